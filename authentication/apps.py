@@ -5,3 +5,7 @@ class AuthenticationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
     verbose_name = "Z Authentication"
+
+    def ready(self):
+        # keep import here, signal handlers need the models to be loaded
+        from authentication import signals  # noqa: F401
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework.authentication import BasicAuthentication
+
+# How long (seconds) a successful Basic verification is reused
+BASIC_AUTH_CACHE_TIMEOUT = getattr(settings, "BASIC_AUTH_CACHE_TIMEOUT", 300)
+
+
+def _digest(purpose: str, value: str) -> str:
+    return salted_hmac(f"authentication.backends.{purpose}", value, algorithm="sha256").hexdigest()
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    HTTP Basic authentication that skips the password hashing for recently verified credentials.
+
+    A successful verification is cached for BASIC_AUTH_CACHE_TIMEOUT seconds
+    under a keyed HMAC of the credentials, so neither the password nor a
+    plain hash of it is ever stored. The cached entry holds the user id and
+    an HMAC of the stored password hash: changing the password changes the
+    hash and invalidates every cached entry of the user, inactive or renamed
+    users are rejected as usual. Failed attempts are never cached.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        key = "auth:basic:" + _digest("credentials", f"{userid}\x00{password}")
+        cached = cache.get(key)
+        if cached is not None:
+            user_pk, fingerprint = cached
+            user = get_user_model()._default_manager.filter(pk=user_pk).first()
+            if (
+                user is not None
+                and user.is_active
+                and user.get_username() == userid
+                and constant_time_compare(fingerprint, _digest("password", user.password))
+            ):
+                return (user, None)
+            cache.delete(key)
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache.set(key, (user.pk, _digest("password", user.password)), BASIC_AUTH_CACHE_TIMEOUT)
+        return (user, auth)
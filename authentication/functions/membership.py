@@ -0,0 +1,134 @@
+import time
+from dataclasses import dataclass, field
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q, QuerySet
+
+from registry.models import ProjectMembership
+
+# Cache shared by all the workers (e.g. Redis) where the memberships are reused across requests. None: loaded
+# once per request. A per-process cache (LocMemCache) must not be used: a revocation would not reach the other workers
+MEMBERSHIP_CACHE = getattr(settings, "MEMBERSHIP_CACHE", None)
+
+# How long (seconds) the memberships of a user are reused across requests
+MEMBERSHIP_CACHE_TIMEOUT = getattr(settings, "MEMBERSHIP_CACHE_TIMEOUT", 300)
+
+
+@dataclass(frozen=True)
+class Memberships:
+    """
+    Projects (with the role) and customers a user can see.
+
+    Superusers are unrestricted. Every check is a dict or set lookup, the
+    querysets are restricted with an indexed IN on the cached ids.
+    """
+
+    unrestricted: bool = False
+    roles: dict = field(default_factory=dict)
+    customers: frozenset = frozenset()
+
+    @property
+    def projects(self):
+        return self.roles.keys()
+
+    @property
+    def key(self) -> str:
+        """Short fingerprint of the scope, for ETags and cache keys."""
+        if self.unrestricted:
+            return "*"
+        roles = ",".join(f"{project}:{role}" for project, role in sorted((str(p), r) for p, r in self.roles.items()))
+        return sha256(roles.encode()).hexdigest()[:16]
+
+    def role(self, project_id):
+        return self.roles.get(project_id)
+
+    def has_project(self, project_id) -> bool:
+        return self.unrestricted or project_id in self.roles
+
+    def has_customer(self, customer_id) -> bool:
+        return self.unrestricted or customer_id in self.customers
+
+    def condition(self, project: str | None = None, customer: str | None = None) -> Q | None:
+        """
+        Filter on the rows of the user's projects (or customers), None if unrestricted.
+
+        `project` / `customer` is the lookup path of the project / customer
+        primary key from the queryset model, e.g. "project" for Deliverable or
+        "id" for Customer.
+        """
+        if self.unrestricted:
+            return None
+        if project is not None:
+            return Q(**{f"{project}__in": list(self.roles)})
+        return Q(**{f"{customer}__in": list(self.customers)})
+
+    def scope(self, queryset: QuerySet, project: str | None = None, customer: str | None = None) -> QuerySet:
+        """Restrict the queryset to the rows of the user's projects (or customers), see condition()."""
+        condition = self.condition(project, customer)
+        return queryset if condition is None else queryset.filter(condition)
+
+
+def _version_key(user_pk):
+    return f"auth:memberships:version:{user_pk}"
+
+
+def _load(user_pk) -> Memberships:
+    rows = list(ProjectMembership.objects.filter(user_id=user_pk).values_list("project_id", "role", "project__customer_id"))
+    return Memberships(
+        roles={project: role for project, role, _ in rows},
+        customers=frozenset(customer for _, _, customer in rows),
+    )
+
+
+def load_memberships(user) -> Memberships:
+    """Memberships of the user, from MEMBERSHIP_CACHE while its version is current."""
+    if not user.is_authenticated:
+        return Memberships()
+    if user.is_superuser:
+        return Memberships(unrestricted=True)
+    if MEMBERSHIP_CACHE is None:
+        return _load(user.pk)
+
+    cache = caches[MEMBERSHIP_CACHE]
+    # the initial version is unique, an evicted version key can never match entries cached before
+    version = cache.get_or_set(_version_key(user.pk), time.time_ns, None)
+    key = f"auth:memberships:{user.pk}:{version}"
+    memberships = cache.get(key)
+    if memberships is None:
+        memberships = _load(user.pk)
+        cache.set(key, memberships, MEMBERSHIP_CACHE_TIMEOUT)
+    return memberships
+
+
+def get_memberships(request) -> Memberships:
+    """Memberships of the user of the request, loaded at most once per request."""
+    user = request.user
+    # stored on the Django request, shared by the DRF request wrappers of the same call
+    request = getattr(request, "_request", request)
+    memberships = getattr(request, "_memberships", None)
+    if memberships is None or memberships[0] != user.pk:
+        memberships = (user.pk, load_memberships(user))
+        request._memberships = memberships
+    return memberships[1]
+
+
+def invalidate_memberships(user_ids):
+    """Make the cached memberships of the users stale once the transaction is committed (the next request reloads them)."""
+    if MEMBERSHIP_CACHE is None:
+        return
+    user_ids = set(user_ids)
+
+    def invalidate():
+        # after the commit: a request reading the memberships before it would cache the old ones with the new version
+        cache = caches[MEMBERSHIP_CACHE]
+        for user_pk in user_ids:
+            try:
+                cache.incr(_version_key(user_pk))
+            except ValueError:
+                # no version yet: nothing cached for the user
+                pass
+
+    transaction.on_commit(invalidate)
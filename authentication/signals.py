@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from authentication.functions.membership import invalidate_memberships
+from registry.models import Project, ProjectMembership
+
+
+@receiver(post_save, sender=ProjectMembership)
+@receiver(post_delete, sender=ProjectMembership)
+def membership_changed(sender, instance: ProjectMembership, **kwargs):
+    invalidate_memberships([instance.user_id])
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance: Project, created, **kwargs):
+    # the project may have been moved to another customer
+    if not created:
+        invalidate_memberships(ProjectMembership.objects.filter(project=instance).values_list("user_id", flat=True))
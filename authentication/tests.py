@@ -1,3 +1,150 @@
-from django.test import TestCase
+from base64 import b64encode
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import hashers
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.test import APITestCase
+
+from authentication.functions import membership
+from authentication.functions.membership import load_memberships
+from authentication.models import CertificateRequest, SSHRootCA
+from registry.models import Company, Customer, Project, ProjectMembership
+from tars.testing import QueryBudgetMixin
+
+
+class AuthenticationQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    """Query budgets of the authentication endpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("developer", email="developer@example.com", password="developer")
+        customer = Customer.objects.create(name="acme", company=Company.objects.create(name="acme", email="info@example.com"))
+        root_ca = SSHRootCA(name="rocket")
+        root_ca.save()
+        cls.project = Project.objects.create(name="rocket", customer=customer, ca_certificate=root_ca)
+        ProjectMembership.objects.create(project=cls.project, user=cls.user, role=ProjectMembership.ProjectMembershipRole.ADMIN)
+
+    def setUp(self):
+        cache.clear()
+
+    def basic(self, password="developer"):
+        return {"HTTP_AUTHORIZATION": "Basic " + b64encode(f"developer:{password}".encode()).decode()}
+
+    def test_token(self):
+        self.client.force_authenticate(self.user)
+        with self.assertMaxQueries(4, "GET /authentication/token/ (new)"):
+            token = self.client.get("/authentication/token/").json()["token"]
+        with self.assertMaxQueries(1, "GET /authentication/token/"):
+            self.assertEqual(self.client.get("/authentication/token/").json()["token"], token)
+
+    def test_access_token(self):
+        # the password is hashed once, then the verification is read from the cache
+        with self.assertMaxQueries(1, "POST /authentication/token/access/ (first)"):
+            self.assertEqual(self.client.post("/authentication/token/access/", **self.basic()).status_code, 200)
+        with self.assertMaxQueries(1, "POST /authentication/token/access/"):
+            self.assertEqual(self.client.post("/authentication/token/access/", **self.basic()).status_code, 200)
+        with self.assertMaxQueries(1, "POST /authentication/token/access/ (wrong password)"):
+            self.assertEqual(self.client.post("/authentication/token/access/", **self.basic("wrong")).status_code, 401)
+
+    def test_certificate(self):
+        self.client.force_authenticate(self.user)
+        with self.assertMaxQueries(8, "GET /authentication/certificate/"):
+            response = self.client.get("/authentication/certificate/", {"project": "rocket@acme"})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(CertificateRequest.objects.filter(user=self.user, project=self.project).exists())
+
+
+class MembershipCacheTest(APITestCase):
+    """Memberships are reused across requests only from a shared cache, and reloaded after every change."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("developer", password="developer")
+        customer = Customer.objects.create(name="acme", company=Company.objects.create(name="acme", email="info@example.com"))
+        cls.rocket = Project.objects.create(name="rocket", customer=customer)
+        cls.satellite = Project.objects.create(name="satellite", customer=customer)
+        ProjectMembership.objects.create(project=cls.rocket, user=cls.user, role=ProjectMembership.ProjectMembershipRole.ADMIN)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_uncached(self):
+        # without a shared cache every request reads the memberships from the database
+        self.assertEqual(set(load_memberships(self.user).projects), {self.rocket.pk})
+        ProjectMembership.objects.filter(user=self.user).delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(set(load_memberships(self.user).projects), set())
+
+    @mock.patch.object(membership, "MEMBERSHIP_CACHE", "default")
+    def test_invalidation(self):
+        self.assertEqual(set(load_memberships(self.user).projects), {self.rocket.pk})
+        with self.assertNumQueries(0):
+            load_memberships(self.user)
+
+        # revoked: stale only until the transaction is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            ProjectMembership.objects.filter(project=self.rocket).get().delete()
+            self.assertEqual(set(load_memberships(self.user).projects), {self.rocket.pk})
+        self.assertEqual(set(load_memberships(self.user).projects), set())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProjectMembership.objects.create(project=self.satellite, user=self.user, role=ProjectMembership.ProjectMembershipRole.DEVELOPER)
+        self.assertEqual(load_memberships(self.user).roles, {self.satellite.pk: ProjectMembership.ProjectMembershipRole.DEVELOPER})
+
+        # a project moved to another customer
+        other = Customer.objects.create(name="globex", company=Company.objects.get(name="acme"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.satellite.customer = other
+            self.satellite.save()
+        self.assertEqual(load_memberships(self.user).customers, {other.pk})
+
+
+class CachedBasicAuthenticationTest(APITestCase):
+    """Basic credentials are hashed once, and the cached verification follows the user."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("developer", password="developer")
+
+    def setUp(self):
+        cache.clear()
+
+    def access(self, password="developer", username="developer"):
+        credentials = b64encode(f"{username}:{password}".encode()).decode()
+        return self.client.post("/authentication/token/access/", HTTP_AUTHORIZATION=f"Basic {credentials}").status_code
+
+    def hashed(self, password="developer", username="developer"):
+        """Status of the request and number of password verifications it ran."""
+        with mock.patch("django.contrib.auth.base_user.check_password", wraps=hashers.check_password) as check_password:
+            status = self.access(password, username)
+        return status, check_password.call_count
+
+    def test_second_request_skips_hasher(self):
+        self.assertEqual(self.hashed(), (200, 1))
+        self.assertEqual(self.hashed(), (200, 0))
+
+    def test_password_change(self):
+        self.assertEqual(self.hashed(), (200, 1))
+        self.user.set_password("changed")
+        self.user.save()
+        self.assertEqual(self.hashed(), (401, 1))
+        self.assertEqual(self.hashed("changed"), (200, 1))
+        self.assertEqual(self.hashed("changed"), (200, 0))
+
+    def test_inactive_and_deleted_users(self):
+        self.assertEqual(self.access(), 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.access(), 401)
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        self.assertEqual(self.access(), 200)
+        User.objects.filter(pk=self.user.pk).delete()
+        self.assertEqual(self.access(), 401)
+
+    def test_wrong_password_not_cached(self):
+        self.assertEqual(self.hashed("wrong"), (401, 1))
+        self.assertEqual(self.hashed("wrong"), (401, 1))
+        self.assertEqual(self.hashed("developer"), (200, 1))
+        # unknown users are rejected every time too
+        self.assertEqual(self.access("developer", "nobody"), 401)
+        self.assertEqual(self.access("developer", "nobody"), 401)
@@ -7,5 +7,6 @@ router = routers.DefaultRouter()
 urlpatterns = [
     path("", include(router.urls)),
     path("certificate/", views.generate_certificate),
-    path('token/', views.get_token)
+    path('token/', views.get_token),
+    path('token/access/', views.get_access_token),
 ]
@@ -1,10 +1,14 @@
 from django.contrib.auth.models import User
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.backends import CachedBasicAuthentication
+from authentication.functions.membership import get_memberships
 
 from authentication.functions.ssh import generate_ssh_credentials
 from registry.models import Project, ProjectMembership
@@ -28,11 +32,12 @@ def generate_certificate(request: Request):
     if root_ca is None:
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
-    membership = ProjectMembership.objects.get(user=user, project=project)
+    # role of the user in the project, from the memberships loaded once per request
+    role = get_memberships(request).role(project.id)
 
     # check if customer has correct permission
-    if (membership.role != ProjectMembership.ProjectMembershipRole.ADMIN and 
-        membership.role != ProjectMembership.ProjectMembershipRole.CUSTOMER):
+    if (role != ProjectMembership.ProjectMembershipRole.ADMIN and 
+        role != ProjectMembership.ProjectMembershipRole.CUSTOMER):
         return Response(status=status.HTTP_401_UNAUTHORIZED)
 
     credentials = generate_ssh_credentials(root_ca, user, project)
@@ -52,3 +57,16 @@ def get_token(request: Request):
     return Response({
         "token": token.key,
     })
+
+
+@api_view(["POST"])
+@authentication_classes([CachedBasicAuthentication])
+@permission_classes([IsAuthenticated])
+def get_access_token(request: Request):
+    # exchange the Basic credentials for a short-lived JWT, scripts then send "Authorization: Bearer <access>"
+    token = AccessToken.for_user(request.user)
+
+    return Response({
+        "access": str(token),
+        "expires_in": int(token.lifetime.total_seconds()),
+    })
@@ -1,3 +1,84 @@
-from django.test import TestCase
+import json
+import os
+import sqlite3
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import fitz
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.test import APITestCase
+
+from tars.testing import QueryBudgetMixin
+
+SIGN_IN = '<form><input name="authenticity_token" value="sign-in-token"></form>'
+HOME = (
+    '<html><head><meta name="csrf-token" content="csrf"></head>'
+    '<body><input name="authenticity_token" value="upload-token"><input name="form_id" value="7"></body></html>'
+)
+TEMPLATE = {"id": 1, "schema": [{"attachment_uuid": "attachment"}]}
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.status_code = 200
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class FakeSession(FakeResponse):
+    """The pages of the e-sign server read by upload_pdf."""
+
+    def __init__(self):
+        super().__init__("")
+
+    def get(self, url):
+        return FakeResponse(SIGN_IN if url.endswith("/sign_in") else HOME)
+
+    def post(self, url, **kwargs):
+        if url.endswith("/templates_upload"):
+            return FakeResponse(f"<template-builder data-template='{json.dumps(TEMPLATE)}'></template-builder>")
+        return FakeResponse("")
+
+
+class EsignQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    """upload_pdf talks to the e-sign server and its SQLite database only: no query on the tars database."""
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user("signer", email="signer@example.com"))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database = os.path.join(directory.name, "esign.sqlite3")
+        with sqlite3.connect(database) as conn:
+            conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+            conn.execute("CREATE TABLE templates (id INTEGER PRIMARY KEY, fields TEXT, submitters TEXT, name TEXT, author_id INTEGER)")
+            conn.execute("INSERT INTO users VALUES (3, 'signer@example.com')")
+            conn.execute("INSERT INTO templates (id) VALUES (1)")
+        self.database = database
+
+        environment = mock.patch.dict(os.environ, {"TARS_USERNAME": "tars", "TARS_PASSWORD": "tars", "TARS_DBPATH": database})
+        environment.start()
+        self.addCleanup(environment.stop)
+        session = mock.patch("esign.views.requests.Session", FakeSession)
+        session.start()
+        self.addCleanup(session.stop)
+
+    def pdf(self, submitters):
+        document = fitz.open()
+        page = document.new_page()
+        for i in range(submitters):
+            page.insert_link({"kind": fitz.LINK_NAMED, "from": fitz.Rect(100, 100 + 40 * i, 200, 120 + 40 * i), "nameddest": f"Submitter{i}"})
+        return SimpleUploadedFile("contract.pdf", document.tobytes(), content_type="application/pdf")
+
+    def test_upload(self):
+        with self.assertMaxQueries(0, "POST /esign/upload"):
+            response = self.client.post("/esign/upload", {"pdf": self.pdf(3), "name": "contract"}, format="multipart")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([submitter["name"] for submitter in response.json()["submitters"]], ["Submitter0", "Submitter1", "Submitter2"])
+        with sqlite3.connect(self.database) as conn:
+            self.assertEqual(conn.execute("SELECT name, author_id FROM templates").fetchone(), ("contract", 3))
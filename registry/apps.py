@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_event_partitions(sender, **kwargs):
+    from registry.partitions import ensure_partitions, is_partitioned
+
+    if is_partitioned():
+        ensure_partitions()
 
 
 class RegistryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'registry'
+
+    def ready(self):
+        # every deploy creates the event partitions of the coming months (registry.partitions)
+        post_migrate.connect(create_event_partitions, sender=self)
@@ -0,0 +1,297 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Func, JSONField, OuterRef, Subquery, Value
+
+from registry.models import Context, ContextChange
+from tars.broadcast import broadcaster
+
+log = logging.getLogger(__name__)
+
+# Broadcaster channel of the committed revisions, watched by the long-poll requests
+CHANNEL = "registry.context"
+
+# Optional PostgreSQL NOTIFY channel: revisions committed by any process wake the watchers of every process
+NOTIFY_CHANNEL = getattr(settings, "CONTEXT_NOTIFY_CHANNEL", None)
+
+
+class VersionConflict(Exception):
+    """The expected versions of some keys are not the stored ones (0 for a missing key)."""
+
+    def __init__(self, versions):
+        super().__init__(versions)
+        self.versions = versions
+
+
+class ChangesPruned(Exception):
+    """The changes after the requested revision have been pruned: reload the keys and follow from `revision`."""
+
+    def __init__(self, revision):
+        super().__init__(revision)
+        self.revision = revision
+
+
+class MergePatch(Func):
+    """
+    value || patch - removed, evaluated by PostgreSQL on the stored row.
+
+    The top level keys of the patch replace the stored ones and the removed
+    keys are dropped (JSON merge patch on the first level); a stored value
+    that is not an object is treated as an empty one.
+    """
+
+    output_field = JSONField()
+    template = "(CASE WHEN jsonb_typeof(%(field)s) = 'object' THEN %(field)s ELSE '{}'::jsonb END || %(patch)s) - %(removed)s::text[]"
+
+    def __init__(self, field, patch, removed):
+        super().__init__(F(field), Value(patch, output_field=JSONField()), Value(removed))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        field, patch, removed = (compiler.compile(expression) for expression in self.get_source_expressions())
+        template = self.template % {"field": field[0], "patch": patch[0], "removed": removed[0]}
+        return template, (*field[1], *field[1], *patch[1], *removed[1])
+
+
+def _revisions(count):
+    """
+    `count` new increasing revisions.
+
+    The transaction gets its id first (the CTE is read before the first
+    nextval): the writers holding lower revisions have lower ids than the
+    changes logged afterwards (see _record).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "WITH xact AS MATERIALIZED (SELECT pg_current_xact_id()) "
+            "SELECT nextval(pg_get_serial_sequence(%s, 'revision')) FROM xact, generate_series(1, %s)",
+            [ContextChange._meta.db_table, count],
+        )
+        return sorted(revision for revision, in cursor.fetchall())
+
+
+def _record(changes):
+    """Log the (revision, key, version) changes and wake the watchers once committed."""
+    # in a savepoint: the rows get a subtransaction id (xmin) assigned after their revisions, read by head()
+    with transaction.atomic():
+        ContextChange.objects.bulk_create(ContextChange(revision=revision, key=key, version=version) for revision, key, version in changes)
+    latest = str(max(revision for revision, _, _ in changes))
+    if NOTIFY_CHANNEL:
+        # delivered by PostgreSQL at commit, to the listeners of every process
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [NOTIFY_CHANNEL, latest])
+    transaction.on_commit(lambda: broadcaster.publish(CHANNEL, "revision", latest))
+
+
+def get_many(keys):
+    """{key: Context} of the stored keys among `keys`, in a single query."""
+    return Context.objects.in_bulk(keys)
+
+
+def put_many(items, create=True):
+    """
+    Store all the (key, value, version) items or none of them.
+
+    `version` is the version the client read (0 if the key must not exist
+    yet) or None to overwrite unconditionally. The rows are locked while
+    the versions are checked, so two concurrent writers of the same
+    version cannot both succeed. Returns the stored Contexts by key and
+    raises VersionConflict with the current versions of the mismatching keys.
+    Without `create`, raises Context.DoesNotExist if a key is missing.
+    """
+    items = {key: (value, version) for key, value, version in items}
+    try:
+        with transaction.atomic():
+            # locked in key order, so two writers of the same keys cannot deadlock
+            stored = Context.objects.select_for_update().order_by("key").in_bulk(list(items))
+            conflicts = {
+                key: stored[key].version if key in stored else 0
+                for key, (_, version) in items.items()
+                if version is not None and version != (stored[key].version if key in stored else 0)
+            }
+            if conflicts:
+                raise VersionConflict(conflicts)
+            if not create and len(stored) < len(items):
+                raise Context.DoesNotExist(sorted(set(items) - set(stored)))
+
+            created = []
+            for (key, (value, _)), revision in zip(items.items(), _revisions(len(items))):
+                if key in stored:
+                    stored[key].value = value
+                    stored[key].version += 1
+                    stored[key].revision = revision
+                else:
+                    created.append(Context(key=key, value=value, version=1, revision=revision))
+            Context.objects.bulk_update([stored[key] for key in stored], ["value", "version", "revision"])
+            Context.objects.bulk_create(created)
+            contexts = {**stored, **{context.key: context for context in created}}
+            _record([(c.revision, c.key, c.version) for c in contexts.values()])
+    except IntegrityError:
+        # a key was created by a concurrent writer after the lock
+        raise VersionConflict(dict(Context.objects.filter(key__in=list(items)).values_list("key", "version")))
+    return contexts
+
+
+def merge(key, patch, version=None):
+    """
+    Apply the JSON merge patch (`None` values remove the key) to the stored value, in the database.
+
+    Concurrent patches of different keys of the value never overwrite each
+    other. With `version`, the patch is applied only to that version.
+    Returns the patched Context, raises Context.DoesNotExist or VersionConflict.
+    """
+    removed = [name for name, value in patch.items() if value is None]
+    patch = {name: value for name, value in patch.items() if value is not None}
+    contexts = Context.objects.filter(key=key)
+    with transaction.atomic():
+        revision, = _revisions(1)
+        updated = (contexts if version is None else contexts.filter(version=version)).update(
+            value=MergePatch("value", patch, removed), version=F("version") + 1, revision=revision
+        )
+        if not updated:
+            current = contexts.values_list("version", flat=True).first()
+            if current is None:
+                raise Context.DoesNotExist(key)
+            raise VersionConflict({key: current})
+        # the row stays locked by the update until the commit
+        merged = contexts.get()
+        _record([(revision, key, merged.version)])
+        return merged
+
+
+def delete(key, version=None):
+    """
+    Delete the key (only at `version` if given).
+
+    Returns False if the key does not exist, raises VersionConflict.
+    """
+    contexts = Context.objects.filter(key=key)
+    with transaction.atomic():
+        deleted, _ = (contexts if version is None else contexts.filter(version=version)).delete()
+        if not deleted:
+            current = contexts.values_list("version", flat=True).first()
+            if current is None:
+                return False
+            raise VersionConflict({key: current})
+        revision, = _revisions(1)
+        _record([(revision, key, 0)])
+    return True
+
+
+def delete_prefix(prefix):
+    """Delete every key starting with `prefix`, returns the number of deleted keys."""
+    with transaction.atomic():
+        # locked first: the keys deleted meanwhile by another writer are skipped, and logged once
+        keys = list(Context.objects.select_for_update().filter(key__startswith=prefix).order_by("key").values_list("key", flat=True))
+        if keys:
+            Context.objects.filter(key__in=keys).delete()
+            _record([(revision, key, 0) for key, revision in zip(keys, _revisions(len(keys)))])
+    return len(keys)
+
+
+def head(since=0):
+    """
+    Revision up to which every change is committed (0 if none), looking at the changes after `since`.
+
+    The writers take their revisions before committing and are not
+    serialized, so they may commit out of order. A change logged after a
+    transaction got its id (xmin above it) may follow a lower revision of
+    that transaction: while it is in progress, the head stops before the
+    change. A long transaction delays the changes logged after it, not the
+    writes; the changes of the current transaction are not held back.
+    """
+    return _bounds(since)[0]
+
+
+def _bounds(since):
+    # (head, last pruned revision or None) in a single query
+    table = ContextChange._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            # transaction ids in progress, 32 bits like xmin, compared modulo 2^32 as PostgreSQL does
+            "WITH running AS (SELECT xip::text::bigint %% 4294967296 AS xid FROM pg_snapshot_xip(pg_current_snapshot()) AS xip) "
+            f"SELECT COALESCE((SELECT min(revision) - 1 FROM {table} AS change WHERE revision > %s AND EXISTS ("
+            "SELECT FROM running WHERE (change.xmin::text::bigint - running.xid + 4294967296) %% 4294967296 BETWEEN 1 AND 2147483647"
+            f")), (SELECT max(revision) FROM {table}), 0), "
+            # the marker left by prune() is the oldest change
+            f"(SELECT CASE WHEN key = '' THEN revision END FROM {table} ORDER BY revision LIMIT 1)",
+            [since],
+        )
+        return cursor.fetchone()
+
+
+def changes(since, prefix=None, key=None, limit=1000):
+    """
+    Changes after revision `since`, of a key or of the keys starting with a prefix.
+
+    Returns (revision, changes): pass `revision` as `since` of the next call,
+    it moves past the changes filtered out as well. The log keeps no values:
+    a change has the stored value while it is the current version of the
+    key, None once overwritten (a later change of the key follows) or
+    deleted. Raises ChangesPruned if the changes after `since` are no
+    longer all in the log (prune()).
+    """
+    latest, pruned = _bounds(since)
+    if pruned is not None and since < pruned:
+        raise ChangesPruned(latest)
+    rows = ContextChange.objects.filter(revision__gt=since, revision__lte=latest).order_by("revision")
+    if key is not None:
+        rows = rows.filter(key=key)
+    elif prefix:
+        rows = rows.filter(key__startswith=prefix)
+    current = Context.objects.filter(key=OuterRef("key"), version=OuterRef("version")).values("value")
+    rows = list(rows.values("revision", "key", "version").annotate(value=Subquery(current, output_field=JSONField()))[:limit])
+    if len(rows) == limit:
+        # truncated: continue from the last returned change
+        latest = rows[-1]["revision"]
+    return max(latest, since), rows
+
+
+def prune(before):
+    """
+    Delete the changes logged before `before`.
+
+    The newest of them stays as a marker with an empty key (keys are never
+    empty): its revision is the last one pruned, so the readers of older
+    revisions get ChangesPruned, and the head never goes back. Returns the
+    number of deleted changes.
+    """
+    pruned = ContextChange.objects.filter(timestamp__lt=before).order_by("-revision").values_list("revision", flat=True).first()
+    if pruned is None:
+        return 0
+    with transaction.atomic():
+        deleted, _ = ContextChange.objects.filter(revision__lt=pruned).delete()
+        marked = ContextChange.objects.filter(revision=pruned).exclude(key="").update(key="", version=0)
+    return deleted + marked
+
+
+def _listen():
+    # one connection per process, LISTENing for the revisions committed by all of them
+    from psycopg import connect, sql
+
+    while True:
+        try:
+            with connect(**connection.get_connection_params(), autocommit=True) as listener:
+                listener.execute(sql.SQL("LISTEN {}").format(sql.Identifier(NOTIFY_CHANNEL)))
+                for notify in listener.notifies():
+                    broadcaster.publish(CHANNEL, "revision", notify.payload)
+        except Exception:
+            log.exception("Context notification listener failed, reconnecting")
+            time.sleep(5)
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def start_listener():
+    """Start the NOTIFY listener thread of the process, if CONTEXT_NOTIFY_CHANNEL is set (idempotent)."""
+    global _listener
+    if not NOTIFY_CHANNEL:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name="context-notify", daemon=True)
+            _listener.start()
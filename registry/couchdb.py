@@ -0,0 +1,490 @@
+"""
+Import of the CouchDB CRM and sales databases into the registry.
+
+The documents are streamed (iter_rows) and mapped to the registry models
+with ids derived from the CouchDB ids (doc_uuid), so importing the same
+documents again updates the rows instead of duplicating them. After a
+full import, Importer.sync() applies only the documents changed since,
+read from the `_changes` feed of each database after its checkpoint.
+"""
+
+import codecs
+import json
+import logging
+import queue
+import threading
+from collections import defaultdict
+from uuid import NAMESPACE_URL, uuid5
+
+import requests
+from django.db import transaction
+from django.db.models import Q, RestrictedError
+from requests.auth import HTTPBasicAuth
+
+from registry.context import get_many, put_many
+from registry.models import Billing, Company, Customer, Membership, MembershipType, Person, Place, Plan, Portfolio
+
+log = logging.getLogger(__name__)
+
+NAMESPACE = uuid5(NAMESPACE_URL, "couchdb")
+
+# Context key of the {"customers": {alias: customer name}, "portfolios": {alias: portfolio id}} maps, and of
+# {"roles": {role document id: [customer id, field, target id]}}, the Customer role set by each role document
+ALIASES_KEY = "couchdb/aliases"
+
+# CouchDB role documents ({"role", "of", "in"}) stored as Customer relations
+ROLE_FIELDS = {
+    "hq_place": "hq_place",
+    "headquarter": "hq_place",
+    "bu_place": "bu_place",
+    "operative": "bu_place",
+    "team_leader": "team_leader",
+    "purchase_manager": "purchase_manager",
+    "engineering_director": "engineering_director",
+    "marketing_director": "marketing_director",
+}
+PLACE_FIELDS = {"hq_place", "bu_place"}
+
+CRM_TYPES = {"person", "place", "role"}
+SALES_TYPES = {"portfolio", "billing", "plan", "membership"}
+
+
+def doc_uuid(doc_id, kind=""):
+    """Registry id of the CouchDB document (of the `kind` row, when a document is stored in more than one)."""
+    return uuid5(NAMESPACE, f"{kind}/{doc_id}" if kind else doc_id)
+
+
+def iter_rows(chunks, key="rows"):
+    """
+    Rows of a CouchDB view response (`{"total_rows": .., "rows": [...]}`) decoded one at a time.
+
+    `key` is the name of the array (`results` for the `_changes` feed).
+
+    `chunks` are the bytes of the body as they are received: only the
+    current row and the unread part of the chunk are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer, position, started = "", 0, False
+    for chunk in chunks:
+        buffer = buffer[position:] + text.decode(chunk)
+        position = 0
+        if not started:
+            start = buffer.find(f'"{key}"')
+            start = buffer.find("[", start) if start >= 0 else -1
+            if start < 0:
+                continue
+            position, started = start + 1, True
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+            if buffer[position] == "]":
+                return
+            try:
+                row, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the row continues in the next chunk
+                break
+            yield row
+    raise ValueError("Truncated CouchDB response")
+
+
+class CouchDB:
+    """Streaming reader of a CouchDB server."""
+
+    def __init__(self, endpoint, username, password, timeout=60, chunk_size=65536):
+        self.endpoint = endpoint.rstrip("/") + "/"
+        self.auth = HTTPBasicAuth(username, password)
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+    def rows(self, path, params=None, key="rows"):
+        with requests.get(self.endpoint + path, params=params, auth=self.auth, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            yield from iter_rows(response.iter_content(self.chunk_size), key)
+
+    def update_seq(self, database):
+        """Sequence of the last change of the database."""
+        with requests.get(self.endpoint + database, auth=self.auth, timeout=self.timeout) as response:
+            response.raise_for_status()
+            return response.json()["update_seq"]
+
+    def all_docs(self, database):
+        """Documents of the database, design documents excluded."""
+        for row in self.rows(f"{database}/_all_docs", {"include_docs": "true"}):
+            doc = row.get("doc")
+            if doc is not None and not doc["_id"].startswith("_design/"):
+                yield doc
+
+    def changes(self, database, since=0, limit=1000):
+        """The next `limit` changes after the sequence `since` ({"seq", "id", "deleted", "doc"}), in order."""
+        params = {"since": since, "limit": limit, "include_docs": "true", "style": "main_only"}
+        return self.rows(f"{database}/_changes", params, key="results")
+
+
+def group_docs(docs, types):
+    """{type: [doc]} of the documents of the given types, the others are dropped while streaming."""
+    grouped = defaultdict(list)
+    for doc in docs:
+        if doc.get("type") in types:
+            grouped[doc["type"]].append(doc)
+    return grouped
+
+
+def batch_docs(docs, types, size):
+    """{type: [doc]} groups of at most `size` documents of the given types, yielded while the documents are streamed."""
+    batch, count = defaultdict(list), 0
+    for doc in docs:
+        if doc.get("type") in types:
+            batch[doc["type"]].append(doc)
+            count += 1
+            if count == size:
+                yield batch
+                batch, count = defaultdict(list), 0
+    if count:
+        yield batch
+
+
+class Prefetch:
+    """
+    Iterator over `docs` read by a thread, at most `size` documents ahead of the consumer.
+
+    The reading starts at once: a database is downloaded while another one
+    is written, and only the bounded queue is held in memory. The errors of
+    the reading thread are raised by the consumer; close() stops the thread.
+    """
+
+    _done = object()
+
+    def __init__(self, docs, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.read, args=(docs,), daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(self, docs):
+        try:
+            for doc in docs:
+                if not self.put(doc):
+                    return
+        except Exception as error:
+            self.put(error)
+        else:
+            self.put(self._done)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.queue.get()
+        if item is self._done:
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def checkpoint_key(database):
+    """Context key of the last `_changes` sequence applied from the database."""
+    return f"couchdb/{database}/seq"
+
+
+class Importer:
+    """
+    Writes the grouped CouchDB documents with batched upserts.
+
+    CRM people with aliases are organizations: each one is stored as a
+    Company and as a Customer named after its first alias. The aliases of
+    customers and portfolios are not registry fields: they are resolved in
+    memory and kept in Context (ALIASES_KEY) for the incremental syncs,
+    with the Customer role set by each role document.
+
+    With `full`, the documents are the whole databases (import_stream): the
+    Customer roles missing from them are cleared and the imported rows of
+    the documents not seen are deleted (delete_unseen). Otherwise only the
+    given changes are applied, the references to unchanged documents are
+    resolved from the rows already imported.
+    """
+
+    def __init__(self, batch_size=1000, full=False):
+        self.batch_size = batch_size
+        self.full = full
+        self.counts = defaultdict(int)
+        # {model: ids written}, kept by full imports only
+        self.seen = defaultdict(set)
+        stored = None if full else get_many([ALIASES_KEY]).get(ALIASES_KEY)
+        self.aliases = stored.value if stored else {"customers": {}, "portfolios": {}}
+        self.aliases.setdefault("roles", {})
+
+    def upsert(self, model, objects, unique_fields=("id",), update_fields=None):
+        if not objects:
+            return objects
+        if update_fields is None:
+            update_fields = [field.name for field in model._meta.concrete_fields if not field.primary_key and field.name not in unique_fields]
+        model.objects.bulk_create(
+            objects, batch_size=self.batch_size, update_conflicts=True, unique_fields=unique_fields, update_fields=update_fields
+        )
+        self.counts[model._meta.verbose_name_plural] += len(objects)
+        if list(unique_fields) != ["id"]:
+            # the rows matched on another (single) unique field keep their id: the objects get it back
+            attname = model._meta.get_field(unique_fields[0]).attname
+            ids = dict(model.objects.filter(**{f"{attname}__in": [getattr(obj, attname) for obj in objects]}).values_list(attname, "pk"))
+            for obj in objects:
+                obj.pk = ids[getattr(obj, attname)]
+        if self.full:
+            self.seen[model].update(obj.pk for obj in objects)
+        return objects
+
+    def add_aliases(self, kind, aliases, target, owner):
+        known = self.aliases[kind]
+        for alias in aliases:
+            if known.get(alias, target) != target:
+                log.warning("Alias %s of %s already used by %s", alias, owner, known[alias])
+            else:
+                known[alias] = target
+
+    def import_docs(self, docs):
+        """Apply the documents grouped by type (group_docs), CRM first: the memberships refer to its customers."""
+        self.import_crm(docs)
+        self.import_sales(docs)
+
+    def import_stream(self, docs, types):
+        """
+        Apply the documents of a whole database while they are streamed, `batch_size` at a time.
+
+        Roles and memberships refer to documents that may come later in the
+        stream: only those are kept, and applied once the database is read.
+        Returns the number of documents applied.
+        """
+        deferred, count = defaultdict(list), 0
+        for batch in batch_docs(docs, types, self.batch_size):
+            count += sum(map(len, batch.values()))
+            for kind in ("role", "membership"):
+                deferred[kind] += batch.pop(kind, [])
+            self.import_people(batch)
+            self.import_offers(batch)
+        self.import_roles(deferred["role"])
+        self.import_memberships(deferred["membership"])
+        return count
+
+    def save_aliases(self):
+        put_many([(ALIASES_KEY, self.aliases, None)])
+
+    def import_crm(self, docs):
+        self.import_people(docs)
+        self.import_roles(docs["role"])
+
+    def import_people(self, docs):
+        """Upsert the people, places and organizations."""
+        people, companies, customers = [], [], {}
+        for doc in docs["person"]:
+            aliases = doc.get("aliases") or []
+            if not aliases:
+                people.append(Person(id=doc_uuid(doc["_id"]), name=doc["name"], phone=doc.get("phone"), email=doc.get("email") or ""))
+                continue
+            company = Company(id=doc_uuid(doc["_id"]), name=doc["name"], vat=doc.get("vat"), phone=doc.get("phone"), email=doc.get("email") or "")
+            companies.append(company)
+            customers[doc["_id"]] = Customer(id=doc_uuid(doc["_id"], "customer"), name=aliases[0], company=company)
+            self.add_aliases("customers", aliases, aliases[0], doc["name"])
+
+        places = [
+            Place(
+                id=doc_uuid(doc["_id"]),
+                address=doc["address"],
+                zip_code=doc["zipCode"],
+                city=doc["city"],
+                province=doc["province"],
+                country_code=doc["countryCode"],
+                notes=doc.get("notes"),
+            )
+            for doc in docs["place"]
+        ]
+
+        self.upsert(Person, people)
+        self.upsert(Place, places)
+        self.upsert(Company, companies)
+        # existing customers are matched by name and keep their id (and their projects); the roles are written by
+        # import_roles, a full import clears them first
+        update_fields = ["company", "updated_at"] + (sorted(set(ROLE_FIELDS.values())) if self.full else [])
+        self.upsert(Customer, list(customers.values()), unique_fields=["name"], update_fields=update_fields)
+
+    def import_roles(self, roles):
+        # the roles set before by the changed documents are cleared, then the customers are read with the new state
+        self.clear_roles(doc["_id"] for doc in roles)
+        # the organizations are found by their company
+        companies = {doc_uuid(doc["in"]) for doc in roles}
+        customers = {customer.company_id: customer for customer in Customer.objects.filter(company_id__in=companies)}
+        targets = {doc_uuid(doc["of"]) for doc in roles}
+        existing = set(Place.objects.filter(pk__in=targets).values_list("pk", flat=True))
+        existing_people = set(Person.objects.filter(pk__in=targets).values_list("pk", flat=True))
+
+        fields = set(ROLE_FIELDS.values())
+        changed = {}
+        for doc in roles:
+            field = ROLE_FIELDS.get(doc["role"].strip().lower().replace(" ", "_"))
+            target = doc_uuid(doc["of"])
+            customer = customers.get(doc_uuid(doc["in"]))
+            if field is None or customer is None or target not in (existing if field in PLACE_FIELDS else existing_people):
+                log.warning("Role %s of %s in %s skipped", doc["role"], doc["of"], doc["in"])
+                self.counts["skipped roles"] += 1
+                continue
+            setattr(customer, f"{field}_id", target)
+            changed[customer.pk] = customer
+            self.aliases["roles"][doc["_id"]] = [str(customer.pk), field, str(target)]
+        Customer.objects.bulk_update(list(changed.values()), sorted(fields), batch_size=self.batch_size)
+
+    def clear_roles(self, doc_ids):
+        """
+        Clear the Customer roles set by the role documents, which are forgotten.
+
+        A role is cleared only if it still has the target set by the document,
+        and no other role document sets the same one.
+        """
+        roles = self.aliases["roles"]
+        cleared = [roles.pop(doc_id) for doc_id in doc_ids if doc_id in roles]
+        kept = {tuple(role) for role in roles.values()}
+        by_field = defaultdict(Q)
+        for customer, field, target in cleared:
+            if (customer, field, target) not in kept:
+                by_field[field] |= Q(pk=customer, **{f"{field}_id": target})
+        for field, condition in by_field.items():
+            Customer.objects.filter(condition).update(**{field: None})
+
+    def import_sales(self, docs):
+        self.import_offers(docs)
+        self.import_memberships(docs["membership"])
+
+    def import_offers(self, docs):
+        portfolios = []
+        for doc in docs["portfolio"]:
+            portfolio = Portfolio(id=doc_uuid(doc["_id"]), name=doc["name"], brand=doc["brand"])
+            portfolios.append(portfolio)
+            self.add_aliases("portfolios", doc.get("aliases") or [], str(portfolio.id), doc["name"])
+
+        billings = [Billing(id=doc_uuid(doc["_id"]), alias=doc["alias"], description=doc["description"]) for doc in docs["billing"]]
+        plans = [
+            Plan(id=doc_uuid(doc["_id"]), name=doc["name"], category=doc["category"], discounts=doc["discounts"], unit=doc["unit"])
+            for doc in docs["plan"]
+        ]
+        self.upsert(Portfolio, portfolios)
+        self.upsert(Billing, billings)
+        self.upsert(Plan, plans, update_fields=["unit", "name", "category", "discounts"])
+        # creation is auto_now_add, overwritten by the insert: the CouchDB value is written by an update
+        for plan, doc in zip(plans, docs["plan"]):
+            plan.creation = doc["creation"]
+        Plan.objects.bulk_update(plans, ["creation"], batch_size=self.batch_size)
+
+    def import_memberships(self, memberships):
+        if not memberships:
+            return
+        MembershipType.objects.bulk_create([MembershipType(name=name) for name in {doc["membership"] for doc in memberships}], ignore_conflicts=True)
+        # one query per referenced model, the rows written above included
+        names = {self.aliases["customers"].get(doc["of"], doc["of"]) for doc in memberships}
+        customer_ids = dict(Customer.objects.filter(name__in=names).values_list("name", "id"))
+        billing_ids = dict(Billing.objects.filter(alias__in={doc["billing"] for doc in memberships}).values_list("alias", "id"))
+        plan_ids = set(Plan.objects.filter(pk__in={doc_uuid(doc["in"]) for doc in memberships}).values_list("pk", flat=True))
+        portfolio_ids = {str(pk) for pk in Portfolio.objects.filter(pk__in=set(self.aliases["portfolios"].values())).values_list("pk", flat=True)}
+
+        rows = []
+        for doc in memberships:
+            customer = customer_ids.get(self.aliases["customers"].get(doc["of"], doc["of"]))
+            portfolio = self.aliases["portfolios"].get(doc["portfolio"])
+            billing = billing_ids.get(doc["billing"])
+            plan = doc_uuid(doc["in"])
+            if customer is None or portfolio not in portfolio_ids or billing is None or plan not in plan_ids:
+                log.warning("Membership %s of %s skipped: unknown customer, portfolio, plan or billing", doc["_id"], doc["of"])
+                self.counts["skipped memberships"] += 1
+                continue
+            rows.append(Membership(id=doc_uuid(doc["_id"]), of_id=customer, portfolio_id=portfolio, plan_id=plan, membership_id=doc["membership"], billing_id=billing))
+        # a customer has a single membership: the imported one replaces it
+        self.upsert(Membership, rows, unique_fields=["of"])
+
+    def delete(self, doc_ids):
+        """
+        Delete the rows of the deleted CouchDB documents.
+
+        Rows still referenced (a Company of a Customer, a Plan of another
+        membership...) are kept; the roles of the deleted people and places
+        are cleared, and so are the roles set by the deleted role documents.
+        """
+        self.clear_roles(doc_ids)
+        self.delete_rows([doc_uuid(doc_id) for doc_id in doc_ids], (Membership, Plan, Portfolio, Billing, Person, Place, Company))
+
+    def delete_unseen(self):
+        """
+        Delete the imported rows of the documents missing from a full import.
+
+        The imported rows are the ones with an id derived from a CouchDB id
+        (version 5 UUIDs), the rows created in the registry are kept. So are
+        the rows still referenced, customers with projects included.
+        """
+        models = (Membership, Customer, Plan, Portfolio, Billing, Person, Place, Company)
+        ids = []
+        for model in models:
+            ids += [pk for pk in model.objects.values_list("pk", flat=True).iterator() if pk.version == 5 and pk not in self.seen[model]]
+        self.delete_rows(ids, models)
+
+    def delete_rows(self, ids, models):
+        """Delete the rows of `models` with the given ids, the rows still referenced are kept."""
+        if not ids:
+            return
+        for field in ROLE_FIELDS.values():
+            Customer.objects.filter(**{f"{field}_id__in": ids}).update(**{field: None})
+        for model in models:
+            rows = model.objects.filter(pk__in=ids)
+            try:
+                with transaction.atomic():
+                    deleted, _ = rows.delete()
+            except RestrictedError:
+                # one referenced row blocks the whole statement: the others are deleted one at a time
+                deleted = 0
+                for pk in rows.values_list("pk", flat=True):
+                    try:
+                        with transaction.atomic():
+                            deleted += model.objects.filter(pk=pk).delete()[0]
+                    except RestrictedError as error:
+                        log.warning("%s %s kept, still referenced: %s", model._meta.verbose_name, pk, error)
+            if deleted:
+                self.counts[f"deleted {model._meta.verbose_name_plural}"] += deleted
+
+    def sync(self, couchdb, database, limit=1000):
+        """
+        Apply the next `limit` changes of the database after its checkpoint.
+
+        The changes and the new checkpoint are committed together: the
+        checkpoint is written with the version read, so two concurrent
+        syncs of the same database cannot both apply a batch (VersionConflict).
+        Returns the number of changes read (fewer than `limit` once caught up).
+        """
+        key = checkpoint_key(database)
+        stored = get_many([key]).get(key)
+        latest, seq, count = {}, None, 0
+        for row in couchdb.changes(database, stored.value["seq"] if stored else 0, limit):
+            seq, count = row["seq"], count + 1
+            # only the last change of a document is applied (an upsert cannot write a row twice)
+            latest.pop(row["id"], None)
+            if not row["id"].startswith("_design/"):
+                latest[row["id"]] = row
+        if seq is None:
+            return 0
+        with transaction.atomic():
+            self.import_docs(group_docs((row["doc"] for row in latest.values() if not row.get("deleted")), CRM_TYPES | SALES_TYPES))
+            self.delete([doc_id for doc_id, row in latest.items() if row.get("deleted")])
+            self.save_aliases()
+            put_many([(key, {"seq": seq}, stored.version if stored else 0)])
+        return count
@@ -0,0 +1,46 @@
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+
+
+class FieldFilter(BaseFilterBackend):
+    """
+    Exact match filters declared by the view as `filter_fields = {"param": "lookup"}`.
+
+    e.g. {"city": "city__iexact"} turns ?city=padova into
+    .filter(city__iexact="padova"); empty parameters are ignored.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        filters = {
+            lookup: request.query_params[param]
+            for param, lookup in getattr(view, "filter_fields", {}).items()
+            if request.query_params.get(param)
+        }
+        return queryset.filter(**filters) if filters else queryset
+
+
+class PrefixFilter(BaseFilterBackend):
+    """
+    ?prefix= filter on the `prefix_field` of the view, e.g. all the keys of a namespace.
+
+    Compiled to field LIKE 'prefix%' (wildcards escaped), a range scan of
+    a varchar_pattern_ops index on the field.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        prefix = request.query_params.get("prefix")
+        if not prefix:
+            return queryset
+        return queryset.filter(**{f"{view.prefix_field}__startswith": prefix})
+
+
+class Search(SearchFilter):
+    """
+    ?q= search on the `search_fields` of the view.
+
+    Every term must match one of the fields; declare the fields with the "^"
+    prefix (istartswith, compiled to UPPER(field) LIKE 'TERM%') so the
+    search is served by the UPPER(field) text_pattern_ops indexes of the
+    models instead of a full table scan.
+    """
+
+    search_param = "q"
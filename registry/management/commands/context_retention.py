@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from registry import context
+
+
+class Command(BaseCommand):
+    help = "Delete the context changes older than the retention"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=getattr(settings, "CONTEXT_CHANGE_RETENTION_DAYS", 7),
+            help="days of context changes kept (default CONTEXT_CHANGE_RETENTION_DAYS or 7)",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 1:
+            raise CommandError("--days must be at least 1")
+        before = datetime.now(timezone.utc) - timedelta(days=options["days"])
+        deleted = context.prune(before)
+        self.stdout.write(self.style.SUCCESS(f"{deleted:,} context changes before {before:%Y-%m-%d %H:%M} deleted"))
@@ -0,0 +1,50 @@
+import os
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from registry.models import Event
+from registry.partitions import add_months, drop_partitions, ensure_partitions, is_partitioned, month_start, partitions
+from registry.signals import events_dropped
+
+
+class Command(BaseCommand):
+    help = "Create the coming event partitions and drop (or archive) the partitions older than the retention"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            type=int,
+            default=getattr(settings, "EVENT_RETENTION_MONTHS", 24),
+            help="months of events kept, the current one included (default EVENT_RETENTION_MONTHS or 24)",
+        )
+        parser.add_argument("--archive", metavar="DIRECTORY", help="write every dropped partition to DIRECTORY/<partition>.csv.gz first")
+        parser.add_argument("--dry-run", action="store_true", help="list the partitions that would be dropped")
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("registry_event is not partitioned, apply the registry migrations first")
+        if options["months"] < 1:
+            raise CommandError("--months must be at least 1")
+        if options["archive"] and not os.path.isdir(options["archive"]):
+            raise CommandError(f"{options['archive']} is not a directory")
+
+        before = add_months(month_start(datetime.now(timezone.utc)), 1 - options["months"])
+        if options["dry_run"]:
+            for start, name in partitions().items():
+                if add_months(start, 1) <= before:
+                    self.stdout.write(f"{name} would be dropped")
+            return
+
+        for name in ensure_partitions():
+            self.stdout.write(f"{name} created")
+        oldest = min(partitions(), default=before)
+        dropped, deleted = drop_partitions(before, options["archive"])
+        if dropped or deleted:
+            events_dropped.send(sender=Event, since=None if deleted else oldest, before=before)
+        for name, rows in dropped.items():
+            self.stdout.write(f"{name} dropped ({rows:,} events{', archived' if options['archive'] else ''})")
+        if deleted:
+            self.stdout.write(f"{deleted:,} events before {before:%Y-%m-%d} deleted from the default partition")
+        self.stdout.write(self.style.SUCCESS(f"Events before {before:%Y-%m-%d} removed"))
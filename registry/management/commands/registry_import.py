@@ -1,39 +1,17 @@
+import logging
+import resource
+import time
+
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction, connection
+from django.db import transaction
 
 import requests
 
-from requests.auth import HTTPBasicAuth
+from registry.context import VersionConflict, put_many
+from registry.couchdb import CRM_TYPES, SALES_TYPES, CouchDB, Importer, Prefetch, checkpoint_key
 
-from registry.models import (
-    Person,
-    PersonRole,
-    Place,
-    PlaceRole,
-    RoleType,
-    Membership,
-    MembershipType,
-    Billing,
-    Plan,
-    PersonAlias,
-    Portfolio,
-    PortfolioAlias
-)
+log = logging.getLogger(__name__)
 
-TABLES = [
-    "registry_personalias",
-    "registry_billing",
-    "registry_membership",
-    "registry_membershiptype",
-    "registry_person",
-    "registry_personrole",
-    "registry_place",
-    "registry_placerole",
-    "registry_plan",
-    "registry_roletype",
-    "registry_portfolio",
-    "registry_portfolioalias"
-]
 
 class Command(BaseCommand):
     help = "Import data from CouchDb"
@@ -49,117 +27,77 @@ class Command(BaseCommand):
             help="CouchDb endpoint",
             default="https://couchdb.tinga.io/",
         )
+        parser.add_argument("--crm", help="CRM database", default="crm-gqyzi5uqadltgest")
+        parser.add_argument("--sales", help="sales database", default="sales-tgayvtjqpfkf1h")
+        parser.add_argument("--batch", type=int, default=1000, help="rows per INSERT (default 1000)")
+        parser.add_argument(
+            "--sync", action="store_true", help="apply only the changes since the last import or sync (CouchDB _changes feed)"
+        )
+        parser.add_argument("--follow", action="store_true", help="with --sync, keep applying the new changes until interrupted")
+        parser.add_argument("--interval", type=float, default=10, help="seconds between the polls of --follow (default 10)")
+        parser.add_argument("--limit", type=int, default=1000, help="changes applied per transaction by --sync (default 1000)")
 
-    @transaction.atomic
     def handle(self, *args, **options):
-        auth = HTTPBasicAuth(options["username"], options["password"])
-        base_url = options["endpoint"]
-
-        with connection.cursor() as cursor:
-            for table in TABLES:
-                cursor.execute(f"DELETE FROM {table}")
-
-        crm_url = base_url + "crm-gqyzi5uqadltgest/_all_docs?include_docs=true"
-        with requests.get(crm_url, auth=auth) as response:
-            crm = list(map(lambda x: x["doc"], response.json()["rows"]))
-
-            people = filter(lambda doc: doc.get("type") == "person", crm)
-            new_people = {}
-            for person in people:
-                new_person = Person.objects.create(
-                    name=person["name"],
-                    vat=person.get("vat"),
-                    phone=person["phone"],
-                    email=person["email"],
-                )
-                if person["name"] == "LEAD_NAME":
-                    lead = new_person
-                new_people[person["_id"]] = new_person
-                for alias in person["aliases"]:
-                    try:
-                        other_alias = PersonAlias.objects.get(name=alias)
-                        print(
-                            f"warning: alias {alias} for {new_person} already exists in {other_alias.person}"
-                        )
-                    except PersonAlias.DoesNotExist:
-                        print(f"{alias} -> {new_person}")
-                        PersonAlias.objects.create(name=alias, person=new_person)
-
-            places = filter(lambda doc: doc.get("type") == "place", crm)
-            new_places = {}
-            for place in places:
-                new_place = Place.objects.create(
-                    address=place["address"],
-                    zip_code=place["zipCode"],
-                    city=place["city"],
-                    province=place["province"],
-                    country_code=place["countryCode"],
-                    notes=place.get("notes"),
-                )
-                new_places[place["_id"]] = new_place
-
-            roles = filter(lambda doc: doc.get("type") == "role", crm)
-            for role in roles:
-                role_type, _ = RoleType.objects.get_or_create(name=role["role"])
-                if role["of"] in new_places:
-                    PlaceRole.objects.create(
-                        place=new_places[role["of"]],
-                        role=role_type,
-                        in_person=new_people[role["in"]],
-                    )
-                else:
-                    PersonRole.objects.create(
-                        person=new_people[role["of"]],
-                        role=role_type,
-                        in_person=new_people[role["in"]],
-                    )
-
-        sales_url = base_url + "sales-tgayvtjqpfkf1h/_all_docs?include_docs=true"
-        with requests.get(sales_url, auth=auth) as response:
-            sales = list(map(lambda x: x["doc"], response.json()["rows"]))
-
-            portfolio_by_alias = {}
-            portfolios = filter(lambda doc: doc.get("type") == "portfolio", sales)
-            for p in portfolios:
-                portfolio = Portfolio.objects.create(name=p["name"], brand=p["brand"])
-                for alias in p["aliases"]:
-                    portfolio_by_alias[alias] = PortfolioAlias.objects.create(portfolio=portfolio, name=alias)
-                     
-            billings = filter(lambda doc: doc.get("type") == "billing", sales)
-            for billing in billings:
-                Billing.objects.create(
-                    alias=billing["alias"], description=billing["description"]
-                )
-
-            plans = filter(lambda doc: doc.get("type") == "plan", sales)
-            new_plans = {}
-            for plan in plans:
-                new_plan = Plan.objects.create(
-                    name=plan["name"],
-                    category=plan["category"],
-                    discounts=plan["discounts"],
-                    unit=plan["unit"],
-                    creation=plan["creation"]
-                )
-                new_plans[plan["_id"]] = new_plan
-
-            memberships = filter(lambda doc: doc.get("type") == "membership", sales)
-            for membership in memberships:
-                membership_type, _ = MembershipType.objects.get_or_create(
-                    name=membership["membership"]
-                )
-
-                try:
-                    alias = PersonAlias.objects.get(name=membership["of"])
-                except PersonAlias.DoesNotExist:
-                    print(f"alias {alias} not found! Creating to LEAD")
-                    alias = PersonAlias.objects.create(name=membership["of"], person=lead)
-
-                Membership.objects.create(
-                    of=alias,
-                    portfolio=portfolio_by_alias[membership["portfolio"]],
-                    plan=new_plans[membership["in"]],
-                    membership=membership_type,
-                    billing=Billing.objects.get(alias=membership["billing"]),
-                )
-
+        couchdb = CouchDB(options["endpoint"], options["username"], options["password"])
+        if options["sync"]:
+            self.sync(couchdb, options)
+        elif options["follow"]:
+            raise CommandError("--follow requires --sync")
+        else:
+            self.full_import(couchdb, options)
+
+    def sync(self, couchdb, options):
+        # CRM first: the memberships refer to its customers
+        databases = [options["crm"], options["sales"]]
+        while True:
+            start, applied = time.perf_counter(), 0
+            try:
+                for database in databases:
+                    while True:
+                        importer = Importer(options["batch"])
+                        count = importer.sync(couchdb, database, options["limit"])
+                        if count:
+                            applied += count
+                            changes = ", ".join(f"{count:,} {name}" for name, count in importer.counts.items())
+                            self.stdout.write(f"{database}: {count:,} changes applied ({changes})")
+                        if count < options["limit"]:
+                            break
+            except (requests.RequestException, ValueError, VersionConflict) as error:
+                if not options["follow"]:
+                    raise CommandError(f"CouchDB sync failed: {error}")
+                log.warning("CouchDB sync failed, retrying: %s", error)
+            if not options["follow"]:
+                self.stdout.write(self.style.SUCCESS(f"{applied:,} changes applied in {time.perf_counter() - start:.1f} s"))
+                return
+            time.sleep(options["interval"])
+
+    def full_import(self, couchdb, options):
+        start = time.perf_counter()
+        importer = Importer(options["batch"], full=True)
+        # read first: the changes made during the download are applied again by the next sync
+        try:
+            seqs = {database: couchdb.update_seq(database) for database in (options["crm"], options["sales"])}
+        except (requests.RequestException, ValueError) as error:
+            raise CommandError(f"CouchDB import failed: {error}")
+        # the sales database is downloaded while the CRM is written, at most ten batches ahead
+        sales = Prefetch(couchdb.all_docs(options["sales"]), 10 * options["batch"])
+        try:
+            with transaction.atomic():
+                # CRM first: the memberships refer to its customers. Each batch is written while the database is read
+                for database, docs, types in ((options["crm"], couchdb.all_docs(options["crm"]), CRM_TYPES), (options["sales"], sales, SALES_TYPES)):
+                    database_start = time.perf_counter()
+                    count = importer.import_stream(docs, types)
+                    self.stdout.write(f"{database}: {count:,} documents written in {time.perf_counter() - database_start:.1f} s")
+                importer.delete_unseen()
+                importer.save_aliases()
+                put_many([(checkpoint_key(database), {"seq": seq}, None) for database, seq in seqs.items()])
+        except (requests.RequestException, ValueError) as error:
+            raise CommandError(f"CouchDB import failed: {error}")
+        finally:
+            sales.close()
+
+        for name, count in importer.counts.items():
+            self.stdout.write(f"{count:,} {name}")
+        # ru_maxrss is in KiB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(self.style.SUCCESS(f"Imported in {time.perf_counter() - start:.1f} s, peak memory {peak:.0f} MiB"))
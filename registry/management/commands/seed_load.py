@@ -0,0 +1,239 @@
+import random
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from authentication.functions.membership import invalidate_memberships
+from registry.models import (
+    Company,
+    Customer,
+    Deliverable,
+    Event,
+    Person,
+    Place,
+    Project,
+    ProjectMembership,
+)
+from registry.signals import deliverables_deleting, deliverables_loaded
+
+STAGES = ["delivery", "staging", "production"]
+EVENT_TYPES = ["build", "build", "build", "deploy", "test"]
+CITIES = [("Padova", "PD", "IT"), ("Milano", "MI", "IT"), ("Torino", "TO", "IT"), ("Paris", "75", "FR"), ("Berlin", "BE", "DE")]
+ROLES = list(ProjectMembership.ProjectMembershipRole)
+
+# Columns written by COPY into registry_event, in order
+EVENT_COLUMNS = ["id", "deliverable_id", "outcome", "timestamp", "type", "stage", "version", "source_code_uri", "updated_at"]
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic registry (customers, projects, deliverables, events) for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=1000, help="number of customers (default 1000)")
+        parser.add_argument("--projects", type=float, default=3, help="mean projects per customer (default 3)")
+        parser.add_argument("--deliverables", type=float, default=8, help="mean deliverables per project (default 8)")
+        parser.add_argument("--events", type=float, default=100, help="mean events per deliverable (default 100)")
+        parser.add_argument("--users", type=int, default=200, help="users the project memberships are drawn from (default 200)")
+        parser.add_argument("--members", type=float, default=3, help="mean members per project (default 3)")
+        parser.add_argument("--days", type=int, default=365, help="events are spread over the last N days (default 365)")
+        parser.add_argument(
+            "--distribution",
+            choices=["uniform", "skewed"],
+            default="skewed",
+            help="sizes around the mean: uniform, or skewed (Pareto: few very large customers, projects and deliverables)",
+        )
+        parser.add_argument("--prefix", default="seed", help="prefix of the generated names (default seed)")
+        parser.add_argument("--seed", type=int, default=None, help="random seed, for reproducible data sets")
+        parser.add_argument("--batch", type=int, default=200, help="customers written per transaction (default 200)")
+        parser.add_argument("--no-copy", action="store_true", help="insert the events with bulk_create instead of COPY")
+        parser.add_argument("--delete", action="store_true", help="delete the data set generated with --prefix instead")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.prefix = options["prefix"]
+        self.random = random.Random(options["seed"])
+        self.now = timezone.now()
+        if options["delete"]:
+            return self.delete()
+        if Customer.objects.filter(name__startswith=f"{self.prefix}-").exists():
+            raise CommandError(f"Customers named {self.prefix}-* already exist, choose another --prefix")
+        if len(self.prefix) > 15:
+            raise CommandError("The prefix can be at most 15 characters long")
+
+        start = time.perf_counter()
+        self.counts = dict.fromkeys(["customers", "projects", "memberships", "deliverables", "events"], 0)
+        users = self.create_users(options["users"])
+        for first in range(0, options["customers"], options["batch"]):
+            with transaction.atomic():
+                self.create_batch(range(first, min(first + options["batch"], options["customers"])), users)
+            elapsed = time.perf_counter() - start
+            rows = sum(self.counts.values())
+            self.stdout.write(f"{self.counts['customers']} customers, {rows:,} rows, {elapsed:.1f} s ({rows / elapsed:,.0f} rows/s)")
+
+        invalidate_memberships([user.pk for user in users])
+        self.stdout.write(self.style.SUCCESS(", ".join(f"{count:,} {name}" for name, count in self.counts.items()) + f" in {time.perf_counter() - start:.1f} s"))
+
+    def delete(self):
+        customers = Customer.objects.filter(name__startswith=f"{self.prefix}-")
+        places = set(customers.values_list("hq_place", flat=True)) | set(customers.values_list("bu_place", flat=True))
+        with transaction.atomic():
+            deliverables_deleting.send(sender=Deliverable, deliverables=Deliverable.objects.filter(project__customer__in=customers))
+            # one statement per table: the ORM would load every deliverable to send its delete signals
+            with connection.cursor() as cursor:
+                for model, path in [
+                    (Event, "deliverable__project__customer__in"),
+                    (Deliverable, "project__customer__in"),
+                    (ProjectMembership, "project__customer__in"),
+                    (Project, "customer__in"),
+                ]:
+                    query, params = model.objects.filter(**{path: customers}).values("pk").query.sql_with_params()
+                    cursor.execute(f"DELETE FROM {model._meta.db_table} WHERE {model._meta.pk.column} IN ({query})", params)
+                    self.stdout.write(f"{cursor.rowcount:,} {model._meta.verbose_name_plural}")
+            company_ids = list(customers.values_list("company", flat=True))
+            person_ids = list(customers.values_list("team_leader", flat=True))
+            customers.delete()
+            Company.objects.filter(pk__in=company_ids).delete()
+            Place.objects.filter(pk__in=places - {None}).delete()
+            Person.objects.filter(pk__in=person_ids).delete()
+            users = User.objects.filter(username__startswith=f"{self.prefix}-user-")
+            user_ids = list(users.values_list("pk", flat=True))
+            users.delete()
+        invalidate_memberships(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Data set {self.prefix} deleted"))
+
+    def size(self, mean, minimum=1):
+        """A random size with the given mean, drawn from the chosen distribution."""
+        if self.options["distribution"] == "uniform":
+            return max(minimum, round(self.random.uniform(0, 2 * mean)))
+        # Pareto with alpha 1.5 scaled to the mean, capped so a single draw cannot dominate the data set
+        alpha = 1.5
+        return max(minimum, min(round(self.random.paretovariate(alpha) * mean * (alpha - 1) / alpha), round(mean * 50)))
+
+    def create_users(self, count):
+        # all the users share one unusable password hash: hashing is the slow part of creating users
+        password = make_password(None)
+        users = User.objects.bulk_create(
+            User(username=f"{self.prefix}-user-{i}", email=f"user{i}@{self.prefix}.example.com", password=password) for i in range(count)
+        )
+        return users
+
+    def create_batch(self, indexes, users):
+        companies, places, people, customers = [], [], [], []
+        for i in indexes:
+            name = f"{self.prefix}-{i}"
+            city, province, country = self.random.choice(CITIES)
+            company = Company(name=f"{name} s.r.l.", vat=f"IT{i:011d}", email=f"info@{name}.example.com")
+            place = Place(address=f"via Roma {i % 200 + 1}", zip_code=f"{35100 + i % 100}", city=city, province=province, country_code=country)
+            person = Person(name=f"Person {name}", email=f"person@{name}.example.com")
+            companies.append(company)
+            places.append(place)
+            people.append(person)
+            customers.append(
+                Customer(
+                    name=name,
+                    company=company,
+                    hq_place=place,
+                    bu_place=place,
+                    team_leader=person,
+                    purchase_manager=person,
+                    engineering_director=person,
+                    marketing_director=person,
+                )
+            )
+        Company.objects.bulk_create(companies)
+        Place.objects.bulk_create(places)
+        Person.objects.bulk_create(people)
+        Customer.objects.bulk_create(customers)
+
+        projects, memberships = [], []
+        for customer in customers:
+            for p in range(self.size(self.options["projects"])):
+                project = Project(customer=customer, name=f"project-{p}")
+                projects.append(project)
+                for user in self.random.sample(users, min(len(users), self.size(self.options["members"], 0))):
+                    memberships.append(ProjectMembership(project=project, user=user, role=self.random.choice(ROLES)))
+
+        for project in projects:
+            project.number_of_deliverables = self.size(self.options["deliverables"])
+        Project.objects.bulk_create(projects)
+        ProjectMembership.objects.bulk_create(memberships)
+
+        # The events are streamed while the deliverables are generated, only the deliverables are kept in memory.
+        # They are inserted after their events: foreign keys are checked at commit (DEFERRABLE INITIALLY DEFERRED)
+        deliverables = []
+
+        def events():
+            for project in projects:
+                for d in range(project.number_of_deliverables):
+                    repository = f"https://github.com/{project.customer.name}/{project.name}-{d}"
+                    deliverable = Deliverable(id=uuid4(), project=project, name=f"deliverable-{d}", repository=repository, source_code_uri=repository)
+                    yield from self.deliverable_events(deliverable)
+                    deliverables.append(deliverable)
+
+        self.write_events(events())
+        Deliverable.objects.bulk_create(deliverables)
+
+        # the data derived from the deliverables is maintained by model signals, which bulk inserts do not send
+        deliverables_loaded.send(sender=Deliverable, deliverables=Deliverable.objects.filter(project__customer__in=customers))
+
+        self.counts["customers"] += len(customers)
+        self.counts["projects"] += len(projects)
+        self.counts["memberships"] += len(memberships)
+        self.counts["deliverables"] += len(deliverables)
+
+    def deliverable_events(self, deliverable):
+        """
+        Generate the events of the deliverable, oldest first, as rows of EVENT_COLUMNS.
+
+        Once exhausted, the published versions, stage status and last build
+        of the deliverable are set from the events, as the ingestion would do.
+        """
+        count = self.size(self.options["events"], 0)
+        days = self.options["days"]
+        timestamps = sorted(self.now - timedelta(seconds=self.random.uniform(0, days * 86400)) for _ in range(count))
+        published = {}
+        last = None
+        for n, timestamp in enumerate(timestamps):
+            stage = self.random.choice(STAGES)
+            version = f"1.{n // 10}.{n % 10}"
+            outcome = "success" if self.random.random() < 0.9 else "failure"
+            event_type = self.random.choice(EVENT_TYPES)
+            if event_type == "deploy" and outcome == "success":
+                published[stage] = (version, timestamp)
+            row = (f"{deliverable.id.hex}-{n}", deliverable.id, outcome, timestamp, event_type, stage, version, deliverable.source_code_uri, self.now)
+            if event_type == "build":
+                last = row
+            yield row
+
+        for stage, (version, timestamp) in published.items():
+            setattr(deliverable, f"{stage}_version", version)
+            setattr(deliverable, f"{stage}_last_published_at", timestamp)
+        deliverable.stage_status = {stage: "published" if stage in published else "pending" for stage in STAGES}
+        deliverable.stage_status["configuration"] = {stage: deliverable.stage_status[stage] for stage in STAGES}
+        if last is not None:
+            deliverable.last_build_event_id, deliverable.last_build_outcome, deliverable.last_build_timestamp = last[0], last[2], last[3]
+            deliverable.last_build_stage, deliverable.last_build_version = last[5], last[6]
+
+    def write_events(self, rows):
+        if self.options["no_copy"]:
+            batch = []
+            for row in rows:
+                batch.append(Event(**dict(zip(EVENT_COLUMNS, row))))
+                if len(batch) == 10000:
+                    self.counts["events"] += len(Event.objects.bulk_create(batch))
+                    batch = []
+            self.counts["events"] += len(Event.objects.bulk_create(batch))
+            return
+
+        # COPY streams the rows to PostgreSQL without building INSERT statements, several times faster than bulk_create
+        with connection.cursor() as cursor:
+            with cursor.copy(f"COPY {Event._meta.db_table} ({', '.join(EVENT_COLUMNS)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+                    self.counts["events"] += 1
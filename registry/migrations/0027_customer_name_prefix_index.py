@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0026_remove_deliverable_stages'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['name'], name='registry_customer_name_prefix', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0027_customer_name_prefix_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['deliverable', 'timestamp', 'id'], name='registry_event_deliv_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:56
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0029_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deliverable',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['stage_status'], name='registry_deliv_stage_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='deliverable',
+            index=models.Index(fields=['production_version'], name='registry_deliv_prod_ver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliverable',
+            index=models.Index(fields=['staging_version'], name='registry_deliv_stag_ver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliverable',
+            index=models.Index(fields=['delivery_version'], name='registry_deliv_deli_ver_idx'),
+        ),
+    ]
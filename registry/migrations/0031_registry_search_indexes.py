@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:10
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0030_deliverable_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='registry_company_name_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('vat'), name='text_pattern_ops'), name='registry_company_vat_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='registry_customer_name_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='registry_person_name_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='text_pattern_ops'), name='registry_person_email_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('city'), name='text_pattern_ops'), name='registry_place_city_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('address'), name='text_pattern_ops'), name='registry_place_address_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(django.db.models.functions.text.Upper('country_code'), name='registry_place_country_upper'),
+        ),
+    ]
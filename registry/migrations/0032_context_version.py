@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0031_registry_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='context',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1),
+        ),
+    ]
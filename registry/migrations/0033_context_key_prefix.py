@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0032_context_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='context',
+            index=models.Index(fields=['key'], name='registry_context_key_prefix', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
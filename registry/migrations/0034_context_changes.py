@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0033_context_key_prefix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContextChange',
+            fields=[
+                ('revision', models.BigAutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=100)),
+                ('version', models.PositiveBigIntegerField()),
+                ('value', models.JSONField(null=True)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='context',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
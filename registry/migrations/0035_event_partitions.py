@@ -0,0 +1,59 @@
+from django.db import migrations
+
+# registry_event becomes a table partitioned by month on timestamp (registry.partitions). PostgreSQL requires the
+# partition key in the primary key: it is (id, timestamp) in the database, the model keeps id as primary key.
+# Months before the last 36 go to the default partition, as well as any timestamp without its partition.
+PARTITION = """
+CREATE TABLE registry_event_partitioned (LIKE registry_event INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE ("timestamp");
+CREATE TABLE registry_event_default PARTITION OF registry_event_partitioned DEFAULT;
+DO $$
+DECLARE
+    month timestamp;
+BEGIN
+    FOR month IN SELECT generate_series(
+        GREATEST(
+            date_trunc('month', COALESCE((SELECT min("timestamp") FROM registry_event), now()) AT TIME ZONE 'UTC'),
+            date_trunc('month', now() AT TIME ZONE 'UTC') - interval '36 months'
+        ),
+        date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+        interval '1 month'
+    ) LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF registry_event_partitioned FOR VALUES FROM (%L) TO (%L)',
+            'registry_event_p' || to_char(month, 'YYYY_MM'), month || '+00', (month + interval '1 month') || '+00'
+        );
+    END LOOP;
+END $$;
+INSERT INTO registry_event_partitioned SELECT * FROM registry_event;
+DROP TABLE registry_event;
+ALTER TABLE registry_event_partitioned RENAME TO registry_event;
+ALTER TABLE registry_event ADD CONSTRAINT registry_event_pkey PRIMARY KEY (id, "timestamp");
+ALTER TABLE registry_event ADD CONSTRAINT registry_event_deliverable_id_051cc236_fk_registry_
+    FOREIGN KEY (deliverable_id) REFERENCES registry_deliverable (id) DEFERRABLE INITIALLY DEFERRED;
+-- the (deliverable_id) index is a prefix of this one, it is not recreated
+CREATE INDEX registry_event_deliv_ts_idx ON registry_event (deliverable_id, "timestamp", id);
+"""
+
+UNPARTITION = """
+CREATE TABLE registry_event_plain (LIKE registry_event INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+INSERT INTO registry_event_plain SELECT * FROM registry_event;
+DROP TABLE registry_event;
+ALTER TABLE registry_event_plain RENAME TO registry_event;
+ALTER TABLE registry_event ADD CONSTRAINT registry_event_pkey PRIMARY KEY (id);
+ALTER TABLE registry_event ADD CONSTRAINT registry_event_deliverable_id_051cc236_fk_registry_
+    FOREIGN KEY (deliverable_id) REFERENCES registry_deliverable (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX registry_event_id_7f796b9a_like ON registry_event (id varchar_pattern_ops);
+CREATE INDEX registry_event_deliverable_id_051cc236 ON registry_event (deliverable_id);
+CREATE INDEX registry_event_deliv_ts_idx ON registry_event (deliverable_id, "timestamp", id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0034_context_changes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION, UNPARTITION),
+    ]
@@ -0,0 +1,83 @@
+from django.db import migrations
+
+# registry_event is partitioned (0035) and its primary key (id, "timestamp") does not make id unique: the ids are
+# claimed in registry_event_id by a trigger, whose primary key rejects the duplicates of any partition. Inserts
+# with the transaction setting registry.event_conflicts = 'skip' drop the duplicate rows instead of failing
+# (registry.partitions.insert_events). Ids are released when their event is deleted, or its partition dropped.
+CLAIM = """
+CREATE TABLE registry_event_id (
+    id varchar(255) PRIMARY KEY,
+    "timestamp" timestamp with time zone NOT NULL
+);
+CREATE INDEX registry_event_id_ts_idx ON registry_event_id ("timestamp");
+INSERT INTO registry_event_id SELECT id, max("timestamp") FROM registry_event GROUP BY id;
+
+CREATE FUNCTION registry_event_claim_id() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('registry.event_conflicts', true) = 'skip' THEN
+        INSERT INTO registry_event_id VALUES (NEW.id, NEW."timestamp") ON CONFLICT DO NOTHING;
+        IF NOT FOUND THEN
+            RETURN NULL;
+        END IF;
+    ELSE
+        INSERT INTO registry_event_id VALUES (NEW.id, NEW."timestamp");
+    END IF;
+    RETURN NEW;
+END $$;
+
+-- an update moving the event to another partition runs the insert trigger on the new one: the id is released
+-- before and claimed again after the update (by the insert trigger if moved, here otherwise)
+CREATE FUNCTION registry_event_release_id() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    DELETE FROM registry_event_id WHERE id = OLD.id;
+    RETURN NEW;
+END $$;
+
+CREATE FUNCTION registry_event_reclaim_id() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO registry_event_id VALUES (NEW.id, NEW."timestamp")
+        ON CONFLICT (id) DO UPDATE SET "timestamp" = EXCLUDED."timestamp";
+    RETURN NULL;
+END $$;
+
+-- statement level: the rows moved by an update are not in the deleted rows, unlike with a row level trigger
+CREATE FUNCTION registry_event_release_deleted_ids() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    DELETE FROM registry_event_id WHERE id IN (SELECT id FROM deleted);
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER registry_event_claim_id BEFORE INSERT ON registry_event
+    FOR EACH ROW EXECUTE FUNCTION registry_event_claim_id();
+CREATE TRIGGER registry_event_release_id BEFORE UPDATE OF id, "timestamp" ON registry_event
+    FOR EACH ROW WHEN (OLD.id IS DISTINCT FROM NEW.id OR OLD."timestamp" IS DISTINCT FROM NEW."timestamp")
+    EXECUTE FUNCTION registry_event_release_id();
+CREATE TRIGGER registry_event_reclaim_id AFTER UPDATE OF id, "timestamp" ON registry_event
+    FOR EACH ROW WHEN (OLD.id IS DISTINCT FROM NEW.id OR OLD."timestamp" IS DISTINCT FROM NEW."timestamp")
+    EXECUTE FUNCTION registry_event_reclaim_id();
+CREATE TRIGGER registry_event_release_deleted_ids AFTER DELETE ON registry_event
+    REFERENCING OLD TABLE AS deleted FOR EACH STATEMENT EXECUTE FUNCTION registry_event_release_deleted_ids();
+"""
+
+UNCLAIM = """
+DROP TRIGGER registry_event_release_deleted_ids ON registry_event;
+DROP TRIGGER registry_event_reclaim_id ON registry_event;
+DROP TRIGGER registry_event_release_id ON registry_event;
+DROP TRIGGER registry_event_claim_id ON registry_event;
+DROP FUNCTION registry_event_release_deleted_ids();
+DROP FUNCTION registry_event_reclaim_id();
+DROP FUNCTION registry_event_release_id();
+DROP FUNCTION registry_event_claim_id();
+DROP TABLE registry_event_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0035_event_partitions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CLAIM, UNCLAIM),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0036_event_id_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='contextchange',
+            name='value',
+        ),
+        migrations.AlterField(
+            model_name='contextchange',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -1,9 +1,30 @@
 from uuid import uuid4
 
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import models, router, transaction
+from django.db.models.functions import Upper
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from registry.signals import events_deleted, events_deleting
+
+
+class AtomicSaveModel(models.Model):
+    """
+    Model saved in a transaction that also runs its post_save receivers.
+
+    Apps keeping data derived from the registry (space documents and counts)
+    update it from post_save: the row and the derived data are committed
+    together, also by callers running in autocommit.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get("using") or router.db_for_write(type(self), instance=self)):
+            super().save(*args, **kwargs)
+
 
 class Person(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
@@ -16,6 +37,11 @@ class Person(models.Model):
 
     class Meta:
         verbose_name_plural = "people"
+        indexes = [
+            # ?q= prefix search (UPPER(field) LIKE 'TERM%') and ?name= / ?email= filters (UPPER(field) = 'VALUE')
+            models.Index(OpClass(Upper("name"), name="text_pattern_ops"), name="registry_person_name_upper"),
+            models.Index(OpClass(Upper("email"), name="text_pattern_ops"), name="registry_person_email_upper"),
+        ]
 
 
 class Place(models.Model):
@@ -32,6 +58,12 @@ class Place(models.Model):
 
     class Meta:
         verbose_name_plural = "places"
+        indexes = [
+            # ?q= prefix search and ?city= / ?country= filters
+            models.Index(OpClass(Upper("city"), name="text_pattern_ops"), name="registry_place_city_upper"),
+            models.Index(OpClass(Upper("address"), name="text_pattern_ops"), name="registry_place_address_upper"),
+            models.Index(Upper("country_code"), name="registry_place_country_upper"),
+        ]
 
 
 class Company(models.Model):
@@ -46,9 +78,14 @@ class Company(models.Model):
 
     class Meta:
         verbose_name_plural = "Companies"
+        indexes = [
+            # ?q= prefix search and ?vat= filter
+            models.Index(OpClass(Upper("name"), name="text_pattern_ops"), name="registry_company_name_upper"),
+            models.Index(OpClass(Upper("vat"), name="text_pattern_ops"), name="registry_company_vat_upper"),
+        ]
 
 
-class Customer(models.Model):
+class Customer(AtomicSaveModel):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     name = models.CharField(max_length=30, unique=True)
     lang = models.CharField(max_length=30, default="italian", help_text="mother tongue of the customer")
@@ -59,16 +96,26 @@ class Customer(models.Model):
     purchase_manager = models.ForeignKey(Person, on_delete=models.RESTRICT, related_name="+", null=True, blank=True, help_text="* person who has to sign commercial offer")
     engineering_director = models.ForeignKey(Person, on_delete=models.RESTRICT, related_name="+", null=True, blank=True, help_text="")
     marketing_director = models.ForeignKey(Person, on_delete=models.RESTRICT, related_name="+", null=True, blank=True, help_text="")
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            # allows LIKE 'prefix%' range scans regardless of the database collation
+            models.Index(fields=["name"], name="registry_customer_name_prefix", opclasses=["varchar_pattern_ops"]),
+            # ?q= prefix search of the registry API (case insensitive)
+            models.Index(OpClass(Upper("name"), name="text_pattern_ops"), name="registry_customer_name_upper"),
+        ]
+
 
-class Project(models.Model):
+class Project(AtomicSaveModel):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     customer = models.ForeignKey(Customer, on_delete=models.RESTRICT)
     name = models.CharField(max_length=30)
     number_of_deliverables = models.IntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name}@{self.customer.name}"
@@ -97,7 +144,7 @@ class ProjectMembership(models.Model):
 
 # Inizio aggiunte classi per funzioni con deliverables-----
 
-class Deliverable(models.Model):
+class Deliverable(AtomicSaveModel):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     name = models.CharField(max_length=30)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="deliverables") 
@@ -129,14 +176,42 @@ class Deliverable(models.Model):
     # AGGIUNTA PER TESTING
     stage_status = models.JSONField(default=dict)
 
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
         return f"{self.name} in {self.project}"
 
     class Meta:
         unique_together = ("name", "project")
+        indexes = [
+            # containment and key lookups (stage_status__contains, __has_key) used by the space deliverables filters
+            GinIndex(fields=["stage_status"], name="registry_deliv_stage_gin"),
+            models.Index(fields=["production_version"], name="registry_deliv_prod_ver_idx"),
+            models.Index(fields=["staging_version"], name="registry_deliv_stag_ver_idx"),
+            models.Index(fields=["delivery_version"], name="registry_deliv_deli_ver_idx"),
+        ]
+
+class EventQuerySet(models.QuerySet):
+    def delete(self):
+        # events have no delete signals, which would disable the fast delete of the events of a deleted deliverable:
+        # the apps keeping data derived from them are told by the registry signals, in the transaction of the delete
+        with transaction.atomic(using=self.db):
+            deliverables = set(self.values_list("deliverable_id", flat=True).distinct())
+            if deliverables:
+                events_deleting.send(sender=Event, events=self)
+            deleted = super().delete()
+            if deliverables:
+                events_deleted.send(sender=Event, deliverables=deliverables)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
 
 ## TESTING ##
-class Event(models.Model):
+class Event(AtomicSaveModel):
+    # The table is partitioned by month on timestamp (migration 0035, registry.partitions): in the database the
+    # primary key is (id, timestamp), the uniqueness of id alone is enforced by the registry_event_id table (0036)
     # Relazioni
     deliverable = models.ForeignKey(Deliverable, on_delete=models.CASCADE, related_name="events")
     
@@ -150,9 +225,22 @@ class Event(models.Model):
     source_code_uri = models.URLField(max_length=200)  # URL del codice sorgente relativo all'evento
     external_ref = models.CharField(max_length=255, blank=True, null=True)  # Riferimento esterno opzionale
     external_ref_uri = models.URLField(max_length=200, blank=True, null=True)  # URL del riferimento esterno
+    updated_at = models.DateTimeField(auto_now=True)  # Ultima modifica della riga
+
+    objects = EventQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.type} event for {self.deliverable.name} ({self.timestamp})" 
+
+    def delete(self, using=None, keep_parents=False):
+        # through EventQuerySet.delete, which keeps the derived data in sync
+        return Event.objects.using(using).filter(pk=self.pk, deliverable_id=self.deliverable_id).delete()
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the events of a deliverable on (timestamp, id)
+            models.Index(fields=["deliverable", "timestamp", "id"], name="registry_event_deliv_ts_idx"),
+        ]
 # Fine aggiunte -----
 
 
@@ -208,8 +296,40 @@ class Membership(models.Model):
 class Context(models.Model):
     key = models.CharField(max_length=100, primary_key=True)
     value = models.JSONField()
+    # incremented by every write, for compare-and-swap updates (registry.context)
+    version = models.PositiveBigIntegerField(default=1)
+    # revision (ContextChange) of the last write
+    revision = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # prefix scans of a namespace (key LIKE 'project/x/%'), the primary key index cannot serve LIKE
+            models.Index(fields=["key"], name="registry_context_key_prefix", opclasses=["varchar_pattern_ops"]),
+        ]
 
     def __str__(self):
         return self.key
 
 
+class ContextChange(models.Model):
+    """
+    Change log of Context: one row per written or deleted key.
+
+    Revisions are global and increasing, taken before the commit: the
+    writers are not serialized, so they may commit out of order.
+    registry.context.head() stops before the first revision that a
+    transaction still in progress could precede, so a reader that saw
+    revision N gets every later change with revision > N.
+    """
+
+    revision = models.BigAutoField(primary_key=True)
+    key = models.CharField(max_length=100)
+    # 0 if the key has been deleted
+    version = models.PositiveBigIntegerField()
+    # kept CONTEXT_CHANGE_RETENTION_DAYS by context_retention
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.revision} {self.key}"
+
+
@@ -0,0 +1,26 @@
+from rest_framework.pagination import CursorPagination
+
+
+class RegistryCursorPagination(CursorPagination):
+    """
+    Cursor pagination for the registry read-only endpoints.
+
+    Pagination is enabled only when `limit` or `cursor` are in the query,
+    otherwise the whole list is returned as before. The order is taken from
+    the `cursor_ordering` attribute of the view and must end with a unique
+    field so the position of the cursor is deterministic.
+    """
+
+    page_size = None
+    page_size_query_param = "limit"
+    max_page_size = 1000
+    default_page_size = 100
+
+    def get_page_size(self, request):
+        page_size = super().get_page_size(request)
+        if page_size is None and self.cursor_query_param in request.query_params:
+            return self.default_page_size
+        return page_size
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, "cursor_ordering", ("id",))
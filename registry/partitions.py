@@ -0,0 +1,207 @@
+"""
+Monthly partitions of the events table (migration 0035).
+
+registry_event is partitioned by range on timestamp, one partition per
+UTC month named registry_event_pYYYY_MM, plus a default partition for the
+timestamps without one. ensure_partitions() creates the partitions of the
+coming months (run by the events_retention command and after migrate),
+drop_partitions() removes whole months in constant time instead of
+DELETE scans.
+
+The primary key of the partitions is (id, timestamp): the ids are kept
+unique by the registry_event_id table (migration 0036), where a trigger
+claims the id of every inserted event. insert_events() skips the events
+whose id is taken instead of failing.
+"""
+
+import gzip
+import re
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone as django_timezone
+
+from registry.models import Event
+
+TABLE = Event._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+EVENT_IDS = f"{TABLE}_id"
+PARTITION_NAME = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+# months created ahead of the current one
+AHEAD = getattr(settings, "EVENT_PARTITIONS_AHEAD", 3)
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+def partitions():
+    """{month: partition name} of the monthly partitions, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = %s::regclass",
+            [TABLE],
+        )
+        names = [name for name, in cursor.fetchall()]
+    months = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months[datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc)] = name
+    return dict(sorted(months.items()))
+
+
+def stored_since():
+    """
+    The oldest moment whose events are all stored, None without partitions.
+
+    The start of the oldest partition, or the oldest event of the default
+    partition if older: the events before it were dropped by
+    drop_partitions().
+    """
+    months = partitions()
+    if not months:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT min(timestamp) FROM {DEFAULT_PARTITION}")
+        oldest, = cursor.fetchone()
+    start = next(iter(months))
+    return start if oldest is None else min(start, oldest)
+
+
+def is_partitioned():
+    """False until migration 0035 is applied (and after it is reverted)."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def _lock():
+    # one maintenance at a time: the partitions are listed and then created or dropped
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [TABLE])
+
+
+def ensure_partitions(ahead=AHEAD, now=None):
+    """
+    Create the partitions from the current month to `ahead` months later.
+
+    The months of the rows stored in the default partition get their
+    partition too, if not older than the oldest partition: the rows are
+    moved into it before it is attached, as PostgreSQL refuses a partition
+    whose rows are in the default one. Returns the names of the created
+    partitions.
+    """
+    month = month_start(now or datetime.now(timezone.utc))
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        _lock()
+        cursor.execute(f"SELECT DISTINCT date_trunc('month', timestamp AT TIME ZONE 'UTC') FROM {DEFAULT_PARTITION}")
+        stray = {month_start(value) for value, in cursor.fetchall()}
+        existing = partitions()
+        oldest = min(existing, default=month)
+        stray = {start for start in stray if start >= oldest}
+        for start in sorted(stray | {add_months(month, n) for n in range(ahead + 1)}):
+            if start in existing:
+                continue
+            name, end = partition_name(start), add_months(start, 1)
+            cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= %s AND timestamp < %s RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved",
+                [start, end],
+            )
+            # the primary key, indexes and foreign key of the table are created on the partition
+            cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", [start, end])
+            created.append(name)
+    return created
+
+
+def archive(query, path):
+    """Write the rows of the query to a gzipped CSV file (with header)."""
+    with connection.cursor() as cursor, gzip.open(path, "wb") as output:
+        with cursor.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+            for data in copy:
+                output.write(data)
+
+
+def drop_partitions(before, archive_to=None):
+    """
+    Drop the monthly partitions of the events older than `before` (only whole months).
+
+    With `archive_to` (a directory) every partition is first written to
+    <archive_to>/<partition>.csv.gz. Every partition is dropped in its own
+    transaction. The rows of the default partition older than `before`
+    are deleted (and archived in <archive_to>/<default partition>-<date>.csv.gz).
+    Returns ({partition: rows}, deleted default rows).
+    """
+    dropped = {}
+    for start, name in partitions().items():
+        if add_months(start, 1) > before:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            _lock()
+            cursor.execute(f"SELECT count(*) FROM {name}")
+            rows, = cursor.fetchone()
+            if archive_to is not None:
+                archive(f"SELECT * FROM {name}", f"{archive_to}/{name}.csv.gz")
+            cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+            # DROP TABLE fires no delete trigger: the ids of the partition are released here
+            cursor.execute(f'DELETE FROM {EVENT_IDS} WHERE "timestamp" >= %s AND "timestamp" < %s', [start, add_months(start, 1)])
+        dropped[name] = rows
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if archive_to is not None:
+            # COPY takes no parameters: `before` is a datetime, its ISO format is a valid literal
+            query = f"SELECT * FROM {DEFAULT_PARTITION} WHERE timestamp < '{before.isoformat()}'"
+            archive(query, f"{archive_to}/{DEFAULT_PARTITION}-{before:%Y%m%d}.csv.gz")
+        # the delete trigger is on the partitioned table, not on the partitions: the ids are released here too
+        cursor.execute(
+            f"WITH deleted AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < %s RETURNING id) "
+            f"DELETE FROM {EVENT_IDS} WHERE id IN (SELECT id FROM deleted)",
+            [before],
+        )
+        deleted = cursor.rowcount
+    return dropped, deleted
+
+
+def insert_events(events):
+    """
+    Insert the Event instances whose id is not taken, in a single statement.
+
+    The id of every event is claimed by the trigger of migration 0036, which
+    with registry.event_conflicts = 'skip' drops the row of a taken id
+    instead of failing. An id claimed by a concurrent transaction waits for
+    it: a batch sent twice at the same time is stored once. Returns the ids
+    of the inserted events.
+    """
+    if not events:
+        return set()
+    fields = Event._meta.concrete_fields
+    now = django_timezone.now()
+    for event in events:
+        event.updated_at = now  # auto_now, set by save() and bulk_create()
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    arrays = ", ".join(f"%s::{field.db_type(connection)}[]" for field in fields)
+    values = [[field.get_db_prep_save(getattr(event, field.attname), connection) for event in events] for field in fields]
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        # the setting lasts until the end of the transaction: restored right after the insert
+        cursor.execute("SELECT set_config('registry.event_conflicts', 'skip', true)")
+        cursor.execute(f"INSERT INTO {TABLE} ({columns}) SELECT * FROM unnest({arrays}) RETURNING id", values)
+        inserted = {id for id, in cursor.fetchall()}
+        cursor.execute("SELECT set_config('registry.event_conflicts', '', true)")
+    return inserted
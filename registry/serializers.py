@@ -88,3 +88,5 @@ class ContextSerializer(serializers.ModelSerializer):
     class Meta:
         model = Context
         fields = "__all__"
+        # both are set by registry.context on every write
+        read_only_fields = ["version", "revision"]
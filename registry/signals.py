@@ -0,0 +1,25 @@
+"""
+Signals of the registry bulk operations, which bypass the model signals.
+
+Apps keeping data derived from the registry (space documents, counts and
+cache) connect to them, so the registry does not depend on those apps.
+"""
+
+from django.dispatch import Signal
+
+# Sent with deliverables= (queryset) once deliverables and their events have been inserted in bulk (seed_load)
+deliverables_loaded = Signal()
+
+# Sent with deliverables= (queryset) before the deliverables and their events are deleted by raw statements:
+# the rows of other apps referencing them must be deleted by the receivers
+deliverables_deleting = Signal()
+
+# Sent with since= and before= (datetimes) once the events in [since, before) have been dropped by
+# events_retention; since is None if events of any age have been removed
+events_dropped = Signal()
+
+# Sent with events= (queryset) before the events are deleted by EventQuerySet.delete, which sends no model signals
+events_deleting = Signal()
+
+# Sent with deliverables= (set of ids) once the events of those deliverables have been deleted by EventQuerySet.delete
+events_deleted = Signal()
@@ -1,3 +1,794 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import tempfile
+import threading
+from unittest import mock
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import parse_qsl, urlsplit
+from datetime import datetime, timedelta, timezone
+from itertools import count
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import Permission, User
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TransactionTestCase
+from rest_framework.test import APITestCase
+
+from registry.models import (
+    Billing,
+    Company,
+    Context,
+    ContextChange,
+    Customer,
+    Deliverable,
+    Event,
+    Membership,
+    MembershipType,
+    Person,
+    Place,
+    Plan,
+    Portfolio,
+    Project,
+    ProjectMembership,
+)
+from registry import context
+from registry.couchdb import CouchDB, Importer, Prefetch, doc_uuid, iter_rows
+from registry.partitions import add_months, ensure_partitions, insert_events, month_start, partition_name, partitions
+from space.models import DeliverableDocument
+from tars.testing import QueryBudgetMixin
+
+
+class RegistryQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    """The registry list endpoints read the nested serializer graph with a fixed number of queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        cls.membership_type = MembershipType.objects.create(name="gold")
+        cls.sequence = count()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def create_customer(self):
+        i = next(self.sequence)
+        person = Person.objects.create(name=f"person {i}", email=f"person{i}@example.com")
+        place = Place.objects.create(address="via Roma 1", zip_code="35100", city="Padova", province="PD", country_code="IT")
+        customer = Customer.objects.create(
+            name=f"customer {i}",
+            company=Company.objects.create(name=f"company {i}", email=f"company{i}@example.com"),
+            hq_place=place,
+            bu_place=place,
+            team_leader=person,
+            purchase_manager=person,
+            engineering_director=person,
+            marketing_director=person,
+        )
+        Membership.objects.create(
+            of=customer,
+            portfolio=Portfolio.objects.create(name="portfolio", brand="brand"),
+            plan=Plan.objects.create(unit=1, name="plan", category={}, discounts={}),
+            membership=self.membership_type,
+            billing=Billing.objects.create(alias="billing", description={}),
+        )
+
+    def grow_customers(self, size):
+        while Customer.objects.count() < size:
+            self.create_customer()
+
+    def test_customers(self):
+        queries = self.assertQueriesConstant(lambda: self.client.get("/registry/customers/"), self.grow_customers)
+        self.assertLessEqual(queries, 3)
+
+        response = self.client.get("/registry/customers/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["membership"]["membership"], "gold")
+
+    def test_memberships(self):
+        queries = self.assertQueriesConstant(lambda: self.client.get("/registry/membership/"), self.grow_customers)
+        self.assertLessEqual(queries, 3)
+
+    def test_lists(self):
+        # every customer adds a person, a place, a company, a billing and a plan
+        for endpoint in ["people", "places", "companies", "billings", "plans"]:
+            url = f"/registry/{endpoint}/"
+            Customer.objects.all().delete()
+            response = self.assertQueryBudget(lambda: self.client.get(url), self.grow_customers, 1, label=f"GET {url}")
+            self.assertGreaterEqual(len(response.json()), 10)
+            self.assertQueryBudget(lambda: self.client.get(url, {"limit": 5}), self.grow_customers, 1, label=f"GET {url}?limit=")
+
+    def test_context(self):
+        def grow(size):
+            Context.objects.bulk_create(Context(key=f"ns/{i}", value={"i": i}) for i in range(Context.objects.count(), size))
+
+        keys = [f"ns/{i}" for i in range(10)]
+        self.assertQueryBudget(lambda: self.client.get("/registry/context/", {"prefix": "ns/"}), grow, 1, label="GET /registry/context/?prefix=")
+        self.assertQueryBudget(lambda: self.client.get("/registry/context/mget/", {"key": keys}), grow, 1, label="GET /registry/context/mget/")
+
+    def test_customer_detail(self):
+        self.grow_customers(1)
+        with self.assertMaxQueries(3):
+            response = self.client.get("/registry/customers/customer 0/")
+        self.assertEqual(response.status_code, 200)
+
+
+class RegistryListTest(APITestCase):
+    """Pagination, filters and search of the registry list endpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        Person.objects.bulk_create(Person(name=f"Person {i:02}", email=f"person{i:02}@example.com") for i in range(25))
+        Place.objects.create(address="via Roma 1", zip_code="35100", city="Padova", province="PD", country_code="IT")
+        Place.objects.create(address="rue de Rivoli 1", zip_code="75001", city="Paris", province="75", country_code="FR")
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_unpaginated(self):
+        response = self.client.get("/registry/people/")
+        self.assertEqual(len(response.json()), 25)
+
+    def test_cursor_pagination(self):
+        names = []
+        url = "/registry/people/?limit=10"
+        while url:
+            page = self.client.get(url).json()
+            names += [person["name"] for person in page["results"]]
+            url = page["next"]
+        self.assertEqual(names, [f"Person {i:02}" for i in range(25)])
+
+    def test_filters(self):
+        response = self.client.get("/registry/people/", {"email": "PERSON07@example.com"})
+        self.assertEqual([person["name"] for person in response.json()], ["Person 07"])
+        response = self.client.get("/registry/places/", {"country": "fr"})
+        self.assertEqual([place["city"] for place in response.json()], ["Paris"])
+
+    def test_search(self):
+        response = self.client.get("/registry/people/", {"q": "person1"})
+        self.assertEqual(len(response.json()), 10)
+        response = self.client.get("/registry/places/", {"q": "pa"})
+        self.assertEqual({place["city"] for place in response.json()}, {"Padova", "Paris"})
+        response = self.client.get("/registry/places/", {"q": "via"})
+        self.assertEqual([place["city"] for place in response.json()], ["Padova"])
+
+
+class RegistryScopeTest(APITestCase):
+    """Customers and memberships are limited to the customers of the user's projects."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("member", password="member")
+        cls.user.user_permissions.set(Permission.objects.filter(codename__in=["view_customer", "view_membership"]))
+        membership_type = MembershipType.objects.create(name="gold")
+        for name in ["acme", "globex"]:
+            customer = Customer.objects.create(name=name, company=Company.objects.create(name=name, email=f"{name}@example.com"))
+            Membership.objects.create(
+                of=customer,
+                portfolio=Portfolio.objects.create(name="portfolio", brand="brand"),
+                plan=Plan.objects.create(unit=1, name="plan", category={}, discounts={}),
+                membership=membership_type,
+                billing=Billing.objects.create(alias="billing", description={}),
+            )
+        cls.membership = ProjectMembership.objects.create(
+            project=Project.objects.create(name="rocket", customer=Customer.objects.get(name="acme")),
+            user=cls.user,
+            role=ProjectMembership.ProjectMembershipRole.DEVELOPER,
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_scope(self):
+        acme = Customer.objects.get(name="acme")
+        self.assertEqual([customer["name"] for customer in self.client.get("/registry/customers/").json()], ["acme"])
+        self.assertEqual([membership["of"] for membership in self.client.get("/registry/membership/").json()], [str(acme.pk)])
+        self.assertEqual(self.client.get(f"/registry/membership/{Membership.objects.get(of__name='globex').pk}/").status_code, 404)
+
+        # a revoked membership hides the customer at the next request
+        self.membership.delete()
+        self.assertEqual(self.client.get("/registry/customers/").json(), [])
+        self.assertEqual(self.client.get("/registry/membership/").json(), [])
+
+
+class ContextStoreTest(QueryBudgetMixin, APITestCase):
+    """Versioned key/value API of /registry/context/."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        Context.objects.create(key="service", value={"timeout": 10, "retries": 3})
+
+    def test_put_with_version(self):
+        response = self.client.put("/registry/context/service/", {"value": {"timeout": 20}, "version": 1}, format="json")
+        self.assertEqual(response.json()["value"], {"timeout": 20})
+        self.assertEqual(response.json()["version"], 2)
+
+        # a second writer that read version 1 does not overwrite the first one
+        response = self.client.put("/registry/context/service/", {"value": {"timeout": 30}, "version": 1}, format="json")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["versions"], {"service": 2})
+        self.assertEqual(Context.objects.get(key="service").value, {"timeout": 20})
+
+    def test_create_ignores_version_and_revision(self):
+        response = self.client.post("/registry/context/", {"key": "new", "value": 1, "version": 7, "revision": 99}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["version"], 1)
+        self.assertEqual(response.json()["revision"], Context.objects.get(key="new").revision)
+        self.assertNotEqual(response.json()["revision"], 99)
+
+    def test_put_creates(self):
+        response = self.client.put("/registry/context/new/", {"value": [1, 2], "version": 0}, format="json")
+        self.assertEqual(response.json()["version"], 1)
+        response = self.client.put("/registry/context/new/", {"value": [3], "version": 0}, format="json")
+        self.assertEqual(response.status_code, 409)
+
+    def test_patch_merges(self):
+        response = self.client.patch("/registry/context/service/", {"value": {"retries": None, "backoff": 2}}, format="json")
+        self.assertEqual(response.json()["value"], {"timeout": 10, "backoff": 2})
+        self.assertEqual(response.json()["version"], 2)
+        response = self.client.patch("/registry/context/service/", {"value": {"timeout": 1}, "version": 1}, format="json")
+        self.assertEqual(response.status_code, 409)
+        response = self.client.patch("/registry/context/missing/", {"value": {"timeout": 1}}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_with_version(self):
+        self.assertEqual(self.client.delete("/registry/context/service/?version=2").status_code, 409)
+        self.assertEqual(self.client.delete("/registry/context/service/?version=1").status_code, 204)
+        self.assertFalse(Context.objects.exists())
+
+    def test_mget(self):
+        Context.objects.create(key="other", value=1)
+        with self.assertMaxQueries(1):
+            response = self.client.get("/registry/context/mget/?key=service&key=other&key=missing")
+        self.assertEqual(
+            response.json(),
+            {"service": {"value": {"timeout": 10, "retries": 3}, "version": 1, "revision": 0}, "other": {"value": 1, "version": 1, "revision": 0}},
+        )
+
+    def test_mput_is_atomic(self):
+        items = [{"key": "service", "value": 1, "version": 1}, {"key": "a", "value": 2}, {"key": "b", "value": 3, "version": 0}]
+        response = self.client.post("/registry/context/mput/", items, format="json")
+        self.assertEqual({key: item["version"] for key, item in response.json().items()}, {"service": 2, "a": 1, "b": 1})
+
+        # one stale version: nothing is written
+        items = [{"key": "a", "value": 20}, {"key": "service", "value": 10, "version": 1}]
+        response = self.client.post("/registry/context/mput/", items, format="json")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["versions"], {"service": 2})
+        self.assertEqual(Context.objects.get(key="a").value, 2)
+
+    def test_write_permissions(self):
+        user = User.objects.create_user("writer")
+        self.client.force_authenticate(user)
+        user.user_permissions.add(*Permission.objects.filter(codename__in=["view_context", "change_context"]))
+        # changing a key does not allow to create one
+        self.assertEqual(self.client.put("/registry/context/service/", {"value": 1}, format="json").status_code, 200)
+        self.assertEqual(self.client.put("/registry/context/new/", {"value": 1}, format="json").status_code, 403)
+
+        # adding keys does not allow to overwrite them
+        user.user_permissions.set(Permission.objects.filter(codename__in=["view_context", "add_context"]))
+        user = User.objects.get(pk=user.pk)
+        self.client.force_authenticate(user)
+        response = self.client.post("/registry/context/mput/", [{"key": "service", "value": 2}], format="json")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Context.objects.get(key="service").value, 1)
+        self.assertFalse(Context.objects.filter(key="new").exists())
+
+    def test_hierarchical_keys(self):
+        response = self.client.put("/registry/context/project/x.y/feature/", {"value": True}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/registry/context/project/x.y/feature/").json()["value"], True)
+
+    def test_prefix_scan(self):
+        Context.objects.bulk_create(Context(key=f"project/{name}", value=i) for i, name in enumerate(["a", "b/c", "b/d", "%"]))
+        Context.objects.create(key="projects", value=0)
+
+        response = self.client.get("/registry/context/", {"prefix": "project/b/"})
+        self.assertEqual([item["key"] for item in response.json()], ["project/b/c", "project/b/d"])
+
+        keys, url = [], "/registry/context/?prefix=project/&limit=3"
+        while url:
+            page = self.client.get(url).json()
+            keys += [item["key"] for item in page["results"]]
+            url = page["next"]
+        self.assertEqual(keys, ["project/%", "project/a", "project/b/c", "project/b/d"])
+
+        response = self.client.get("/registry/context/", {"prefix": "project/b", "format": "ndjson"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, ['{"key":"project/b/c","value":1,"version":1,"revision":0}', '{"key":"project/b/d","value":2,"version":1,"revision":0}'])
+
+    def test_subtree_delete(self):
+        Context.objects.bulk_create(Context(key=key, value=0) for key in ["a/1", "a/2/3", "a_b", "b/1"])
+        self.assertEqual(self.client.delete("/registry/context/subtree/").status_code, 400)
+        response = self.client.delete("/registry/context/subtree/?prefix=a/")
+        self.assertEqual(response.json(), {"deleted": 2})
+        self.assertEqual(sorted(Context.objects.values_list("key", flat=True)), ["a_b", "b/1", "service"])
+
+
+class ContextChangesTest(APITestCase):
+    """Revisions, change feed and long-poll watch of the context store."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def put(self, key, value):
+        with self.captureOnCommitCallbacks(execute=True):
+            return context.put_many([(key, value, None)])[key]
+
+    def test_changes(self):
+        first = self.put("a/1", 1)
+        self.client.patch("/registry/context/a/1/", {"value": {"x": 1}}, format="json")
+        self.client.post("/registry/context/mput/", [{"key": "b/1", "value": 2}, {"key": "a/2", "value": 3}], format="json")
+        self.client.delete("/registry/context/subtree/?prefix=a/")
+
+        response = self.client.get("/registry/context/changes/", {"since": first.revision - 1})
+        changes = response.json()["changes"]
+        self.assertEqual([(c["key"], c["version"]) for c in changes], [("a/1", 1), ("a/1", 2), ("b/1", 1), ("a/2", 1), ("a/1", 0), ("a/2", 0)])
+        revisions = [c["revision"] for c in changes]
+        self.assertEqual(revisions, sorted(set(revisions)))
+        self.assertEqual(response.json()["revision"], revisions[-1])
+
+        # the revision moves past the filtered out changes
+        response = self.client.get("/registry/context/changes/", {"since": first.revision - 1, "prefix": "b/"})
+        self.assertEqual([c["key"] for c in response.json()["changes"]], ["b/1"])
+        self.assertEqual(response.json()["revision"], revisions[-1])
+
+        response = self.client.get("/registry/context/changes/", {"since": first.revision - 1, "limit": 2})
+        self.assertEqual(response.json()["revision"], revisions[1])
+
+        # the log keeps no values: only the current version of a key has one
+        self.put("b/1", 4)
+        response = self.client.get("/registry/context/changes/", {"since": first.revision - 1, "prefix": "b/"})
+        self.assertEqual([(c["version"], c["value"]) for c in response.json()["changes"]], [(1, None), (2, 4)])
+
+    def test_retention(self):
+        first, second, third = (self.put(key, 1) for key in "abc")
+        ContextChange.objects.update(timestamp=datetime.now(timezone.utc) - timedelta(days=8))
+        ContextChange.objects.filter(revision=third.revision).update(timestamp=datetime.now(timezone.utc))
+        stdout = StringIO()
+        call_command("context_retention", stdout=stdout)
+        self.assertIn("2 context changes", stdout.getvalue())
+
+        # behind the changes kept: reload the keys and follow from the revision
+        response = self.client.get("/registry/context/changes/", {"since": first.revision})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json()["revision"], third.revision)
+        response = self.client.get("/registry/context/changes/", {"since": second.revision})
+        self.assertEqual([c["key"] for c in response.json()["changes"]], ["c"])
+
+        # the latest change stays as the marker, so the revisions never go back
+        ContextChange.objects.update(timestamp=datetime.now(timezone.utc) - timedelta(days=8))
+        call_command("context_retention", stdout=StringIO())
+        self.assertEqual(context.head(), third.revision)
+        self.assertEqual(self.client.get("/registry/context/changes/", {"since": third.revision}).json()["changes"], [])
+        self.assertEqual(self.client.get("/registry/context/changes/", {"since": second.revision}).status_code, 410)
+
+    async def test_watch(self):
+        await self.async_client.aforce_login(self.user)
+        head = await sync_to_async(context.head)()
+        response = await self.async_client.get("/registry/context/watch/", {"since": head, "timeout": 0})
+        self.assertEqual(response.json(), {"revision": head, "changes": []})
+
+        watch = asyncio.create_task(self.async_client.get("/registry/context/watch/", {"since": head, "key": "b", "timeout": 10}))
+        await asyncio.sleep(0.1)
+        # a change of another key does not answer the watch
+        await sync_to_async(self.put)("a", 1)
+        await asyncio.sleep(0.1)
+        self.assertFalse(watch.done())
+        await sync_to_async(self.put)("b", 2)
+        response = await asyncio.wait_for(watch, 5)
+        self.assertEqual([(c["key"], c["value"]) for c in response.json()["changes"]], [("b", 2)])
+        self.assertEqual(await ContextChange.objects.acount(), 2)
+
+    async def test_watch_pruned(self):
+        await self.async_client.aforce_login(self.user)
+        first, second = await sync_to_async(lambda: [self.put(key, 1) for key in "ab"])()
+        await ContextChange.objects.filter(revision=first.revision).aupdate(timestamp=datetime.now(timezone.utc) - timedelta(days=1))
+        await sync_to_async(context.prune)(datetime.now(timezone.utc) - timedelta(hours=1))
+        response = await self.async_client.get("/registry/context/watch/", {"since": first.revision - 1, "timeout": 0})
+        self.assertEqual((response.status_code, response.json()["revision"]), (410, second.revision))
+
+    async def test_watch_requires_authentication(self):
+        response = await self.async_client.get("/registry/context/watch/")
+        self.assertEqual(response.status_code, 401)
+
+
+class ContextRevisionOrderTest(TransactionTestCase):
+    """The context writers are not serialized: the changes are read in revision order once committed."""
+
+    def test_writer_in_progress(self):
+        # a writer that took a lower revision and has not committed yet holds back the later changes
+        from psycopg import connect
+
+        with connect(**connection.get_connection_params()) as writer:
+            writer.execute("SELECT pg_current_xact_id()")
+            pending, = writer.execute("SELECT nextval(pg_get_serial_sequence('registry_contextchange', 'revision'))").fetchone()
+            later = context.put_many([("a", 1, None)])["a"]
+            self.assertGreater(later.revision, pending)
+            self.assertEqual(context.changes(pending - 1), (later.revision - 1, []))
+            writer.rollback()
+        self.assertEqual(context.changes(pending - 1), (later.revision, [{"revision": later.revision, "key": "a", "version": 1, "value": 1}]))
+
+
+class SeedLoadTest(APITestCase):
+    """The seed_load command generates a consistent registry and deletes it."""
+
+    def seed(self, **options):
+        call_command("seed_load", prefix="load", seed=1, customers=5, users=4, events=6, batch=2, stdout=StringIO(), **options)
+
+    def test_seed(self):
+        for options in [{}, {"no_copy": True, "distribution": "uniform"}]:
+            with self.subTest(**options):
+                self.seed(**options)
+                deliverables = Deliverable.objects.filter(project__customer__name__startswith="load-")
+                self.assertEqual(Customer.objects.filter(name__startswith="load-").count(), 5)
+                self.assertTrue(deliverables.exists())
+                self.assertFalse(deliverables.filter(document__isnull=True).exists())
+                for deliverable in deliverables:
+                    last_build = deliverable.events.filter(type="build").order_by("timestamp").last()
+                    self.assertEqual(deliverable.last_build_event_id, last_build and last_build.id)
+                self.assertTrue(ProjectMembership.objects.filter(user__username__startswith="load-user-").exists())
+
+                self.seed(delete=True)
+                self.assertFalse(Customer.objects.exists())
+                self.assertFalse(Event.objects.exists())
+                self.assertFalse(User.objects.filter(username__startswith="load-").exists())
+
+
+CRM = [
+    {"_id": "_design/views", "views": {}},
+    {"_id": "p1", "type": "person", "name": "Acme S.p.A.", "vat": "IT01234567890", "phone": "049 123", "email": "info@acme.example.com", "aliases": ["acme", "acme-old"]},
+    {"_id": "p2", "type": "person", "name": "Mario Rossi", "phone": None, "email": "mario@acme.example.com", "aliases": []},
+    {"_id": "p3", "type": "person", "name": "Città S.r.l.", "email": "info@citta.example.com", "aliases": ["citta"]},
+    {"_id": "pl1", "type": "place", "address": "via Roma 1", "zipCode": "35100", "city": "Padova", "province": "PD", "countryCode": "IT"},
+    {"_id": "r1", "type": "role", "role": "hq_place", "of": "pl1", "in": "p1"},
+    {"_id": "r2", "type": "role", "role": "Team Leader", "of": "p2", "in": "p1"},
+    {"_id": "r3", "type": "role", "role": "cook", "of": "p2", "in": "p1"},
+]
+SALES = [
+    {"_id": "f1", "type": "portfolio", "name": "Cloud", "brand": "tinga", "aliases": ["cloud"]},
+    {"_id": "b1", "type": "billing", "alias": "monthly", "description": {"every": "month"}},
+    {"_id": "pn1", "type": "plan", "name": "base", "category": {}, "discounts": [], "unit": 10, "creation": "2020-01-01T00:00:00Z"},
+    {"_id": "m1", "type": "membership", "membership": "gold", "of": "acme-old", "portfolio": "cloud", "in": "pn1", "billing": "monthly"},
+    {"_id": "m2", "type": "membership", "membership": "gold", "of": "nobody", "portfolio": "cloud", "in": "pn1", "billing": "monthly"},
+]
+
+
+class FakeCouchDB(BaseHTTPRequestHandler):
+    """
+    In-memory stand-in of the CouchDB _all_docs and _changes endpoints.
+
+    `log` has the changed documents of every database in sequence order,
+    bodies are sent in small chunks; `fail` makes every request fail.
+    """
+
+    log = {}
+    fail = False
+
+    @classmethod
+    def reset(cls):
+        cls.log = {"crm": list(CRM), "sales": list(SALES)}
+
+    @classmethod
+    def change(cls, database, doc):
+        cls.log[database].append(doc)
+
+    def send_json(self, body):
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(body), 50):
+            chunk = body[start : start + 50]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        database, _, view = url.path.strip("/").partition("/")
+        params = dict(parse_qsl(url.query))
+        if self.fail or self.headers["Authorization"] != "Basic " + b64encode(b"admin:secret").decode() or database not in self.log:
+            self.send_error(500 if self.fail else 404)
+            return
+        log = self.log[database]
+        # latest sequence of every document
+        latest = {doc["_id"]: seq for seq, doc in enumerate(log, 1)}
+        if not view:
+            self.send_json(json.dumps({"db_name": database, "update_seq": f"{len(log)}-g1"}))
+        elif view == "_all_docs":
+            docs = [log[seq - 1] for seq in latest.values() if not log[seq - 1].get("_deleted")]
+            rows = ",\r\n".join(json.dumps({"id": doc["_id"], "key": doc["_id"], "doc": doc}) for doc in docs)
+            self.send_json(f'{{"total_rows":{len(docs)},"offset":0,"rows":[\r\n{rows}\r\n]}}\n')
+        elif view == "_changes":
+            since = int(str(params["since"]).split("-")[0])
+            seqs = sorted(seq for seq in latest.values() if seq > since)[: int(params["limit"])]
+            results = [{"seq": f"{seq}-g1", "id": log[seq - 1]["_id"], "deleted": log[seq - 1].get("_deleted", False), "doc": log[seq - 1]} for seq in seqs]
+            last = results[-1]["seq"] if results else params["since"]
+            self.send_json(json.dumps({"results": results, "last_seq": last, "pending": len(latest) - len(seqs)}))
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+class RegistryImportTest(APITestCase):
+    """registry_import against a local fake CouchDB server."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCouchDB)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+
+    def setUp(self):
+        FakeCouchDB.reset()
+
+    def run_import(self, **options):
+        stdout = StringIO()
+        with self.assertLogs("registry.couchdb", "WARNING"):
+            call_command(
+                "registry_import",
+                password="secret",
+                endpoint=f"http://127.0.0.1:{self.server.server_port}",
+                crm="crm",
+                sales="sales",
+                stdout=stdout,
+                **options,
+            )
+        return stdout.getvalue()
+
+    def test_iter_rows(self):
+        body = json.dumps({"total_rows": 2, "rows": [{"id": "à"}, {"id": "b", "doc": {"rows": [1]}}]}).encode()
+        self.assertEqual(list(iter_rows(body[i : i + 1] for i in range(len(body)))), [{"id": "à"}, {"id": "b", "doc": {"rows": [1]}}])
+        with self.assertRaises(ValueError):
+            list(iter_rows([body[:-10]]))
+
+    def test_import(self):
+        # an existing customer is matched by name and keeps its id and projects
+        existing = Customer.objects.create(name="citta", company=Company.objects.create(name="old", email="old@example.com"))
+        Project.objects.create(name="rocket", customer=existing)
+
+        output = self.run_import()
+        self.assertIn("peak memory", output)
+        acme = Customer.objects.get(name="acme")
+        self.assertEqual(acme.company.vat, "IT01234567890")
+        self.assertEqual(acme.hq_place.city, "Padova")
+        self.assertEqual(acme.team_leader.name, "Mario Rossi")
+        self.assertEqual(Customer.objects.get(name="citta").company.name, "Città S.r.l.")
+        self.assertEqual(Customer.objects.get(name="citta").pk, existing.pk)
+        membership = Membership.objects.get()
+        self.assertEqual((membership.of, membership.portfolio.name, membership.plan.unit, membership.billing.alias), (acme, "Cloud", 10, "monthly"))
+        self.assertEqual(membership.plan.creation.year, 2020)
+        self.assertEqual(membership.id, doc_uuid("m1"))
+
+        counts = [model.objects.count() for model in (Person, Place, Company, Customer, Plan, Portfolio, Billing, Membership, MembershipType)]
+        self.run_import()
+        self.assertEqual([model.objects.count() for model in (Person, Place, Company, Customer, Plan, Portfolio, Billing, Membership, MembershipType)], counts)
+
+    def test_import_streamed(self):
+        # each batch is written while the database is still read, and the sales database is read meanwhile
+        couchdb_docs, written, sales_read, overlapped = CouchDB.all_docs, [], threading.Event(), []
+
+        def all_docs(couchdb, database):
+            for doc in couchdb_docs(couchdb, database):
+                if database == "sales":
+                    sales_read.set()
+                else:
+                    written.append(Person.objects.count())
+                yield doc
+            if database == "crm":
+                overlapped.append(sales_read.wait(5))
+
+        with mock.patch.object(CouchDB, "all_docs", all_docs):
+            self.run_import(batch=1)
+        self.assertEqual(written[:3], [0, 0, 1])
+        self.assertEqual(overlapped, [True])
+        self.assertEqual(Customer.objects.get(name="acme").team_leader.name, "Mario Rossi")
+        self.assertEqual(Membership.objects.get().id, doc_uuid("m1"))
+
+    def test_import_deleted(self):
+        manual = Person.objects.create(name="Anna Verdi", email="anna@example.com")
+        FakeCouchDB.change("sales", {"_id": "pn2", "type": "plan", "name": "extra", "category": {}, "discounts": [], "unit": 1, "creation": "2021-01-01T00:00:00Z"})
+        self.run_import()
+        self.assertTrue(Plan.objects.filter(pk=doc_uuid("pn2")).exists())
+
+        # the rows of the documents missing from a full import are deleted, the referenced and the registry ones are kept
+        FakeCouchDB.reset()
+        FakeCouchDB.log["crm"] = [doc for doc in CRM if doc["_id"] not in ("p2", "r2", "p3", "pl1")]
+        self.run_import()
+        self.assertFalse(Plan.objects.filter(pk=doc_uuid("pn2")).exists())
+        self.assertFalse(Person.objects.filter(pk=doc_uuid("p2")).exists())
+        self.assertFalse(Customer.objects.filter(name="citta").exists())
+        self.assertFalse(Company.objects.filter(pk=doc_uuid("p3")).exists())
+        self.assertFalse(Place.objects.exists())
+        self.assertTrue(Person.objects.filter(pk=manual.pk).exists())
+        acme = Customer.objects.get(name="acme")
+        self.assertEqual((acme.team_leader, acme.hq_place), (None, None))
+        self.assertEqual(Membership.objects.get().of, acme)
+
+    def test_prefetch(self):
+        def docs():
+            yield {"_id": "a"}
+            raise ValueError("Truncated CouchDB response")
+
+        prefetch = Prefetch(docs(), 1)
+        self.assertEqual(next(prefetch), {"_id": "a"})
+        with self.assertRaises(ValueError):
+            next(prefetch)
+        prefetch.close()
+
+    def test_unavailable(self):
+        FakeCouchDB.fail = True
+        self.addCleanup(setattr, FakeCouchDB, "fail", False)
+        with self.assertRaises(CommandError):
+            call_command("registry_import", password="secret", endpoint=f"http://127.0.0.1:{self.server.server_port}", crm="crm", sales="sales", stdout=StringIO())
+        self.assertFalse(Person.objects.exists())
+
+    def test_sync(self):
+        self.run_import()
+        self.assertEqual(Context.objects.get(key="couchdb/crm/seq").value, {"seq": f"{len(CRM)}-g1"})
+
+        FakeCouchDB.change("crm", {**CRM[2], "name": "Mario Bianchi"})
+        FakeCouchDB.change("crm", {"_id": "p4", "type": "person", "name": "Beta", "email": "info@beta.example.com", "aliases": ["beta", "b"]})
+        FakeCouchDB.change("crm", {"_id": "pl2", "type": "place", "address": "via Po 2", "zipCode": "10100", "city": "Torino", "province": "TO", "countryCode": "IT"})
+        FakeCouchDB.change("crm", {"_id": "r4", "type": "role", "role": "bu_place", "of": "pl2", "in": "p1"})
+        FakeCouchDB.change("crm", {"_id": "pl2", "type": "place", "address": "via Po 3", "zipCode": "10100", "city": "Torino", "province": "TO", "countryCode": "IT"})
+        FakeCouchDB.change("sales", {"_id": "m3", "type": "membership", "membership": "silver", "of": "b", "portfolio": "cloud", "in": "pn1", "billing": "monthly"})
+        FakeCouchDB.change("sales", {"_id": "m1", "_deleted": True})
+
+        stdout = StringIO()
+        call_command("registry_import", password="secret", endpoint=f"http://127.0.0.1:{self.server.server_port}", crm="crm", sales="sales", sync=True, limit=2, stdout=stdout)
+        # the two changes of pl2 are read as one, like CouchDB does
+        self.assertIn("6 changes applied", stdout.getvalue())
+        acme = Customer.objects.get(name="acme")
+        self.assertEqual((acme.team_leader.name, acme.hq_place.city, acme.bu_place.address), ("Mario Bianchi", "Padova", "via Po 3"))
+        # the membership of the sales database refers to an alias of the synced CRM
+        self.assertEqual(Membership.objects.get().of.name, "beta")
+        self.assertEqual(Context.objects.get(key="couchdb/sales/seq").value, {"seq": f"{len(SALES) + 2}-g1"})
+
+        # caught up: nothing to apply
+        stdout = StringIO()
+        call_command("registry_import", password="secret", endpoint=f"http://127.0.0.1:{self.server.server_port}", crm="crm", sales="sales", sync=True, stdout=stdout)
+        self.assertIn("0 changes applied", stdout.getvalue())
+
+        # an edited role document moves its role, a deleted one clears it unless another document has set it since
+        def sync():
+            call_command("registry_import", password="secret", endpoint=f"http://127.0.0.1:{self.server.server_port}", crm="crm", sales="sales", sync=True, stdout=StringIO())
+
+        FakeCouchDB.change("crm", {**CRM[5], "role": "operative"})
+        sync()
+        acme.refresh_from_db()
+        self.assertEqual((acme.hq_place, acme.bu_place.city), (None, "Padova"))
+        FakeCouchDB.change("crm", {"_id": "r4", "_deleted": True})
+        sync()
+        acme.refresh_from_db()
+        self.assertEqual(acme.bu_place.city, "Padova")
+        FakeCouchDB.change("crm", {"_id": "r1", "_deleted": True})
+        sync()
+        acme.refresh_from_db()
+        self.assertIsNone(acme.bu_place)
+        self.assertEqual(acme.team_leader.name, "Mario Bianchi")
+
+        # a person still referenced by a customer role is cleared from the role, a company is kept
+        FakeCouchDB.change("crm", {"_id": "p2", "_deleted": True})
+        FakeCouchDB.change("crm", {"_id": "p1", "_deleted": True})
+        with self.assertLogs("registry.couchdb", "WARNING"):
+            call_command("registry_import", password="secret", endpoint=f"http://127.0.0.1:{self.server.server_port}", crm="crm", sales="sales", sync=True, stdout=StringIO())
+        acme.refresh_from_db()
+        self.assertIsNone(acme.team_leader)
+        self.assertFalse(Person.objects.filter(name="Mario Bianchi").exists())
+        self.assertEqual(acme.company.name, "Acme S.p.A.")
+
+    def test_sync_conflict(self):
+        # a sync that read the checkpoint before another one committed a batch does not apply it again
+        self.run_import()
+        FakeCouchDB.change("crm", {**CRM[2], "name": "Mario Bianchi"})
+        couchdb = CouchDB(f"http://127.0.0.1:{self.server.server_port}", "admin", "secret")
+        importer = Importer()
+        context.put_many([("couchdb/crm/seq", {"seq": "0"}, None)])
+        with mock.patch("registry.couchdb.get_many", return_value={}), self.assertLogs("registry.couchdb", "WARNING"):
+            with self.assertRaises(context.VersionConflict):
+                importer.sync(couchdb, "crm")
+        self.assertEqual(Person.objects.get(pk=doc_uuid("p2")).name, "Mario Rossi")
+
+
+class EventPartitionTest(APITestCase):
+    """Monthly partitions of the events and their retention."""
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="acme", company=Company.objects.create(name="acme", email="info@example.com"))
+        cls.deliverable = Deliverable.objects.create(name="rocket", project=Project.objects.create(name="rocket", customer=customer), repository="https://example.com")
+        cls.month = month_start(datetime.now(timezone.utc))
+
+    def create_event(self, id, timestamp):
+        return Event.objects.create(
+            id=id, deliverable=self.deliverable, outcome="success", timestamp=timestamp, type="build", stage="staging", version="1.0.0", source_code_uri="https://example.com"
+        )
+
+    def partition_of(self, event_id):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM registry_event WHERE id = %s", [event_id])
+            return cursor.fetchone()[0]
+
+    def test_partitions(self):
+        self.assertLessEqual({add_months(self.month, n) for n in range(4)}, set(partitions()))
+        self.assertEqual(ensure_partitions(), [])
+
+        # without its partition, an event goes to the default one until the partition is created
+        future = add_months(self.month, 12)
+        self.create_event("future", future.replace(day=10))
+        self.assertEqual(self.partition_of("future"), "registry_event_default")
+        self.assertEqual(ensure_partitions(), [partition_name(future)])
+        self.assertEqual(self.partition_of("future"), partition_name(future))
+        self.assertEqual(self.deliverable.events.get().id, "future")
+
+    def test_unique_ids(self):
+        event = self.create_event("build-1", self.month.replace(day=2))
+        # the primary key includes the timestamp: the id is unique through registry_event_id
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.create_event("build-1", add_months(self.month, 1))
+
+        # moved to another partition and back, the id stays claimed by the event
+        Event.objects.filter(id="build-1").update(timestamp=add_months(self.month, 1))
+        self.assertEqual(self.partition_of("build-1"), partition_name(add_months(self.month, 1)))
+        Event.objects.filter(id="build-1").update(timestamp=event.timestamp, version="1.0.1")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.create_event("build-1", add_months(self.month, -1))
+
+        # insert_events skips the taken ids instead of failing
+        duplicate = Event(id="build-1", deliverable=self.deliverable, outcome="success", timestamp=add_months(self.month, 2), type="build", stage="staging", version="2.0.0", source_code_uri="")
+        new = Event(id="build-2", deliverable=self.deliverable, outcome="success", timestamp=add_months(self.month, 2), type="build", stage="staging", version="2.0.0", source_code_uri="")
+        self.assertEqual(insert_events([duplicate, new]), {"build-2"})
+        self.assertEqual(Event.objects.get(id="build-1").version, "1.0.1")
+        # the setting is restored: the next duplicate fails again
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.create_event("build-2", self.month)
+
+        # a deleted id can be used again
+        Event.objects.filter(id="build-1").delete()
+        self.create_event("build-1", add_months(self.month, 1))
+        self.assertEqual(self.partition_of("build-1"), partition_name(add_months(self.month, 1)))
+
+    def test_retention(self):
+        ensure_partitions(now=add_months(self.month, -3))
+        for n in range(4):
+            self.create_event(f"event-{n}", add_months(self.month, -n).replace(day=2))
+        self.create_event("ancient", datetime(2001, 1, 1, tzinfo=timezone.utc))
+        # the deferred foreign key checks of the rows inserted by the test transaction would prevent DROP TABLE
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        with tempfile.TemporaryDirectory() as archive:
+            stdout = StringIO()
+            call_command("events_retention", months=2, dry_run=True, stdout=stdout)
+            self.assertIn(f"{partition_name(add_months(self.month, -2))} would be dropped", stdout.getvalue())
+            self.assertEqual(Event.objects.count(), 5)
+
+            call_command("events_retention", months=2, archive=archive, stdout=StringIO())
+            self.assertEqual(set(Event.objects.values_list("id", flat=True)), {"event-0", "event-1"})
+            document = json.loads(DeliverableDocument.objects.get(deliverable=self.deliverable).body)
+            self.assertEqual([event["id"] for event in document["latest_build_events"]], ["event-0", "event-1"])
+            self.assertNotIn(add_months(self.month, -2), partitions())
+            with gzip.open(f"{archive}/{partition_name(add_months(self.month, -3))}.csv.gz", "rt") as rows:
+                self.assertEqual([row.split(",")[0] for row in rows], ["id", "event-3"])
+        # the ids of the dropped events are released
+        self.create_event("event-3", self.month)
+        self.create_event("ancient", self.month)
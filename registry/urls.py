@@ -7,6 +7,7 @@ from registry import views
 router = routers.DefaultRouter()
 router.register("places", views.PlaceViewSet)
 router.register("people", views.PersonViewSet)
+router.register("companies", views.CompanyViewSet)
 router.register("billings", views.BillingViewSet)
 router.register("plans", views.PlanViewSet)
 router.register("membership", views.MembershipViewSet)
@@ -14,5 +15,7 @@ router.register("context", views.ContextViewSet)
 router.register("customers", views.CustomerViewSet)
 
 urlpatterns = [
+    # async long-poll view, before the context/<key>/ routes
+    path("context/watch/", views.watch_context),
     path("", include(router.urls)),
 ]
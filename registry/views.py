@@ -1,10 +1,24 @@
+import asyncio
 import logging
 
-from rest_framework import viewsets
-from rest_framework.pagination import PageNumberPagination
+from asgiref.sync import sync_to_async
 
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from authentication.functions.membership import get_memberships
+from registry import context
+from registry.filters import FieldFilter, PrefixFilter, Search
+from registry.pagination import RegistryCursorPagination
 from registry.serializers import (
     BillingSerializer,
+    CompanySerializer,
     ContextSerializer,
     CustomerSerializer,
     MembershipSerializer,
@@ -13,6 +27,7 @@ from registry.serializers import (
     PersonSerializer,
 )
 from registry.models import (
+    Company,
     Context,
     Customer,
     Place,
@@ -21,41 +36,353 @@ from registry.models import (
     Plan,
     Membership,
 )
+from tars.broadcast import broadcaster
+from tars.renderers import NDJSONRenderer, encode_json, stream_json_array, stream_ndjson
 
 log = logging.getLogger(__name__)
 
-class PersonViewSet(viewsets.ReadOnlyModelViewSet):
+# Rows read per round trip by the streamed lists
+STREAM_CHUNK_SIZE = 500
+
+# Maximum number of changes returned by context/changes/ and context/watch/
+CHANGES_LIMIT = 1000
+
+# Default and maximum time (seconds) context/watch/ waits for a change
+WATCH_TIMEOUT = 30
+WATCH_MAX_TIMEOUT = 300
+
+
+class RegistryViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Read-only registry endpoint with ?limit= / ?cursor= pagination, `filter_fields` filters and ?q= search.
+
+    Subclasses set `cursor_ordering` (ending with a unique field), and the
+    `filter_fields` / `search_fields` they support.
+    """
+
+    pagination_class = RegistryCursorPagination
+    filter_backends = [FieldFilter, Search]
+    cursor_ordering = ("id",)
+
+
+class PersonViewSet(RegistryViewSet):
     queryset = Person.objects.all()
     serializer_class = PersonSerializer
+    cursor_ordering = ("name", "id")
+    filter_fields = {"name": "name__iexact", "email": "email__iexact"}
+    search_fields = ["^name", "^email"]
 
 
-class PlaceViewSet(viewsets.ReadOnlyModelViewSet):
+class PlaceViewSet(RegistryViewSet):
     queryset = Place.objects.all()
     serializer_class = PlaceSerializer
+    cursor_ordering = ("city", "id")
+    filter_fields = {"city": "city__iexact", "country": "country_code__iexact"}
+    search_fields = ["^city", "^address"]
 
 
-class BillingViewSet(viewsets.ReadOnlyModelViewSet):
+class CompanyViewSet(RegistryViewSet):
+    queryset = Company.objects.all()
+    serializer_class = CompanySerializer
+    cursor_ordering = ("name", "id")
+    filter_fields = {"vat": "vat__iexact"}
+    search_fields = ["^name", "^vat"]
+
+
+class BillingViewSet(RegistryViewSet):
     queryset = Billing.objects.all()
     serializer_class = BillingSerializer
 
 
-class PlanViewSet(viewsets.ReadOnlyModelViewSet):
+class PlanViewSet(RegistryViewSet):
     queryset = Plan.objects.all()
     serializer_class = PlanSerializer
 
 
-class MembershipViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Membership.objects.all()
+class MembershipViewSet(RegistryViewSet):
+    # the nested plan, billing, portfolio and membership type are read in the same query
+    queryset = Membership.objects.select_related("plan", "billing", "portfolio", "membership")
     serializer_class = MembershipSerializer
 
+    def get_queryset(self):
+        # only the memberships of the customers of the projects the user is a member of
+        return get_memberships(self.request).scope(super().get_queryset(), customer="of")
+
 
-class CustomerViewSet(viewsets.ReadOnlyModelViewSet):
+class CustomerViewSet(RegistryViewSet):
     lookup_field = "name"
-    queryset = Customer.objects.all()
+    # the whole graph of CustomerSerializer in a single query, whatever the number of customers
+    queryset = Customer.objects.select_related(
+        "company",
+        "hq_place",
+        "bu_place",
+        "team_leader",
+        "purchase_manager",
+        "engineering_director",
+        "marketing_director",
+        "membership__plan",
+        "membership__billing",
+        "membership__portfolio",
+        "membership__membership",
+    )
     serializer_class = CustomerSerializer
+    cursor_ordering = ("name",)
+    search_fields = ["^name"]
+
+    def get_queryset(self):
+        # only the customers of the projects the user is a member of
+        return get_memberships(self.request).scope(super().get_queryset(), customer="id")
     
 
+def _version(value):
+    """Version (or revision) sent by the client: None (no check) or an integer >= 0, ValueError otherwise."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not str(value).isdigit():
+        raise ValueError(f"invalid version {value!r}")
+    return int(value)
+
+
+def _key(value):
+    """Key sent by the client, ValueError if it cannot be stored."""
+    if not isinstance(value, str) or not value:
+        raise ValueError("every item needs a key and a value")
+    if len(value) > Context._meta.get_field("key").max_length:
+        raise ValueError(f"key too long: {value!r}")
+    return value
+
+
+def _changes_params(params):
+    """since, key, prefix and limit of a changes / watch request, ValueError if invalid."""
+    since = _version(params.get("since")) or 0
+    limit = _version(params.get("limit")) or CHANGES_LIMIT
+    if not 0 < limit <= CHANGES_LIMIT:
+        raise ValueError(f"limit must be between 1 and {CHANGES_LIMIT}")
+    return since, params.get("key"), params.get("prefix"), limit
+
+
+def _pruned(error):
+    return {"detail": "since is older than the changes kept, reload the keys and follow from revision", "revision": error.revision}
+
+
+def _conflict(error):
+    return Response({"detail": "version conflict", "versions": error.versions}, status=status.HTTP_409_CONFLICT)
+
+
 class ContextViewSet(viewsets.ModelViewSet):
+    """
+    Key/value store over Context.
+
+    Every write increments the version of the key. PUT, PATCH and DELETE
+    accept the version the client read ("version" in the body, ?version=
+    for DELETE) and answer 409 with the current version if the key changed
+    meanwhile. PATCH merges the object in the body into the stored value in
+    the database (null removes a key). mget/mput read and write many keys
+    in a single request.
+
+    Keys are hierarchical ("project/x/feature"): the list accepts ?prefix=
+    to read a namespace, paginated (?limit= / ?cursor=) or streamed
+    (?format=ndjson, ?stream=true), and subtree/?prefix= deletes it.
+
+    Every write gets a global revision: changes/?since= lists the changes
+    after a revision and watch/ (watch_context) waits for them.
+    """
+
     queryset = Context.objects.all()
     serializer_class = ContextSerializer
-    pagination_class = PageNumberPagination
+    renderer_classes = [JSONRenderer, BrowsableAPIRenderer, NDJSONRenderer]
+    pagination_class = RegistryCursorPagination
+    cursor_ordering = ("key",)
+    filter_backends = [PrefixFilter]
+    prefix_field = "key"
+    # keys can contain slashes and dots
+    lookup_value_regex = ".+"
+
+    def list(self, request, *args, **kwargs):
+        streaming = request.accepted_renderer.format == NDJSONRenderer.format or request.query_params.get("stream") in ("1", "true")
+        if not streaming:
+            return super().list(request, *args, **kwargs)
+
+        # read with a server side cursor and sent one key at a time, whatever the size of the namespace
+        rows = (
+            encode_json({"key": key, "value": value, "version": version, "revision": revision}).decode()
+            for key, value, version, revision in self.filter_queryset(self.get_queryset())
+            .order_by("key")
+            .values_list("key", "value", "version", "revision")
+            .iterator(chunk_size=STREAM_CHUNK_SIZE)
+        )
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return StreamingHttpResponse(stream_ndjson(rows), content_type=NDJSONRenderer.media_type)
+        return StreamingHttpResponse(stream_json_array(rows), content_type="application/json")
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            stored = context.put_many([(serializer.validated_data["key"], serializer.validated_data["value"], 0)])
+        except context.VersionConflict as error:
+            return _conflict(error)
+        return Response(self.get_serializer(stored[serializer.validated_data["key"]]).data, status=status.HTTP_201_CREATED)
+
+    def update(self, request, *args, **kwargs):
+        # PUT creates the key if missing (or if "version" is 0), with the add_context permission as for POST
+        if "value" not in request.data:
+            return Response({"value": ["This field is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            key = _key(kwargs[self.lookup_field])
+            stored = context.put_many(
+                [(key, request.data["value"], _version(request.data.get("version")))],
+                create=request.user.has_perm("registry.add_context"),
+            )
+        except ValueError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        except context.VersionConflict as error:
+            return _conflict(error)
+        except Context.DoesNotExist:
+            raise PermissionDenied("Creating a key requires the add_context permission.")
+        return Response(self.get_serializer(stored[key]).data)
+
+    def partial_update(self, request, *args, **kwargs):
+        patch = request.data.get("value")
+        if not isinstance(patch, dict):
+            return Response({"value": ["Expected an object to merge into the stored value."]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            merged = context.merge(kwargs[self.lookup_field], patch, _version(request.data.get("version")))
+        except ValueError as error:
+            return Response({"version": [str(error)]}, status=status.HTTP_400_BAD_REQUEST)
+        except Context.DoesNotExist:
+            raise Http404
+        except context.VersionConflict as error:
+            return _conflict(error)
+        return Response(self.get_serializer(merged).data)
+
+    def destroy(self, request, *args, **kwargs):
+        key = kwargs[self.lookup_field]
+        try:
+            version = _version(request.query_params.get("version"))
+        except ValueError as error:
+            return Response({"version": [str(error)]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            deleted = context.delete(key, version)
+        except context.VersionConflict as error:
+            return _conflict(error)
+        if not deleted:
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=["get"])
+    def mget(self, request):
+        """GET ?key=a&key=b: {key: {"value", "version", "revision"}} of the stored keys, in a single query."""
+        keys = request.query_params.getlist("key")
+        if not keys:
+            return Response({"key": ["At least one key is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        contexts = context.get_many(keys)
+        return Response({key: {"value": c.value, "version": c.version, "revision": c.revision} for key, c in contexts.items()})
+
+    @action(detail=False, methods=["post"])
+    def mput(self, request):
+        """
+        POST [{"key", "value", "version"?}, ...]: store all the keys or none of them.
+
+        Answers {key: {"value", "version", "revision"}} of the stored keys, or 409 with the
+        current versions of the keys whose "version" does not match. The keys are created
+        or overwritten: both add_context (POST) and change_context are required.
+        """
+        if not request.user.has_perm("registry.change_context"):
+            raise PermissionDenied("Writing keys requires the change_context permission.")
+        if not isinstance(request.data, list) or not request.data:
+            return Response({"detail": "Expected a non empty list of {key, value, version}."}, status=status.HTTP_400_BAD_REQUEST)
+        items = []
+        try:
+            for item in request.data:
+                if not isinstance(item, dict) or "value" not in item:
+                    raise ValueError("every item needs a key and a value")
+                items.append((_key(item.get("key")), item["value"], _version(item.get("version"))))
+        except ValueError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        if len({key for key, _, _ in items}) != len(items):
+            return Response({"detail": "duplicated keys"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            stored = context.put_many(items)
+        except context.VersionConflict as error:
+            return _conflict(error)
+        return Response({key: {"value": c.value, "version": c.version, "revision": c.revision} for key, c in stored.items()})
+
+    @action(detail=False, methods=["delete"])
+    def subtree(self, request):
+        """DELETE ?prefix=project/x/: delete every key of the namespace, in a single query."""
+        prefix = request.query_params.get("prefix")
+        if not prefix:
+            return Response({"prefix": ["A non empty prefix is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"deleted": context.delete_prefix(prefix)})
+
+    @action(detail=False, methods=["get"])
+    def changes(self, request):
+        """
+        GET ?since=REV[&key=|&prefix=][&limit=]: changes after the revision since, oldest first.
+
+        Answers {"revision", "changes": [{"revision", "key", "version", "value"}]}
+        (version 0 for deleted keys, value null once the version is not the
+        current one); pass "revision" as since of the next request.
+        context/watch/ waits for the next change instead. A since older than
+        the changes kept (context_retention) is answered 410 with the
+        revision to follow from after reloading the keys.
+        """
+        try:
+            since, key, prefix, limit = _changes_params(request.query_params)
+        except ValueError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            revision, changes = context.changes(since, prefix, key, limit)
+        except context.ChangesPruned as error:
+            return Response(_pruned(error), status=status.HTTP_410_GONE)
+        return Response({"revision": revision, "changes": changes})
+
+
+def _authenticate_watch(request):
+    # same authentication and permissions as ContextViewSet (view_context)
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    user = drf_request.user
+    return user.is_authenticated, user.is_authenticated and user.has_perm("registry.view_context")
+
+
+async def watch_context(request):
+    """
+    GET context/watch/?since=REV[&key=|&prefix=][&timeout=]: long-poll for the changes after since.
+
+    Same parameters and response as context/changes/, but without changes
+    the request waits up to `timeout` seconds for the next matching one.
+    An async view: served by an ASGI server (tars.asgi) a waiting client
+    costs only a coroutine.
+    """
+    authenticated, allowed = await sync_to_async(_authenticate_watch)(request)
+    if not authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    if not allowed:
+        return JsonResponse({"detail": "You do not have permission to perform this action."}, status=403)
+    try:
+        since, key, prefix, limit = _changes_params(request.GET)
+        timeout = _version(request.GET.get("timeout"))
+    except ValueError as error:
+        return JsonResponse({"detail": str(error)}, status=400)
+    timeout = min(WATCH_TIMEOUT if timeout is None else timeout, WATCH_MAX_TIMEOUT)
+
+    await sync_to_async(context.start_listener)()
+    deadline = asyncio.get_running_loop().time() + timeout
+    # subscribed before reading, so a change committed meanwhile still wakes the request
+    async with broadcaster.subscribe(context.CHANNEL) as subscription:
+        while True:
+            try:
+                revision, changes = await sync_to_async(context.changes)(since, prefix, key, limit)
+            except context.ChangesPruned as error:
+                return JsonResponse(_pruned(error), status=410)
+            remaining = deadline - asyncio.get_running_loop().time()
+            if changes or remaining <= 0:
+                break
+            # changes of other keys move the revision without waking up the client
+            since = revision
+            try:
+                await asyncio.wait_for(subscription.get(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    return JsonResponse({"revision": revision, "changes": changes})
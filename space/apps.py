@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SpaceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'space'
+
+    def ready(self):
+        # keep import here, signal handlers need the models to be loaded
+        from space import signals  # noqa: F401
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.db.models import Exists, OuterRef, QuerySet, Subquery, Window
+from django.db.models.functions import Now, RowNumber
+
+from registry.models import Deliverable, Event
+
+# Build events listed in the latest_build_events of a deliverable document
+LATEST_BUILD_EVENTS = getattr(settings, "SPACE_LATEST_BUILD_EVENTS", 5)
+
+# Deliverable columns describing the last build, and the Event field each one is taken from
+LAST_BUILD_FIELDS = {
+    "last_build_event_id": "id",
+    "last_build_outcome": "outcome",
+    "last_build_timestamp": "timestamp",
+    "last_build_stage": "stage",
+    "last_build_version": "version",
+    "source_code_uri": "source_code_uri",
+    "external_ref": "external_ref",
+    "external_ref_uri": "external_ref_uri",
+}
+
+
+def update_last_build(deliverable_ids) -> int:
+    """
+    Copy the latest build event of each deliverable into its last_build_* columns.
+
+    A single UPDATE statement whatever the number of deliverables.
+    """
+    builds = Event.objects.filter(deliverable=OuterRef("pk"), type="build")
+    latest = builds.order_by("-timestamp", "-id")
+    return Deliverable.objects.filter(Exists(builds), pk__in=deliverable_ids).update(
+        updated_at=Now(),
+        **{column: Subquery(latest.values(field)[:1]) for column, field in LAST_BUILD_FIELDS.items()},
+    )
+
+
+def latest_builds(deliverable_ids, limit: int = LATEST_BUILD_EVENTS, events: QuerySet | None = None) -> dict:
+    """
+    The latest `limit` build events of each deliverable, most recent first.
+
+    A single query whatever the number of deliverables: the events are
+    numbered per deliverable by ROW_NUMBER() OVER (PARTITION BY deliverable
+    ORDER BY timestamp DESC) and the first ones are kept. `events` selects
+    the Event manager (the historical model in migrations).
+    Returns {deliverable id: [Event]}, deliverables without builds are missing.
+    """
+    if events is None:
+        events = Event.objects.all()
+    rows = (
+        events.filter(type="build", deliverable_id__in=deliverable_ids)
+        .annotate(position=Window(RowNumber(), partition_by="deliverable_id", order_by=("-timestamp", "-id")))
+        .filter(position__lte=limit)
+        .order_by("deliverable_id", "position")
+    )
+    builds = {}
+    for event in rows:
+        builds.setdefault(event.deliverable_id, []).append(event)
+    return builds
@@ -0,0 +1,172 @@
+import threading
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+
+from registry.models import Customer, Deliverable, Project
+
+# Cache aliases (settings.CACHES) of the two tiers: the local one is required, the shared one is optional
+LOCAL_CACHE = "space"
+SHARED_CACHE = "space_shared"
+
+# Scope of the documents that are the same for every user allowed to read them
+ALL = "*"
+
+# Key of the whole GET /deliverables/ body
+DELIVERABLES_KEY = ("deliverables",)
+
+
+def customer_key(customer):
+    return ("customer", customer)
+
+
+def project_key(customer, project):
+    return ("project", customer, project)
+
+
+def deliverable_key(customer, project, deliverable):
+    return ("deliverable", customer, project, deliverable)
+
+
+class TreeCache:
+    """
+    Two tier cache of the encoded space documents (customers, projects, deliverables).
+
+    Lookups go to the in-process LRU tier first, then to the shared tier if
+    configured. Every entry is stored with the change token computed by the
+    conditional GET marker of the view (space.conditional) and is returned
+    only while the token matches, so entries left in the local tier of other
+    processes are never served after a change. The signal handlers evict
+    the changed entries from both tiers as soon as a transaction commits.
+    """
+
+    def __init__(self, local=LOCAL_CACHE, shared=SHARED_CACHE):
+        self._local_alias = local
+        self._shared_alias = shared
+        self._lock = threading.Lock()
+        self._stats = {"local_hits": 0, "shared_hits": 0, "misses": 0, "stale": 0, "invalidations": 0}
+
+    @property
+    def local(self):
+        return caches[self._local_alias]
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias] if self._shared_alias in settings.CACHES else None
+
+    @staticmethod
+    def make_key(key):
+        # names can contain any character: hash them into keys valid for every backend
+        return "space:" + sha256("\x1f".join(key).encode()).hexdigest()
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _entry(self, cache_key):
+        tier = "local_hits"
+        entry = self.local.get(cache_key)
+        if entry is None and self.shared is not None:
+            tier = "shared_hits"
+            entry = self.shared.get(cache_key)
+            if entry is not None:
+                self.local.set(cache_key, entry)
+        return tier, entry
+
+    def get(self, key, token, scope=ALL):
+        """
+        Cached body of the key for the given change token, or None (always without a token).
+
+        Documents whose content depends on the projects visible to the user
+        are stored once per scope (authentication.functions.membership) in
+        the same entry, so evicting the key drops all of them.
+        """
+        if token is None:
+            return None
+        tier, entry = self._entry(self.make_key(key))
+        if entry is None or (entry[0] == token and scope not in entry[1]):
+            self._count("misses")
+            return None
+        if entry[0] != token:
+            self._count("stale")
+            return None
+        self._count(tier)
+        return entry[1][scope]
+
+    def set(self, key, token, body, scope=ALL):
+        """Store the body of the key for the given change token (nothing is stored without a token)."""
+        if token is None:
+            return
+        cache_key = self.make_key(key)
+        _, entry = self._entry(cache_key)
+        bodies = dict(entry[1]) if entry is not None and entry[0] == token else {}
+        bodies[scope] = body
+        self.local.set(cache_key, (token, bodies))
+        if self.shared is not None:
+            self.shared.set(cache_key, (token, bodies))
+
+    def get_or_build(self, key, token, build, scope=ALL):
+        """Cached body of the key, built and stored by `build()` on a miss."""
+        body = self.get(key, token, scope)
+        if body is None:
+            body = build()
+            self.set(key, token, body, scope)
+        return body
+
+    def delete_many(self, keys):
+        cache_keys = [self.make_key(key) for key in keys]
+        self.local.delete_many(cache_keys)
+        if self.shared is not None:
+            self.shared.delete_many(cache_keys)
+        with self._lock:
+            self._stats["invalidations"] += len(cache_keys)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["local_hits"] + stats["shared_hits"] + stats["misses"] + stats["stale"]
+        stats["hit_ratio"] = (stats["local_hits"] + stats["shared_hits"]) / lookups if lookups else None
+        stats["shared_tier"] = self.shared is not None
+        return stats
+
+
+tree_cache = TreeCache()
+
+
+def tree_keys(customer_ids=(), project_ids=(), deliverable_ids=()):
+    """
+    Keys of the cached documents that depend on the given customers, projects and deliverables.
+
+    A customer document lists its projects, a project document its
+    deliverables; deliverable documents contain the names of their project
+    and customer, so changes propagate down the tree as well.
+    """
+    keys = {DELIVERABLES_KEY}
+    if customer_ids:
+        keys |= {customer_key(name) for name in Customer.objects.filter(pk__in=customer_ids).values_list("name", flat=True)}
+
+    if customer_ids or project_ids:
+        projects = Project.objects.filter(Q(pk__in=project_ids) | Q(customer_id__in=customer_ids)).values_list("customer__name", "name")
+        for customer, project in projects:
+            keys |= {customer_key(customer), project_key(customer, project)}
+
+    deliverables = Deliverable.objects.filter(
+        Q(pk__in=deliverable_ids) | Q(project_id__in=project_ids) | Q(project__customer_id__in=customer_ids)
+    ).values_list("project__customer__name", "project__name", "name")
+    for customer, project, deliverable in deliverables:
+        keys |= {project_key(customer, project), deliverable_key(customer, project, deliverable)}
+    return keys
+
+
+def invalidate_tree(customer_ids=(), project_ids=(), deliverable_ids=()):
+    """
+    Evict the documents depending on the given objects once the current transaction commits.
+
+    The keys are computed immediately, while the rows still have the names
+    (and exist) they had before the change.
+    """
+    keys = tree_keys(customer_ids, project_ids, deliverable_ids)
+    transaction.on_commit(lambda: tree_cache.delete_many(keys))
@@ -0,0 +1,136 @@
+from functools import wraps
+from hashlib import sha256
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from authentication.functions.membership import get_memberships
+from registry.models import Customer, Deliverable, Project
+from space.models import DeliverableDocument
+
+
+def conditional(marker):
+    """
+    Gestisce le GET condizionali (If-None-Match / If-Modified-Since) di una vista space.
+
+    `marker(request, *args, **kwargs)` restituisce un economico indicatore di modifica
+    (token, ultima modifica) oppure None se la risorsa non esiste. Se il client ha già
+    la versione corrente viene risposto 304 senza eseguire la vista, altrimenti alla
+    risposta vengono aggiunti gli header ETag e, se l'ultima modifica è nota, Last-Modified.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            change = marker(request, *args, **kwargs)
+            request.change_token = None
+            if change is None:
+                return view(request, *args, **kwargs)
+
+            token, last_modified = change
+            # la vista può usare il token per validare le risposte in cache (space.cache)
+            request.change_token = token
+            # la stessa risorsa cambia rappresentazione in base a query string, formato, utente e progetti visibili all'utente
+            etag = quote_etag(sha256("|".join([
+                str(token),
+                request.get_full_path(),
+                request.accepted_media_type or "",
+                str(request.user.pk),
+                get_memberships(request).key,
+            ]).encode()).hexdigest())
+            last_modified = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+            response.headers["ETag"] = etag
+            if last_modified:
+                response.headers["Last-Modified"] = http_date(last_modified)
+            # i client devono sempre rivalidare, la rivalidazione costa solo la query dell'indicatore
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _marker(last_modified=None, **aggregate):
+    """
+    Token (versioni e conteggi) da un risultato di aggregate() e data di ultima modifica.
+
+    La data va passata solo per le risorse di una singola riga: per elenchi e aggregati
+    Max(updated_at) non cambia quando una riga viene cancellata, il 304 di If-Modified-Since
+    sarebbe sbagliato. Restano validati dal solo ETag, il cui token include i conteggi.
+    """
+    token = ",".join(f"{key}={value.isoformat() if hasattr(value, 'isoformat') else value}" for key, value in sorted(aggregate.items()))
+    return token, last_modified
+
+
+# Indicatori di modifica delle viste space, calcolati con query aggregate sugli indici
+
+def customers_marker(request):
+    customers = Customer.objects.aggregate(customers=Count("id"), customers_at=Max("updated_at"))
+    projects = Project.objects.aggregate(projects=Count("id"), projects_at=Max("updated_at"))
+    return _marker(**customers, **projects)
+
+
+def customer_marker(request, customer):
+    change = Customer.objects.filter(name=customer).aggregate(
+        customer_at=Max("updated_at"), projects=Count("project"), projects_at=Max("project__updated_at")
+    )
+    if change["customer_at"] is None:
+        return None
+    return _marker(**change)
+
+
+def project_marker(request, customer_name, project_name):
+    change = Project.objects.filter(customer__name=customer_name, name=project_name).aggregate(
+        project_at=Max("updated_at"),
+        documents=Count("deliverables__document"),
+        documents_at=Max("deliverables__document__updated_at"),
+    )
+    if change["project_at"] is None:
+        return None
+    return _marker(**change)
+
+
+def deliverable_marker(request, customer_name, project_name, deliverable_name):
+    updated_at = DeliverableDocument.objects.filter(
+        customer_name=customer_name, project_name=project_name, name=deliverable_name
+    ).values_list("updated_at", flat=True).first()
+    if updated_at is None:
+        return None
+    return _marker(updated_at, deliverable_at=updated_at)
+
+
+def deliverables_marker(request):
+    return _marker(**DeliverableDocument.objects.aggregate(deliverables=Count("pk"), deliverables_at=Max("updated_at")))
+
+
+def events_marker(request, customer, project, deliverable):
+    # il documento del deliverable viene ricostruito a ogni scrittura degli eventi (space.signals, space.events):
+    # una sola riga letta con l'indice univoco del percorso, qualunque sia il numero degli eventi
+    updated_at = DeliverableDocument.objects.filter(
+        customer_name=customer, project_name=project, name=deliverable
+    ).values_list("updated_at", flat=True).first()
+    if updated_at is None:
+        return None
+    # è comunque un elenco: senza Last-Modified, validato dal solo ETag
+    return _marker(events_at=updated_at)
+
+
+def configuration_marker(request, customer, project, deliverable, stage):
+    updated_at = Deliverable.objects.filter(
+        name=deliverable, project__name=project, project__customer__name=customer
+    ).values_list("updated_at", flat=True).first()
+    if updated_at is None:
+        return None
+    return _marker(updated_at, deliverable_at=updated_at)
@@ -0,0 +1,107 @@
+import json
+
+from django.db.models import F, Func, QuerySet, TextField, Value
+from django.utils import timezone
+
+from space.builds import latest_builds
+from space.encoders import DELIVERABLE_COLUMNS, encode_deliverable_row
+from space.models import DeliverableDocument
+from space.serializers import DOCUMENT_FIELDS
+
+# Document keys that are also stored as columns of DeliverableDocument
+DOCUMENT_COLUMNS = {
+    "name": "name",
+    "project": "project_name",
+    "customer": "customer_name",
+    "id": "deliverable_id",
+}
+
+
+class JSONFragment(Func):
+    """
+    Text of a top level key of the JSON body, extracted by PostgreSQL.
+
+    The body is read as json (not jsonb) so the fragment keeps the key order
+    of the stored document.
+    """
+
+    arg_joiner = "::json -> "
+    template = "(%(expressions)s)::text"
+    output_field = TextField()
+
+    def __init__(self, key: str):
+        super().__init__(F("body"), Value(key))
+
+
+def build_document(row, builds=()) -> DeliverableDocument:
+    """Document of a deliverable read as a DELIVERABLE_COLUMNS row, with its latest build events."""
+    return DeliverableDocument(
+        deliverable_id=row[0],
+        project_id=row[2],
+        customer_name=row[4],
+        project_name=row[3],
+        name=row[1],
+        body=encode_deliverable_row(row, builds),
+        updated_at=timezone.now(),
+    )
+
+
+def refresh_documents(deliverables: QuerySet, create: bool = True) -> list[DeliverableDocument]:
+    """
+    Rebuild the documents of the given deliverables.
+
+    The deliverables are read as plain rows and encoded through the
+    precompiled template of space.encoders, with the latest build events
+    of all of them read by a single window query (space.builds).
+    With create=False only existing documents are updated, this is used by
+    handlers that may run while the deliverable itself is being deleted.
+    """
+    rows = list(deliverables.values_list(*DELIVERABLE_COLUMNS))
+    if not rows:
+        return []
+
+    builds = latest_builds([row[0] for row in rows])
+    documents = [build_document(row, builds.get(row[0], ())) for row in rows]
+
+    fields = ["project", "customer_name", "project_name", "name", "body", "updated_at"]
+    if create:
+        DeliverableDocument.objects.bulk_create(
+            documents, update_conflicts=True, unique_fields=["deliverable"], update_fields=fields
+        )
+    else:
+        DeliverableDocument.objects.bulk_update(documents, fields)
+
+    return documents
+
+
+def read_documents(documents: QuerySet, keys=None, chunk_size: int | None = None):
+    """
+    Read the documents selected by the queryset, limited to the given top level keys.
+
+    Keys stored as columns are read from them, the others are extracted from
+    the body by the database, so only the requested data leaves PostgreSQL.
+    Without keys (or if all of them are requested) the whole body is read.
+    With chunk_size the rows are read through a server side cursor.
+    Returns an iterator of (possibly partial) document dicts.
+    """
+    def fetch(rows):
+        return rows.iterator(chunk_size=chunk_size) if chunk_size else rows
+
+    keys = set(keys or DOCUMENT_FIELDS)
+    if keys >= set(DOCUMENT_FIELDS):
+        return (json.loads(body) for body in fetch(documents.values_list("body", flat=True)))
+
+    columns = {key: DOCUMENT_COLUMNS[key] for key in keys if key in DOCUMENT_COLUMNS}
+    fragments = {f"body_{key}": JSONFragment(key) for key in keys if key not in DOCUMENT_COLUMNS}
+    rows = fetch(documents.values(*columns.values(), **fragments))
+
+    def documents_from(rows):
+        for row in rows:
+            document = {key: row[column] for key, column in columns.items()}
+            if "id" in document:
+                document["id"] = str(document["id"])
+            for alias in fragments:
+                document[alias[len("body_"):]] = json.loads(row[alias])
+            yield document
+
+    return documents_from(rows)
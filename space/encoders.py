@@ -0,0 +1,99 @@
+from json import dumps
+from json.encoder import encode_basestring
+
+from space.serializers import SPACE_API_URI, STAGES
+
+
+# Colonne lette con values_list() per codificare un deliverable senza istanziare i modelli, nell'ordine atteso da encode_deliverable_row
+DELIVERABLE_COLUMNS = (
+    "id",
+    "name",
+    "project_id",
+    "project__name",
+    "project__customer__name",
+    "repository",
+    "stage_status",
+    *(f"{stage}_{column}" for stage in STAGES for column in ("version", "last_published_at", "download_uri")),
+)
+
+
+def _string(value):
+    return "null" if value is None else encode_basestring(value)
+
+
+def _datetime(value):
+    # Stesso formato dell'encoder di DRF: isoformat con il suffisso Z per UTC
+    if value is None:
+        return "null"
+    representation = value.isoformat()
+    if representation.endswith("+00:00"):
+        representation = representation[:-6] + "Z"
+    return f'"{representation}"'
+
+
+def _json(value):
+    return dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _fragment(value):
+    # Frammento costante già codificato da inserire all'interno di una stringa JSON del template
+    return encode_basestring(value)[1:-1].replace("%", "%%")
+
+
+# Template precompilato del documento di serialize_deliverable: le parti costanti (chiavi, prefissi degli URI) sono già codificate
+_STAGE_TEMPLATE = (
+    '"{stage}":{{"status":%s,"current_published_version":%s,"last_published_at":%s,"download_uri":%s,'
+    '"current_configuration_uri":"{uri}%s{stage}"}}'
+)
+DELIVERABLE_TEMPLATE = (
+    '{"name":%s,"project":%s,"customer":%s,"id":"%s","stages":{'
+    + ",".join(_STAGE_TEMPLATE.format(stage=stage, uri=_fragment(f"{SPACE_API_URI}/customers/")) for stage in STAGES)
+    + '},"can_publish_from_ui":true,"latest_build_events":[%s],"repository_uri":%s,"configuration":%s}'
+)
+BUILD_TEMPLATE = (
+    '{"id":%s,"outcome":%s,"timestamp":%s,"type":"build",'
+    '"stage":%s,"version":%s,"source_code_uri":%s,"external_ref":%s,"external_ref_uri":%s}'
+)
+
+
+def encode_deliverable_row(row, builds=()):
+    """
+    Codifica una riga di DELIVERABLE_COLUMNS e i suoi ultimi eventi di build nel documento JSON di serialize_deliverable.
+
+    Il risultato è identico a encode_json(serialize_deliverable(deliverable, builds)).decode().
+    """
+    (
+        id, name, _project_id, project, customer, repository, stage_status,
+        production_version, production_published_at, production_download_uri,
+        staging_version, staging_published_at, staging_download_uri,
+        delivery_version, delivery_published_at, delivery_download_uri,
+    ) = row
+
+    # Parte variabile degli URI di configurazione, comune ai tre stage
+    path = (
+        encode_basestring(customer)[1:-1] + "/projects/" + encode_basestring(project)[1:-1]
+        + "/deliverables/" + encode_basestring(name)[1:-1] + "/configurations/"
+    )
+    status = stage_status.get
+
+    body = DELIVERABLE_TEMPLATE % (
+        _string(name), _string(project), _string(customer), id,
+        _json(status("production")), _string(production_version), _datetime(production_published_at), _string(production_download_uri), path,
+        _json(status("staging")), _string(staging_version), _datetime(staging_published_at), _string(staging_download_uri), path,
+        _json(status("delivery")), _string(delivery_version), _datetime(delivery_published_at), _string(delivery_download_uri), path,
+        ",".join(
+            BUILD_TEMPLATE % (
+                _string(event.id), _string(event.outcome), _datetime(event.timestamp), _string(event.stage), _string(event.version),
+                _string(event.source_code_uri), _string(event.external_ref), _string(event.external_ref_uri),
+            )
+            for event in builds
+        ),
+        _string(repository), _json(status("configuration", {})),
+    )
+    # Come JSONRenderer: i separatori di riga Unicode non sono validi in JavaScript
+    return body.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+
+
+def encode_array(bodies):
+    """Array JSON composto da documenti già codificati, senza decodificarli."""
+    return "[" + ",".join(bodies) + "]"
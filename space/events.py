@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from registry.models import Deliverable, Event
+from registry.partitions import insert_events
+from space.builds import update_last_build
+from space.cache import invalidate_tree
+from space.documents import refresh_documents
+from space.serializers import serialize_event
+from space.signals import publish_documents
+from space.stats import count_events
+from tars.broadcast import publish_many_on_commit
+from tars.renderers import encode_json
+
+def ingest_events(events: list[dict], deliverables: QuerySet | None = None) -> dict:
+    """
+    Store a batch of events of many deliverables with a constant number of queries.
+
+    Each event refers its deliverable by customer, project and deliverable
+    name, looked up in the given deliverables (all by default): events of the
+    others are reported as unknown. Events whose id already exists are
+    skipped, so a batch can be safely sent again.
+    """
+    if deliverables is None:
+        deliverables = Deliverable.objects.all()
+
+    paths = {(e["customer"], e["project"], e["deliverable"]) for e in events}
+    deliverables = {
+        (customer, project, name): pk
+        for pk, name, project, customer in deliverables.filter(
+            name__in={p[2] for p in paths},
+            project__name__in={p[1] for p in paths},
+            project__customer__name__in={p[0] for p in paths},
+        ).values_list("pk", "name", "project__name", "project__customer__name")
+    }
+
+    unknown = sorted(paths - deliverables.keys())
+    known = [e for e in events if (e["customer"], e["project"], e["deliverable"]) in deliverables]
+
+    with transaction.atomic():
+        new_events = {}
+        for e in known:
+            if e["id"] in new_events:
+                continue
+            new_events[e["id"]] = Event(
+                deliverable_id=deliverables[(e["customer"], e["project"], e["deliverable"])],
+                id=e["id"],
+                outcome=e["outcome"],
+                timestamp=e.get("timestamp") or timezone.now(),
+                type=e["type"],
+                stage=e["stage"],
+                version=e["version"],
+                source_code_uri=e["source_code_uri"],
+                external_ref=e.get("external_ref"),
+                external_ref_uri=e.get("external_ref_uri"),
+            )
+
+        # the ids already stored, also by a concurrent transaction still running, are skipped by the database
+        inserted = insert_events(list(new_events.values()))
+        new_events = {id: event for id, event in new_events.items() if id in inserted}
+
+        # bulk inserts and update() do not send signals: keep last build, read model and live streams in sync here
+        affected = {event.deliverable_id for event in new_events.values()}
+        if affected:
+            update_last_build(affected)
+            count_events(Event.objects.filter(id__in=list(new_events), deliverable_id__in=affected))
+            publish_documents(refresh_documents(Deliverable.objects.filter(pk__in=affected), create=False))
+            invalidate_tree(deliverable_ids=affected)
+        publish_many_on_commit(
+            (str(event.deliverable_id), "event", encode_json(serialize_event(event)).decode()) for event in new_events.values()
+        )
+
+    return {
+        "received": len(events),
+        "created": len(new_events),
+        "duplicates": len(known) - len(new_events),
+        "unknown_deliverables": [
+            {"customer": customer, "project": project, "deliverable": name} for customer, project, name in unknown
+        ],
+    }
+
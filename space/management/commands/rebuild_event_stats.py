@@ -0,0 +1,33 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from registry.models import Deliverable
+from space.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily event counts of the stats endpoint from the stored events"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", metavar="YYYY-MM-DD", help="rebuild only the days from this one (older counts are kept)")
+        parser.add_argument("--customer", help="rebuild only the deliverables of this customer")
+        parser.add_argument("--project", help="rebuild only the deliverables of this project (with --customer)")
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options["since"]) if options["since"] else None
+        except ValueError:
+            raise CommandError("--since must be a date in the YYYY-MM-DD format")
+        if options["project"] and not options["customer"]:
+            raise CommandError("--project requires --customer")
+
+        deliverable_ids = None
+        if options["customer"]:
+            deliverables = Deliverable.objects.filter(project__customer__name=options["customer"])
+            if options["project"]:
+                deliverables = deliverables.filter(project__name=options["project"])
+            deliverable_ids = list(deliverables.values_list("id", flat=True))
+
+        rows = rebuild(deliverable_ids, since)
+        self.stdout.write(self.style.SUCCESS(f"{rows:,} daily event counts rebuilt"))
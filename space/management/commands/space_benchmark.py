@@ -0,0 +1,129 @@
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from registry.models import Company, Customer, Deliverable, Event, Project
+from space.builds import LATEST_BUILD_EVENTS, latest_builds
+from space.documents import refresh_documents
+from space.encoders import DELIVERABLE_COLUMNS, encode_array, encode_deliverable_row
+from space.models import DeliverableDocument
+from space.serializers import serialize_deliverable
+from tars.renderers import encode_json
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measure the serialization throughput (rows/s) of the space deliverable list"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--synthetic", type=int, default=0, help="benchmark N generated deliverables (rolled back at the end) instead of the stored ones")
+        parser.add_argument("--repeat", type=int, default=3, help="runs per measure, the best one is reported")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options["synthetic"]:
+                    self.create_deliverables(options["synthetic"])
+                self.run(options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_deliverables(self, count):
+        company = Company.objects.create(name="benchmark", email="benchmark@example.com")
+        customer = Customer.objects.create(name="benchmark", company=company)
+        project = Project.objects.create(name="benchmark", customer=customer)
+        deliverables = Deliverable.objects.bulk_create(
+            [
+                Deliverable(
+                    name=f"deliverable-{i}",
+                    project=project,
+                    repository=f"https://github.com/benchmark/deliverable-{i}",
+                    production_version=f"1.{i}.0",
+                    staging_version=f"1.{i}.1",
+                    stage_status={"production": "published", "staging": "pending", "configuration": {"staging": "published"}},
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+        now = timezone.now()
+        Event.objects.bulk_create(
+            [
+                Event(
+                    id=f"build-{i}-{b}",
+                    deliverable=deliverable,
+                    outcome="success",
+                    timestamp=now - timedelta(hours=b),
+                    type="build",
+                    stage="staging",
+                    version=f"1.{i}.{b}",
+                    source_code_uri=deliverable.repository,
+                )
+                for i, deliverable in enumerate(deliverables)
+                for b in range(LATEST_BUILD_EVENTS)
+            ],
+            batch_size=1000,
+        )
+        refresh_documents(Deliverable.objects.filter(project=project))
+
+    def measure(self, label, count, function, repeat):
+        best = min(self.timed(function) for _ in range(repeat))
+        rate = count / best if best else float("inf")
+        self.stdout.write(f"{label:<45} {best * 1000:10.1f} ms {rate:14,.0f} rows/s")
+        return best
+
+    def timed(self, function):
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+    def run(self, repeat):
+        deliverables = Deliverable.objects.order_by("id")
+        count = deliverables.count()
+        if not count:
+            raise CommandError("No deliverables to benchmark, use --synthetic N")
+
+        # The latest builds are read once, both encoders take them
+        builds = latest_builds(deliverables.values("id"))
+
+        # Both encoders must produce the same documents
+        legacy = [encode_json(serialize_deliverable(d, builds.get(d.id, ()))).decode() for d in deliverables.select_related("project__customer")]
+        rows = [encode_deliverable_row(row, builds.get(row[0], ())) for row in deliverables.values_list(*DELIVERABLE_COLUMNS)]
+        if legacy != rows:
+            raise CommandError("encode_deliverable_row differs from serialize_deliverable")
+
+        self.stdout.write(f"{count} deliverables\n\nDocument encoding (read model refresh)")
+        models = self.measure(
+            "model instances + serialize_deliverable", count,
+            lambda: [encode_json(serialize_deliverable(d, builds.get(d.id, ()))) for d in deliverables.select_related("project__customer")],
+            repeat,
+        )
+        template = self.measure(
+            "values_list rows + precompiled template", count,
+            lambda: [encode_deliverable_row(row, builds.get(row[0], ())) for row in deliverables.values_list(*DELIVERABLE_COLUMNS)],
+            repeat,
+        )
+        self.stdout.write(f"speedup {models / template:.1f}x")
+
+        documents = DeliverableDocument.objects.order_by("customer_name", "project_name", "name").values_list("body", flat=True)
+        self.stdout.write("\nGET /deliverables/ response body")
+        decoded = self.measure(
+            "decode + JSONRenderer", count,
+            lambda: JSONRenderer().render([json.loads(body) for body in documents]),
+            repeat,
+        )
+        spliced = self.measure(
+            "pre-encoded bodies spliced", count,
+            lambda: encode_array(documents).encode(),
+            repeat,
+        )
+        self.stdout.write(f"speedup {decoded / spliced:.1f}x")
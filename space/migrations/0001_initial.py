@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('registry', '0028_event_deliverable_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliverableDocument',
+            fields=[
+                ('deliverable', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='registry.deliverable')),
+                ('customer_name', models.CharField(max_length=30)),
+                ('project_name', models.CharField(max_length=30)),
+                ('name', models.CharField(max_length=30)),
+                ('body', models.TextField()),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='registry.project')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('customer_name', 'project_name', 'name'), name='space_document_path_unique')],
+            },
+        ),
+    ]
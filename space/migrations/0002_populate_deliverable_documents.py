@@ -0,0 +1,93 @@
+import json
+from datetime import datetime
+
+from django.db import migrations
+
+# Frozen copy of the document encoding of this migration: it must not follow later changes of space.serializers
+
+SPACE_API_URI = "https://tars.iotinga.it/space/api/v1"
+STAGES = ("production", "staging", "delivery")
+
+
+class DocumentEncoder(json.JSONEncoder):
+    # dates as written by the JSONRenderer of REST framework, UTC with the Z suffix
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            representation = obj.isoformat()
+            if representation.endswith("+00:00"):
+                representation = representation[:-6] + "Z"
+            return representation
+        return super().default(obj)
+
+
+def encode_document(data):
+    # compact UTF-8 JSON, as the default settings of JSONRenderer
+    text = json.dumps(data, cls=DocumentEncoder, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+    return text.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+
+
+def deliverable_document(deliverable):
+    project_name = deliverable.project.name
+    customer_name = deliverable.project.customer.name
+    configuration_uri = f"{SPACE_API_URI}/customers/{customer_name}/projects/{project_name}/deliverables/{deliverable.name}/configurations"
+    return {
+        "name": deliverable.name,
+        "project": project_name,
+        "customer": customer_name,
+        "id": str(deliverable.id),
+        "stages": {
+            stage: {
+                "status": deliverable.stage_status.get(stage),
+                "current_published_version": getattr(deliverable, f"{stage}_version"),
+                "last_published_at": getattr(deliverable, f"{stage}_last_published_at"),
+                "download_uri": getattr(deliverable, f"{stage}_download_uri"),
+                "current_configuration_uri": f"{configuration_uri}/{stage}",
+            }
+            for stage in STAGES
+        },
+        "can_publish_from_ui": True,
+        "latest_build_events": [
+            {
+                "id": deliverable.last_build_event_id,
+                "outcome": deliverable.last_build_outcome,
+                "timestamp": deliverable.last_build_timestamp,
+                "type": "build",
+                "stage": deliverable.last_build_stage,
+                "version": deliverable.last_build_version,
+                "source_code_uri": deliverable.source_code_uri,
+                "external_ref": deliverable.external_ref,
+                "external_ref_uri": deliverable.external_ref_uri,
+            }
+        ],
+        "repository_uri": deliverable.repository,
+        "configuration": deliverable.stage_status.get("configuration", {}),
+    }
+
+
+def populate_documents(apps, schema_editor):
+    Deliverable = apps.get_model("registry", "Deliverable")
+    DeliverableDocument = apps.get_model("space", "DeliverableDocument")
+
+    documents = [
+        DeliverableDocument(
+            deliverable_id=deliverable.id,
+            project_id=deliverable.project_id,
+            customer_name=deliverable.project.customer.name,
+            project_name=deliverable.project.name,
+            name=deliverable.name,
+            body=encode_document(deliverable_document(deliverable)),
+        )
+        for deliverable in Deliverable.objects.select_related("project__customer")
+    ]
+    DeliverableDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('space', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('space', '0002_populate_deliverable_documents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliverabledocument',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
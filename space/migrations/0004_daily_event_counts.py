@@ -0,0 +1,38 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0035_event_partitions'),
+        ('space', '0003_document_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyEventCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('stage', models.CharField(max_length=50)),
+                ('type', models.CharField(max_length=50)),
+                ('outcome', models.CharField(max_length=50)),
+                ('count', models.IntegerField()),
+                ('deliverable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='registry.deliverable')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('deliverable', 'day', 'stage', 'type', 'outcome'), name='space_event_count_unique')],
+            },
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO space_dailyeventcount (deliverable_id, day, stage, type, outcome, count)
+            SELECT deliverable_id, ("timestamp" AT TIME ZONE 'UTC')::date, stage, type, outcome, count(*)
+            FROM registry_event GROUP BY 1, 2, 3, 4, 5
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,112 @@
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Window
+from django.db.models.functions import RowNumber
+
+# Frozen copy of the document encoding of this migration: it must not follow later changes of space.serializers
+
+SPACE_API_URI = "https://tars.iotinga.it/space/api/v1"
+STAGES = ("production", "staging", "delivery")
+LATEST_BUILD_EVENTS = getattr(settings, "SPACE_LATEST_BUILD_EVENTS", 5)
+
+
+class DocumentEncoder(json.JSONEncoder):
+    # dates as written by the JSONRenderer of REST framework, UTC with the Z suffix
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            representation = obj.isoformat()
+            if representation.endswith("+00:00"):
+                representation = representation[:-6] + "Z"
+            return representation
+        return super().default(obj)
+
+
+def encode_document(data):
+    # compact UTF-8 JSON, as the default settings of JSONRenderer
+    text = json.dumps(data, cls=DocumentEncoder, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+    return text.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+
+
+def deliverable_document(deliverable, builds):
+    project_name = deliverable.project.name
+    customer_name = deliverable.project.customer.name
+    configuration_uri = f"{SPACE_API_URI}/customers/{customer_name}/projects/{project_name}/deliverables/{deliverable.name}/configurations"
+    return {
+        "name": deliverable.name,
+        "project": project_name,
+        "customer": customer_name,
+        "id": str(deliverable.id),
+        "stages": {
+            stage: {
+                "status": deliverable.stage_status.get(stage),
+                "current_published_version": getattr(deliverable, f"{stage}_version"),
+                "last_published_at": getattr(deliverable, f"{stage}_last_published_at"),
+                "download_uri": getattr(deliverable, f"{stage}_download_uri"),
+                "current_configuration_uri": f"{configuration_uri}/{stage}",
+            }
+            for stage in STAGES
+        },
+        "can_publish_from_ui": True,
+        "latest_build_events": [
+            {
+                "id": event.id,
+                "outcome": event.outcome,
+                "timestamp": event.timestamp,
+                "type": "build",
+                "stage": event.stage,
+                "version": event.version,
+                "source_code_uri": event.source_code_uri,
+                "external_ref": event.external_ref,
+                "external_ref_uri": event.external_ref_uri,
+            }
+            for event in builds
+        ],
+        "repository_uri": deliverable.repository,
+        "configuration": deliverable.stage_status.get("configuration", {}),
+    }
+
+
+def latest_builds(Event, deliverable_ids):
+    # the latest build events of each deliverable, most recent first, numbered by a window query
+    rows = (
+        Event.objects.filter(type="build", deliverable_id__in=deliverable_ids)
+        .annotate(position=Window(RowNumber(), partition_by="deliverable_id", order_by=("-timestamp", "-id")))
+        .filter(position__lte=LATEST_BUILD_EVENTS)
+        .order_by("deliverable_id", "position")
+    )
+    builds = {}
+    for event in rows:
+        builds.setdefault(event.deliverable_id, []).append(event)
+    return builds
+
+
+def rewrite_documents(apps, schema_editor):
+    # latest_build_events lists the latest build events instead of the last_build_* columns
+    Deliverable = apps.get_model("registry", "Deliverable")
+    DeliverableDocument = apps.get_model("space", "DeliverableDocument")
+    Event = apps.get_model("registry", "Event")
+
+    deliverables = Deliverable.objects.select_related("project__customer").filter(document__isnull=False)
+    builds = latest_builds(Event, deliverables.values("id"))
+    documents = [
+        DeliverableDocument(
+            deliverable_id=deliverable.id,
+            body=encode_document(deliverable_document(deliverable, builds.get(deliverable.id, ()))),
+        )
+        for deliverable in deliverables
+    ]
+    DeliverableDocument.objects.bulk_update(documents, ["body"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('space', '0004_daily_event_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(rewrite_documents, migrations.RunPython.noop),
+    ]
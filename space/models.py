@@ -1,3 +1,55 @@
 from django.db import models
 
-# Create your models here.
+from registry.models import Deliverable, Project
+
+
+class DeliverableDocument(models.Model):
+    """
+    Read model of the space API: the ready-to-serve document of a deliverable.
+
+    Rows are kept in sync with Deliverable, Project, Customer and Event by the
+    handlers in space.signals, inside the same transaction of the change.
+    """
+
+    deliverable = models.OneToOneField(Deliverable, on_delete=models.CASCADE, primary_key=True, related_name="document")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="+")
+    customer_name = models.CharField(max_length=30)
+    project_name = models.CharField(max_length=30)
+    name = models.CharField(max_length=30)
+    # JSON text as served by GET /deliverables/ (text, unlike jsonb, keeps the key order)
+    body = models.TextField()
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} in {self.project_name}@{self.customer_name}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["customer_name", "project_name", "name"], name="space_document_path_unique"),
+        ]
+
+
+class DailyEventCount(models.Model):
+    """
+    Rollup of the events: number of events per deliverable, UTC day, stage, type and outcome.
+
+    Rows are incremented by space.stats when events are stored (ingestion
+    and signals) and rebuilt from the events by ./manage.py rebuild_event_stats.
+    They outlive the event partitions dropped by events_retention.
+    """
+
+    deliverable = models.ForeignKey(Deliverable, on_delete=models.CASCADE, related_name="+")
+    day = models.DateField()
+    stage = models.CharField(max_length=50)
+    type = models.CharField(max_length=50)
+    outcome = models.CharField(max_length=50)
+    count = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.count} {self.type} {self.outcome} of {self.deliverable_id} in {self.stage} on {self.day}"
+
+    class Meta:
+        constraints = [
+            # conflict target of the increments, its index serves the date ranges of a deliverable
+            models.UniqueConstraint(fields=["deliverable", "day", "stage", "type", "outcome"], name="space_event_count_unique"),
+        ]
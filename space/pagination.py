@@ -0,0 +1,81 @@
+import json
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# Ordinamenti ammessi per GET /customers/ (il secondo campo rende l'ordine deterministico)
+CUSTOMER_ORDERINGS = {
+    "name": ("name",),
+    "-name": ("-name",),
+    "number_of_projects": ("number_of_projects", "name"),
+    "-number_of_projects": ("-number_of_projects", "name"),
+}
+
+
+class CustomerCursorPagination(CursorPagination):
+    """
+    Paginazione a cursore per la lista dei clienti.
+
+    La paginazione si attiva solo se nella query compaiono `limit` o `cursor`,
+    altrimenti la vista restituisce la lista completa come in precedenza.
+    """
+
+    page_size = None
+    page_size_query_param = "limit"
+    max_page_size = 1000
+    default_page_size = 100
+
+    def __init__(self, ordering="name"):
+        self.ordering = CUSTOMER_ORDERINGS[ordering]
+
+    def get_page_size(self, request):
+        page_size = super().get_page_size(request)
+        if page_size is None and self.cursor_query_param in request.query_params:
+            return self.default_page_size
+        return page_size
+
+
+def encode_event_cursor(timestamp, event_id):
+    """Codifica la posizione (timestamp, id) dell'ultimo evento restituito in un cursore opaco."""
+    payload = json.dumps([timestamp.isoformat(), event_id]).encode()
+    return urlsafe_b64encode(payload).decode()
+
+
+def decode_event_cursor(cursor):
+    """
+    Decodifica un cursore prodotto da `encode_event_cursor`.
+
+    Solleva ValueError se il cursore non è valido.
+    """
+    try:
+        timestamp, event_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), str(event_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError("invalid cursor") from e
+
+
+def events_before(events, timestamp, event_id):
+    """
+    Eventi che seguono la posizione (timestamp, id) nell'ordine decrescente della paginazione a cursore.
+
+    Il confronto è tra righe, `("timestamp", id) < (%s, %s)`: PostgreSQL lo
+    usa come condizione dell'indice registry_event_deliv_ts_idx, mentre
+    l'equivalente con OR sarebbe un filtro valutato su ogni riga già letta.
+    Il limite ridondante su timestamp esclude le partizioni più recenti.
+    """
+    table = events.model._meta.db_table
+    before = RawSQL(f'("{table}"."timestamp", "{table}"."id") < (%s, %s)', (timestamp, event_id), output_field=BooleanField())
+    return events.filter(before, timestamp__lte=timestamp)
+
+
+def event_page_url(request, cursor):
+    """URL assoluto della pagina successiva, con gli stessi parametri della richiesta corrente."""
+    url = request.build_absolute_uri()
+    url = remove_query_param(url, "offset")
+    return replace_query_param(url, "cursor", cursor)
@@ -0,0 +1,182 @@
+from rest_framework import serializers
+
+from registry.models import Deliverable, Event
+
+
+# Prefisso degli URI pubblici delle API space
+SPACE_API_URI = "https://tars.iotinga.it/space/api/v1"
+
+# Stage standard di un deliverable
+STAGES = ("production", "staging", "delivery")
+
+
+# Converte un evento nel dizionario restituito dalle API
+def serialize_event(event: Event):
+    return {
+        "id": event.id,
+        "outcome": event.outcome,
+        "timestamp": event.timestamp.isoformat(),
+        "type": event.type,
+        "stage": event.stage,
+        "version": event.version,
+        "source_code_uri": event.source_code_uri,
+        "external_ref": event.external_ref,
+        "external_ref_uri": event.external_ref_uri
+    }
+
+
+# Converte un deliverable nel dizionario restituito da GET /deliverables/
+# Il deliverable deve essere caricato con select_related("project__customer") per evitare query aggiuntive,
+# builds sono i suoi ultimi eventi di build (space.builds.latest_builds)
+def serialize_deliverable(deliverable: Deliverable, builds=()):
+    project_name = deliverable.project.name
+    customer_name = deliverable.project.customer.name
+    configuration_uri = f"{SPACE_API_URI}/customers/{customer_name}/projects/{project_name}/deliverables/{deliverable.name}/configurations"
+
+    return {
+        "name": deliverable.name,
+        "project": project_name,
+        "customer": customer_name,
+        "id": str(deliverable.id),
+        "stages": {
+            stage: {
+                "status": deliverable.stage_status.get(stage),
+                "current_published_version": getattr(deliverable, f"{stage}_version"),
+                "last_published_at": getattr(deliverable, f"{stage}_last_published_at"),
+                "download_uri": getattr(deliverable, f"{stage}_download_uri"),
+                "current_configuration_uri": f"{configuration_uri}/{stage}",
+            }
+            for stage in STAGES
+        },
+        "can_publish_from_ui": True,  # Indica se il deliverable può essere pubblicato dalla UI, qui sempre impostato su True
+        "latest_build_events": [  # Dettagli sugli ultimi eventi di build relativi al deliverable, dal più recente
+            {
+                "id": event.id,
+                "outcome": event.outcome,
+                "timestamp": event.timestamp,
+                "type": "build",
+                "stage": event.stage,
+                "version": event.version,
+                "source_code_uri": event.source_code_uri,
+                "external_ref": event.external_ref,
+                "external_ref_uri": event.external_ref_uri
+            }
+            for event in builds
+        ],
+        "repository_uri": deliverable.repository,
+        "configuration": deliverable.stage_status.get("configuration", {}),
+    }
+
+
+# I documenti del read model (space.models.DeliverableDocument) hanno la forma di serialize_deliverable,
+# le funzioni seguenti ne ricavano le forme restituite dagli altri endpoint senza ulteriori query
+
+def _stages_without_status(stages):
+    return {
+        stage: {key: value for key, value in block.items() if key != "status"}
+        for stage, block in stages.items()
+    }
+
+
+def _first(items):
+    return items[0] if items else None
+
+
+# Forma di un deliverable per ogni endpoint: campo restituito -> (chiave del documento da cui si ricava, trasformazione)
+DOCUMENT_FIELDS = {
+    key: (key, None)
+    for key in (
+        "name", "project", "customer", "id", "stages", "can_publish_from_ui",
+        "latest_build_events", "repository_uri", "configuration",
+    )
+}
+
+# Deliverable restituito da GET /customers/{customer}/projects/{project}/deliverables/{deliverable}/
+DETAIL_FIELDS = {
+    "name": ("name", None),
+    "project": ("project", None),
+    "customer": ("customer", None),
+    "id": ("id", None),
+    "stages": ("stages", _stages_without_status),
+    "can_publish_from_ui": ("can_publish_from_ui", None),
+    "latest_build_events": ("latest_build_events", None),
+    "repository_uri": ("repository_uri", None),
+}
+
+# Deliverable restituito all'interno di GET /customers/{customer}/projects/{project}/
+PROJECT_DELIVERABLE_FIELDS = {
+    "name": ("name", None),
+    "uri": ("repository_uri", None),
+    "stages": ("stages", _stages_without_status),
+    "last_build_event": ("latest_build_events", _first),
+    "repository_uri": ("repository_uri", None),
+    "project": ("project", None),
+    "customer": ("customer", None),
+}
+
+# Espansioni richiedibili con ?include=: aggiungono alla forma dell'endpoint dati del documento altrimenti omessi
+INCLUDES = {
+    "status": {"stages": ("stages", None)},
+    "configuration": {"configuration": ("configuration", None)},
+}
+
+
+def select_fields(shape, fields=None, include=None):
+    """
+    Restringe la forma di un endpoint ai campi richiesti con ?fields= e vi aggiunge le espansioni di ?include=
+    (status aggiunge gli stage completi di stato, configuration lo stato delle configurazioni).
+
+    I due parametri sono liste separate da virgole; solleva ValueError per campi o espansioni sconosciuti.
+    """
+    if fields:
+        names = [name for name in fields.split(",") if name]
+        unknown = [name for name in names if name not in shape]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}, expected any of: {', '.join(shape)}")
+        shape = {name: value for name, value in shape.items() if name in names}
+    else:
+        shape = dict(shape)
+
+    for name in filter(None, (include or "").split(",")):
+        if name not in INCLUDES:
+            raise ValueError(f"Unknown include: {name}, expected one of: {', '.join(INCLUDES)}")
+        shape.update(INCLUDES[name])
+    return shape
+
+
+def shape_keys(shape):
+    """Chiavi del documento necessarie per costruire la forma."""
+    return {key for key, _ in shape.values()}
+
+
+def shape_document(document, shape):
+    """Costruisce un deliverable nella forma indicata a partire dal documento (anche parziale, con le sole shape_keys)."""
+    return {
+        name: transform(document[key]) if transform else document[key]
+        for name, (key, transform) in shape.items()
+    }
+
+
+def deliverable_details(document):
+    return shape_document(document, DETAIL_FIELDS)
+
+
+def project_deliverable(document):
+    return shape_document(document, PROJECT_DELIVERABLE_FIELDS)
+
+
+class EventInputSerializer(serializers.Serializer):
+    """Evento ricevuto da POST /events/, il deliverable è indicato per nome."""
+
+    customer = serializers.CharField(max_length=30)
+    project = serializers.CharField(max_length=30)
+    deliverable = serializers.CharField(max_length=30)
+    id = serializers.CharField(max_length=255)
+    outcome = serializers.CharField(max_length=50)
+    timestamp = serializers.DateTimeField(required=False)
+    type = serializers.CharField(max_length=50)
+    stage = serializers.CharField(max_length=50)
+    version = serializers.CharField(max_length=50)
+    source_code_uri = serializers.URLField(max_length=200)
+    external_ref = serializers.CharField(max_length=255, required=False, allow_null=True, allow_blank=True)
+    external_ref_uri = serializers.URLField(max_length=200, required=False, allow_null=True, allow_blank=True)
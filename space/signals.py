@@ -0,0 +1,155 @@
+from django.db.models.signals import post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from registry.models import Customer, Deliverable, Event, Project
+from registry.signals import deliverables_deleting, deliverables_loaded, events_deleted, events_deleting, events_dropped
+from space.builds import update_last_build
+from space.cache import invalidate_tree
+from space.documents import refresh_documents
+from space.models import DailyEventCount, DeliverableDocument
+from space.serializers import serialize_event
+from space.stats import count_events, uncount_events
+from tars.broadcast import publish_many_on_commit, publish_on_commit
+from tars.renderers import encode_json
+
+
+def publish_documents(documents):
+    publish_many_on_commit((str(document.deliverable_id), "deliverable", document.body) for document in documents)
+
+
+@receiver(post_save, sender=Deliverable)
+def deliverable_saved(sender, instance: Deliverable, **kwargs):
+    publish_documents(refresh_documents(Deliverable.objects.filter(pk=instance.pk)))
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance: Project, created, **kwargs):
+    if not created:
+        publish_documents(refresh_documents(Deliverable.objects.filter(project=instance), create=False))
+
+
+@receiver(post_save, sender=Customer)
+def customer_saved(sender, instance: Customer, created, **kwargs):
+    if not created:
+        publish_documents(refresh_documents(Deliverable.objects.filter(project__customer=instance), create=False))
+
+
+# Event has no delete receivers: they would disable the fast delete of the events of a deleted deliverable,
+# loading every event to send its signals. Direct deletes go through EventQuerySet.delete (registry.signals).
+# The receivers below run in the transaction of the change: AtomicSaveModel.save and EventQuerySet.delete open it
+
+@receiver(post_save, sender=Event)
+def event_changed(sender, instance: Event, **kwargs):
+    # last_build_* columns derived from the events, as ingest_events does for its batches
+    if instance.type == "build":
+        update_last_build([instance.deliverable_id])
+    refresh_documents(Deliverable.objects.filter(pk=instance.deliverable_id), create=False)
+
+
+@receiver(events_deleting)
+def events_deleting_in_bulk(sender, events, **kwargs):
+    uncount_events(events)
+
+
+@receiver(events_deleted)
+def events_deleted_in_bulk(sender, deliverables, **kwargs):
+    update_last_build(deliverables)
+    publish_documents(refresh_documents(Deliverable.objects.filter(pk__in=deliverables), create=False))
+    invalidate_tree(deliverable_ids=deliverables)
+
+
+@receiver(post_save, sender=Event)
+def event_saved(sender, instance: Event, **kwargs):
+    publish_on_commit(str(instance.deliverable_id), "event", encode_json(serialize_event(instance)).decode())
+
+
+# Daily event counts (space.stats): a saved event is removed from the counts with the values it has before the
+# change (pre_save) and added with the new ones (post_save), as the cache below handles renames
+
+# Event fields that select the daily count of an event
+COUNTED_FIELDS = {"deliverable", "deliverable_id", "timestamp", "stage", "type", "outcome"}
+
+
+def _recounted(update_fields):
+    return update_fields is None or not COUNTED_FIELDS.isdisjoint(update_fields)
+
+
+@receiver(pre_save, sender=Event)
+def event_uncounted(sender, instance: Event, update_fields=None, **kwargs):
+    # an instance still being added that updates an existing row was not uncounted: it is not counted again either
+    instance._uncounted = not instance._state.adding and _recounted(update_fields)
+    if instance._uncounted:
+        uncount_events(Event.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Event)
+def event_counted(sender, instance: Event, created, **kwargs):
+    if created or instance._uncounted:
+        count_events(Event.objects.filter(pk=instance.pk, deliverable_id=instance.deliverable_id))
+
+
+# Cached documents (space.cache): evicted with the names the rows have before the change (renames, deletes) and after it
+
+def _tree_objects(instance):
+    if isinstance(instance, Customer):
+        return {"customer_ids": [instance.pk]}
+    if isinstance(instance, Project):
+        return {"project_ids": [instance.pk]}
+    return {"deliverable_ids": [instance.pk]}
+
+
+@receiver(pre_save, sender=Customer)
+@receiver(pre_save, sender=Project)
+@receiver(pre_save, sender=Deliverable)
+@receiver(pre_delete, sender=Customer)
+@receiver(pre_delete, sender=Project)
+@receiver(pre_delete, sender=Deliverable)
+def tree_changing(sender, instance, **kwargs):
+    if not instance._state.adding:
+        invalidate_tree(**_tree_objects(instance))
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Deliverable)
+def tree_saved(sender, instance, **kwargs):
+    invalidate_tree(**_tree_objects(instance))
+
+
+@receiver(post_save, sender=Event)
+def tree_event_changed(sender, instance: Event, **kwargs):
+    invalidate_tree(deliverable_ids=[instance.deliverable_id])
+
+
+# Registry bulk operations (registry.signals), which send no model signals
+
+@receiver(deliverables_loaded)
+def deliverables_loaded_in_bulk(sender, deliverables, **kwargs):
+    refresh_documents(deliverables)
+    count_events(Event.objects.filter(deliverable__in=deliverables))
+
+
+@receiver(deliverables_deleting)
+def deliverables_deleting_in_bulk(sender, deliverables, **kwargs):
+    invalidate_tree(deliverable_ids=deliverables)
+    DailyEventCount.objects.filter(deliverable__in=deliverables).delete()
+    DeliverableDocument.objects.filter(deliverable__in=deliverables).delete()
+
+
+@receiver(events_dropped)
+def events_dropped_by_retention(sender, since, before, **kwargs):
+    # the deliverables that had events in the removed days are found in the daily counts, which are kept,
+    # instead of scanning the events before dropping them
+    days = DailyEventCount.objects.filter(count__gt=0, day__lt=before.date())
+    if since is not None:
+        days = days.filter(day__gte=since.date())
+    dropped = set(days.values_list("deliverable_id", flat=True).distinct())
+    # the documents of those with builds may list them in latest_build_events
+    stale = set(days.filter(type="build").values_list("deliverable_id", flat=True).distinct())
+    if stale:
+        publish_documents(refresh_documents(Deliverable.objects.filter(pk__in=stale), create=False))
+        invalidate_tree(deliverable_ids=stale)
+    # the others are only touched: updated_at is the change marker of their event lists (space.conditional)
+    if dropped - stale:
+        DeliverableDocument.objects.filter(deliverable__in=dropped - stale).update(updated_at=timezone.now())
@@ -0,0 +1,120 @@
+from datetime import datetime, time, timezone
+
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.db.models.functions import Trunc
+
+from registry.models import Event
+from registry.partitions import stored_since
+from space.models import DailyEventCount
+
+TABLE = DailyEventCount._meta.db_table
+
+# Periods of GET .../stats/, as date_trunc() units
+BUCKETS = ("day", "week", "month", "year")
+
+# Daily counts of the events selected by the subquery, added to the stored ones
+COUNT_EVENTS = f"""
+INSERT INTO {TABLE} (deliverable_id, day, stage, type, outcome, count)
+SELECT deliverable_id, ("timestamp" AT TIME ZONE 'UTC')::date, stage, type, outcome, count(*)
+FROM {Event._meta.db_table} WHERE id IN ({{events}}) {{where}}
+GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT (deliverable_id, day, stage, type, outcome) DO UPDATE SET count = {TABLE}.count + EXCLUDED.count
+"""
+
+# Daily counts of the events selected by the subquery, subtracted from the stored ones
+UNCOUNT_EVENTS = f"""
+UPDATE {TABLE} SET count = {TABLE}.count - removed.count
+FROM (
+    SELECT deliverable_id, ("timestamp" AT TIME ZONE 'UTC')::date AS day, stage, type, outcome, count(*) AS count
+    FROM {Event._meta.db_table} WHERE id IN ({{events}})
+    GROUP BY 1, 2, 3, 4, 5
+) removed
+WHERE {TABLE}.deliverable_id = removed.deliverable_id AND {TABLE}.day = removed.day
+    AND {TABLE}.stage = removed.stage AND {TABLE}.type = removed.type AND {TABLE}.outcome = removed.outcome
+"""
+
+
+def count_events(events, where="", params=()):
+    """
+    Add the events of the queryset to the daily counts, in a single statement.
+
+    The events must be counted once: call it for the events just inserted.
+    """
+    query, events_params = events.values("id").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(COUNT_EVENTS.format(events=query, where=where), [*events_params, *params])
+
+
+def uncount_events(events):
+    """Remove the events of the queryset, about to be deleted, from the daily counts in a single statement."""
+    query, params = events.values("id").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(UNCOUNT_EVENTS.format(events=query), params)
+
+
+def rebuild(deliverable_ids=None, since=None):
+    """
+    Recompute the daily counts from the stored events (of some deliverables, from the day `since`).
+
+    The counts of the days before `since`, and of the days whose events
+    were dropped by events_retention (before registry.partitions.stored_since()),
+    are kept. Returns the number of rollup rows written.
+    """
+    stored = stored_since()
+    if stored is not None:
+        # drop_partitions() cuts at the start of a month: the day of `stored` is whole
+        since = stored.date() if since is None else max(since, stored.date())
+    counts = DailyEventCount.objects.all()
+    events = Event.objects.all()
+    where, params = "", []
+    if deliverable_ids is not None:
+        counts = counts.filter(deliverable_id__in=deliverable_ids)
+        events = events.filter(deliverable_id__in=deliverable_ids)
+    if since is not None:
+        counts = counts.filter(day__gte=since)
+        # on the events table, not in the subquery: partitions older than `since` are not scanned
+        where, params = 'AND "timestamp" >= %s', [datetime.combine(since, time.min, timezone.utc)]
+    with transaction.atomic():
+        counts.delete()
+        count_events(events, where, params)
+        return counts.count()
+
+
+def bucket_stats(deliverable, bucket="day", since=None, until=None, stage=None, type=None):
+    """
+    Event counts of the deliverable per period, stage and type, from the rollup.
+
+    Every item has the number of events, the number per outcome and the
+    share of successes of the period; periods without events are omitted.
+    """
+    counts = DailyEventCount.objects.filter(deliverable=deliverable)
+    if since is not None:
+        counts = counts.filter(day__gte=since)
+    if until is not None:
+        counts = counts.filter(day__lte=until)
+    if stage is not None:
+        counts = counts.filter(stage=stage)
+    if type is not None:
+        counts = counts.filter(type=type)
+    rows = (
+        counts.annotate(period=Trunc("day", bucket))
+        .values("period", "stage", "type", "outcome")
+        .annotate(events=Sum("count"))
+        .order_by("period", "stage", "type", "outcome")
+    )
+
+    stats = {}
+    for row in rows:
+        if not row["events"]:
+            continue
+        period = row["period"]
+        item = stats.setdefault(
+            (period, row["stage"], row["type"]),
+            {"period": period.isoformat(), "stage": row["stage"], "type": row["type"], "events": 0, "outcomes": {}},
+        )
+        item["events"] += row["events"]
+        item["outcomes"][row["outcome"]] = row["events"]
+    for item in stats.values():
+        item["success_rate"] = round(item["outcomes"].get("success", 0) / item["events"], 4)
+    return list(stats.values())
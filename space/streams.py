@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from authentication.functions.membership import get_memberships
+from registry.models import Deliverable, Event
+from space.models import DeliverableDocument
+from space.serializers import serialize_event
+from tars.broadcast import Message, broadcaster, start_listener
+from tars.renderers import encode_json
+
+# Intervallo (secondi) dei commenti di keepalive che tengono aperte le connessioni inattive
+KEEPALIVE_INTERVAL = 15
+
+# Attesa (millisecondi) suggerita al client prima di riconnettersi
+RETRY_INTERVAL = 3000
+
+
+def _authenticate(request):
+    # Autentica la richiesta con le stesse classi configurate per le API DRF (sessione, token, basic, JWT) e carica i progetti visibili all'utente
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    return drf_request.user, get_memberships(drf_request)
+
+
+def _backfill(deliverable_id, since):
+    # Stato perso durante la disconnessione: documento corrente del deliverable ed eventi modificati dopo `since`
+    messages = []
+    body = DeliverableDocument.objects.filter(deliverable_id=deliverable_id).values_list("body", flat=True).first()
+    if body is not None:
+        messages.append(("deliverable", body))
+    events = Event.objects.filter(deliverable_id=deliverable_id, updated_at__gt=since).order_by("updated_at", "id")
+    messages += [("event", encode_json(serialize_event(event)).decode()) for event in events]
+    return messages
+
+
+async def _event_stream(deliverable_id, last_event_id, since):
+    # Sottoscrizione prima di leggere lo storico, così nessun messaggio pubblicato nel frattempo va perso
+    async with broadcaster.subscribe(str(deliverable_id), last_event_id) as subscription:
+        yield f"retry: {RETRY_INTERVAL}\n\n".encode()
+
+        # Messaggi persi dal client: da ricostruire dal database se non più presenti nello storico del broadcaster
+        if subscription.replay is None:
+            for event, data in await sync_to_async(_backfill)(deliverable_id, since):
+                yield Message(broadcaster.next_id(), subscription.channel, event, data).encode()
+        else:
+            for message in subscription.replay:
+                yield message.encode()
+
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            yield message.encode()
+
+
+# GET /customers/{customer}/projects/{project}/deliverables/{deliverable}/events/stream/ - Server-Sent Events con i nuovi eventi e le modifiche del deliverable - possibili risposte gestite 200/400/401/404
+# Vista asincrona: servita da un server ASGI (tars.asgi) ogni connessione inattiva costa solo una coroutine
+async def stream_deliverable_events(request, customer, project, deliverable):
+
+    # Controlla se l'utente è autenticato e in caso contrario restituisci errore con codice 401 Unauthorized
+    user, memberships = await sync_to_async(_authenticate)(request)
+    if not user.is_authenticated:
+        return JsonResponse({
+            "error": "Invalid auth token"
+        }, status=401)
+
+    # Ottieni il deliverable e in caso non esista (o l'utente non faccia parte del progetto) restituisci errore con codice 404 Not Found
+    deliverable_id = await memberships.scope(Deliverable.objects, project="project").filter(
+        name=deliverable, project__name=project, project__customer__name=customer
+    ).values_list("id", flat=True).afirst()
+    if deliverable_id is None:
+        return JsonResponse({
+            "detail": "Deliverable not found"
+        }, status=404)
+
+    # Id dell'ultimo messaggio ricevuto dal client, inviato dal browser alla riconnessione (o come parametro per i client che non possono impostare header)
+    # Gli id sono microsecondi dall'epoch: un id negativo o fuori scala non indica un istante e viene rifiutato con codice 400 Bad Request
+    last_event_id = request.headers.get("Last-Event-ID") or request.GET.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+        if last_event_id is not None and last_event_id < 0:
+            raise ValueError(last_event_id)
+        since = datetime.fromtimestamp(last_event_id / 1_000_000, tz=timezone.utc) if last_event_id is not None else None
+    except (ValueError, OverflowError, OSError):
+        return JsonResponse({
+            "error": "Invalid Last-Event-ID"
+        }, status=400)
+
+    # I messaggi scritti dagli altri processi arrivano con NOTIFY (BROADCAST_NOTIFY_CHANNEL)
+    await sync_to_async(start_listener)()
+
+    response = StreamingHttpResponse(
+        _event_stream(deliverable_id, last_event_id, since),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # disabilita il buffering dei reverse proxy (nginx)
+    return response
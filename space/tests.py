@@ -1,3 +1,956 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from registry.models import Company, Customer, Deliverable, Event, Project, ProjectMembership
+from registry.partitions import add_months, ensure_partitions, partition_name
+from space.builds import LATEST_BUILD_EVENTS, latest_builds
+from space.cache import DELIVERABLES_KEY, LOCAL_CACHE, customer_key, deliverable_key, project_key, tree_cache
+from space.documents import refresh_documents
+from space.encoders import DELIVERABLE_COLUMNS, encode_deliverable_row
+from space.models import DailyEventCount
+from space.pagination import events_before
+from space.serializers import DETAIL_FIELDS, DOCUMENT_FIELDS, PROJECT_DELIVERABLE_FIELDS, serialize_deliverable
+from space.stats import rebuild
+from tars import broadcast
+from tars.broadcast import Broadcaster, Message, NotifyReceiver, broadcaster, notify_payloads, publish_many_on_commit
+from tars.renderers import encode_json
+from tars.testing import QueryBudgetMixin
+
+API = "/space/api/v1"
+
+
+class SpaceQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    """
+    Query budgets of the space endpoints.
+
+    Every list is requested with 1, 3 and 10 rows: the number of queries
+    must not change (no N+1) and stay within the budget, cache misses
+    included (the document cache is cleared before every request).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        cls.company = Company.objects.create(name="iotinga", email="info@example.com")
+        cls.customer = Customer.objects.create(name="acme", company=cls.company)
+        cls.project = Project.objects.create(name="rocket", customer=cls.customer)
+        cls.deliverable = cls.create_deliverables(cls.project, 1)[0]
+        cls.sequence = count()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    @staticmethod
+    def create_deliverables(project, size):
+        existing = Deliverable.objects.filter(project=project).count()
+        deliverables = Deliverable.objects.bulk_create(
+            Deliverable(
+                name=f"deliverable-{i}",
+                project=project,
+                repository=f"https://github.com/example/deliverable-{i}",
+                production_version="1.0.0",
+                staging_version="1.1.0",
+                stage_status={"production": "published", "staging": "pending", "configuration": {"staging": "published"}},
+            )
+            for i in range(existing, size)
+        )
+        refresh_documents(Deliverable.objects.filter(project=project))
+        return deliverables
+
+    def grow_deliverables(self, size):
+        self.create_deliverables(self.project, size)
+
+    def grow_projects(self, size):
+        for i in range(self.customer.project_set.count(), size):
+            self.create_deliverables(Project.objects.create(name=f"project-{i}", customer=self.customer), 2)
+
+    def grow_customers(self, size):
+        for i in range(Customer.objects.count(), size):
+            customer = Customer.objects.create(name=f"customer-{i}", company=self.company)
+            Project.objects.create(name="project", customer=customer)
+
+    def grow_events(self, size):
+        now = timezone.now()
+        Event.objects.bulk_create(
+            Event(
+                id=f"event-{next(self.sequence)}",
+                deliverable=self.deliverable,
+                outcome="success",
+                timestamp=now - timedelta(minutes=i),
+                type="build",
+                stage="staging",
+                version=f"1.{i}.0",
+                source_code_uri="https://github.com/example/deliverable-0",
+            )
+            for i in range(self.deliverable.events.count(), size)
+        )
+
+    def get(self, url, **params):
+        def request():
+            caches[LOCAL_CACHE].clear()
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200, response.content[:500])
+            return response
+
+        return request
+
+    def test_customers(self):
+        response = self.assertQueryBudget(self.get(f"{API}/customers/"), self.grow_customers, 3, label="GET /customers/")
+        self.assertEqual(len(response.json()), 10)
+        self.assertQueryBudget(self.get(f"{API}/customers/", limit=5), self.grow_customers, 3, label="GET /customers/?limit=")
+
+    def test_customer(self):
+        response = self.assertQueryBudget(self.get(f"{API}/customers/acme/"), self.grow_projects, 3, label="GET /customers/{customer}/")
+        self.assertEqual(len(response.json()["projects"]), 10)
+
+    def test_project(self):
+        url = f"{API}/customers/acme/projects/rocket/"
+        response = self.assertQueryBudget(self.get(url), self.grow_deliverables, 3, label="GET /customers/{customer}/projects/{project}/")
+        self.assertEqual(len(response.json()["deliverables"]), 10)
+        self.assertQueryBudget(self.get(url, fields="name", include="status"), self.grow_deliverables, 3, label="GET /customers/{customer}/projects/{project}/?fields=")
+
+    def test_deliverable(self):
+        url = f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/"
+        self.assertQueryBudget(self.get(url), self.grow_events, 2, label="GET /customers/{customer}/projects/{project}/deliverables/{deliverable}/")
+
+    def test_deliverables(self):
+        response = self.assertQueryBudget(self.get(f"{API}/deliverables/"), self.grow_deliverables, 3, label="GET /deliverables/")
+        self.assertEqual(len(response.json()), 10)
+        self.assertQueryBudget(self.get(f"{API}/deliverables/", fields="name,project"), self.grow_deliverables, 3, label="GET /deliverables/?fields=")
+        self.assertQueryBudget(self.get(f"{API}/deliverables/", stage="staging"), self.grow_deliverables, 3, label="GET /deliverables/?stage=")
+
+        def stream():
+            response = self.client.get(f"{API}/deliverables/", {"format": "ndjson"})
+            return b"".join(response.streaming_content)
+
+        lines = self.assertQueryBudget(stream, self.grow_deliverables, 3, label="GET /deliverables/?format=ndjson")
+        self.assertEqual(len(lines.splitlines()), 10)
+
+    def test_events(self):
+        url = f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/events/"
+        response = self.assertQueryBudget(self.get(url), self.grow_events, 3, label="GET .../events/")
+        self.assertEqual(len(response.json()), 10)
+        self.assertQueryBudget(self.get(url, cursor="", limit=5), self.grow_events, 3, label="GET .../events/?cursor=")
+
+    def test_ingest_events(self):
+        def grow(size):
+            self.batch = [
+                {
+                    "customer": "acme",
+                    "project": "rocket",
+                    "deliverable": "deliverable-0",
+                    "id": f"ingested-{next(self.sequence)}",
+                    "outcome": "success",
+                    "type": "build",
+                    "stage": "staging",
+                    "version": "2.0.0",
+                    "source_code_uri": "https://github.com/example/deliverable-0",
+                }
+                for _ in range(size)
+            ]
+
+        def post():
+            response = self.client.post(f"{API}/events/", self.batch, format="json")
+            self.assertEqual(response.status_code, 200, response.content)
+            return response
+
+        self.assertQueryBudget(post, grow, 12, label="POST /events/")
+
+    def test_stats(self):
+        def grow(size):
+            self.grow_events(size)
+            rebuild([self.deliverable.id])
+
+        url = f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/stats/"
+        response = self.assertQueryBudget(self.get(url, bucket="month"), grow, 2, label="GET .../stats/")
+        self.assertEqual(sum(item["events"] for item in response.json()["results"]), 10)
+
+    def test_refresh_documents(self):
+        def grow(size):
+            for deliverable in self.create_deliverables(self.project, size):
+                self.deliverable = deliverable
+                self.grow_events(LATEST_BUILD_EVENTS + 1)
+
+        documents = self.assertQueryBudget(
+            lambda: refresh_documents(Deliverable.objects.filter(project=self.project)), grow, 3, label="refresh_documents"
+        )
+        builds = {document.name: len(json.loads(document.body)["latest_build_events"]) for document in documents}
+        self.assertEqual(builds.pop("deliverable-0"), 0)
+        self.assertEqual(set(builds.values()), {LATEST_BUILD_EVENTS})
+
+    def test_delete_deliverable(self):
+        def grow(size):
+            self.deliverable = Deliverable.objects.create(name=f"deleted-{size}", project=self.project, repository="https://example.com")
+            self.grow_events(size)
+
+        # the events are removed by one DELETE, without loading them
+        self.assertQueriesConstant(lambda: self.deliverable.delete(), grow, sizes=(5, 50), label="DELETE deliverable")
+        self.assertFalse(Event.objects.filter(deliverable__name__startswith="deleted-").exists())
+
+    def test_stage_status(self):
+        url = f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/configurations/staging/"
+        with self.assertMaxQueries(2, "GET .../configurations/{stage}/"):
+            self.assertEqual(self.client.get(url).json()["status"], "published")
+        # the save runs in a savepoint with the read model update (AtomicSaveModel)
+        with self.assertMaxQueries(9, "PUT .../configurations/{stage}/"):
+            self.assertEqual(self.client.put(url, {"status": "pending"}, format="json").status_code, 200)
+
+    def test_publish(self):
+        url = f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/publish/"
+        with self.assertMaxQueries(1, "POST .../publish/"):
+            response = self.client.post(url, {"stage": "staging", "version": "1.2.0"}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_auth_user(self):
+        with self.assertMaxQueries(0, "GET /auth/user/"):
+            self.assertEqual(self.client.get(f"{API}/auth/user/").json()["username"], "admin")
+
+
+class SpaceMemberQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    """Query budgets of the space lists for a user restricted to the projects they are a member of."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("member", password="member")
+        cls.company = Company.objects.create(name="iotinga", email="info@example.com")
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def grow(self, size):
+        for i in range(Customer.objects.count(), size):
+            customer = Customer.objects.create(name=f"customer-{i}", company=self.company)
+            project = Project.objects.create(name="project", customer=customer)
+            Project.objects.create(name="hidden", customer=customer)
+            ProjectMembership.objects.create(project=project, user=self.user, role=ProjectMembership.ProjectMembershipRole.DEVELOPER)
+            SpaceQueryBudgetTest.create_deliverables(project, 2)
+
+    def get(self, url):
+        def request():
+            caches[LOCAL_CACHE].clear()
+            return self.client.get(url)
+
+        return request
+
+    def test_customers(self):
+        response = self.assertQueryBudget(self.get(f"{API}/customers/"), self.grow, 4, label="GET /customers/ (member)")
+        self.assertEqual({customer["number_of_projects"] for customer in response.json()}, {1})
+
+    def test_deliverables(self):
+        response = self.assertQueryBudget(self.get(f"{API}/deliverables/"), self.grow, 4, label="GET /deliverables/ (member)")
+        self.assertEqual(len(response.json()), 20)
+
+
+class SpaceStatsTest(APITestCase):
+    """Daily event counts maintained on ingestion and ORM changes, and the stats endpoint reading them."""
+
+    URL = f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/stats/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        company = Company.objects.create(name="iotinga", email="info@example.com")
+        project = Project.objects.create(name="rocket", customer=Customer.objects.create(name="acme", company=company))
+        cls.deliverable = SpaceQueryBudgetTest.create_deliverables(project, 1)[0]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def ingest(self, *events):
+        batch = [
+            {
+                "customer": "acme",
+                "project": "rocket",
+                "deliverable": "deliverable-0",
+                "version": "1.0.0",
+                "source_code_uri": "https://github.com/example/deliverable-0",
+                **event,
+            }
+            for event in events
+        ]
+        response = self.client.post(f"{API}/events/", batch, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def counts(self):
+        return {
+            (count.day, count.stage, count.type, count.outcome): count.count
+            for count in DailyEventCount.objects.filter(deliverable=self.deliverable, count__gt=0)
+        }
+
+    def test_counts(self):
+        day = datetime(2026, 3, 2, 23, 30, tzinfo=dt_timezone.utc)
+        self.ingest(
+            {"id": "a", "timestamp": day.isoformat(), "stage": "staging", "type": "build", "outcome": "success"},
+            {"id": "b", "timestamp": day.isoformat(), "stage": "staging", "type": "build", "outcome": "failure"},
+            {"id": "c", "timestamp": (day + timedelta(hours=1)).isoformat(), "stage": "staging", "type": "build", "outcome": "success"},
+        )
+        # duplicates are not counted twice
+        self.ingest({"id": "a", "timestamp": day.isoformat(), "stage": "staging", "type": "build", "outcome": "success"})
+        Event.objects.create(
+            id="d", deliverable=self.deliverable, timestamp=day, stage="production", type="deploy", outcome="success",
+            version="1.0.0", source_code_uri="https://github.com/example/deliverable-0",
+        )
+        expected = {
+            (date(2026, 3, 2), "staging", "build", "success"): 1,
+            (date(2026, 3, 2), "staging", "build", "failure"): 1,
+            (date(2026, 3, 3), "staging", "build", "success"): 1,
+            (date(2026, 3, 2), "production", "deploy", "success"): 1,
+        }
+        self.assertEqual(self.counts(), expected)
+
+        Event.objects.filter(id="b").delete()
+        del expected[date(2026, 3, 2), "staging", "build", "failure"]
+        self.assertEqual(self.counts(), expected)
+        Event.objects.get(id="d").delete()
+        del expected[date(2026, 3, 2), "production", "deploy", "success"]
+        self.assertEqual(self.counts(), expected)
+
+        # a changed event moves from the count of its old values to the one of the new values
+        event = Event.objects.get(id="c")
+        event.outcome, event.timestamp = "failure", day
+        event.save()
+        del expected[date(2026, 3, 3), "staging", "build", "success"]
+        expected[date(2026, 3, 2), "staging", "build", "failure"] = 1
+        self.assertEqual(self.counts(), expected)
+        event.version = "1.0.1"
+        event.save(update_fields=["version"])
+        self.assertEqual(self.counts(), expected)
+
+        # a rebuild recomputes the same counts
+        DailyEventCount.objects.update(count=100)
+        call_command("rebuild_event_stats", "--customer", "acme", stdout=StringIO())
+        self.assertEqual(self.counts(), expected)
+
+        # the counts of the days before the oldest stored event, dropped by the retention, are kept
+        dropped = {"deliverable": self.deliverable, "stage": "staging", "type": "build", "outcome": "success"}
+        DailyEventCount.objects.create(day=date(2025, 1, 6), count=7, **dropped)
+        DailyEventCount.objects.create(day=date(2026, 3, 4), count=7, **dropped)
+        rebuild()
+        self.assertEqual(self.counts(), {**expected, (date(2025, 1, 6), "staging", "build", "success"): 7})
+
+    def test_stats(self):
+        start = datetime(2026, 3, 2, 12, tzinfo=dt_timezone.utc)
+        self.ingest(*(
+            {
+                "id": f"event-{i}",
+                "timestamp": (start + timedelta(days=i)).isoformat(),
+                "stage": "staging",
+                "type": "build",
+                "outcome": "failure" if i % 4 == 3 else "success",
+            }
+            for i in range(14)
+        ))
+
+        results = self.client.get(self.URL, {"bucket": "week"}).json()["results"]
+        self.assertEqual(
+            [(item["period"], item["events"], item["outcomes"]) for item in results],
+            [
+                ("2026-03-02", 7, {"failure": 1, "success": 6}),
+                ("2026-03-09", 7, {"failure": 2, "success": 5}),
+            ],
+        )
+        self.assertEqual(results[0]["success_rate"], round(6 / 7, 4))
+
+        results = self.client.get(self.URL, {"from": "2026-03-05", "to": "2026-03-06"}).json()["results"]
+        self.assertEqual([(item["period"], item["events"]) for item in results], [("2026-03-05", 1), ("2026-03-06", 1)])
+        self.assertEqual(self.client.get(self.URL, {"type": "deploy"}).json()["results"], [])
+
+        with self.assertLogs("django.request", "WARNING"):
+            self.assertEqual(self.client.get(self.URL, {"bucket": "hour"}).status_code, 400)
+            self.assertEqual(self.client.get(self.URL, {"from": "yesterday"}).status_code, 400)
+            self.assertEqual(self.client.get(self.URL.replace("deliverable-0", "missing")).status_code, 404)
+
+
+class SpaceLatestBuildsTest(APITestCase):
+    """latest_build_events lists the latest build events, last_build_* follows the events."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        company = Company.objects.create(name="iotinga", email="info@example.com")
+        cls.project = Project.objects.create(name="rocket", customer=Customer.objects.create(name="acme", company=company))
+        SpaceQueryBudgetTest.create_deliverables(cls.project, 2)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        self.start = datetime(2026, 3, 2, tzinfo=dt_timezone.utc)
+
+    def create_event(self, id, deliverable, hours, type="build"):
+        return Event.objects.create(
+            id=id, deliverable=deliverable, outcome="success", timestamp=self.start + timedelta(hours=hours), type=type,
+            stage="staging", version=f"1.{hours}.0", source_code_uri="https://github.com/example/deliverable-0",
+        )
+
+    def latest_builds(self):
+        deliverables = self.client.get(f"{API}/deliverables/").json()
+        return {deliverable["name"]: [event["id"] for event in deliverable["latest_build_events"]] for deliverable in deliverables}
+
+    def test_latest_build_events(self):
+        first, second = Deliverable.objects.order_by("name")
+        self.assertEqual(self.latest_builds(), {"deliverable-0": [], "deliverable-1": []})
+        response = self.client.get(f"{API}/customers/acme/projects/rocket/")
+        self.assertEqual({deliverable["last_build_event"] for deliverable in response.json()["deliverables"]}, {None})
+
+        for hours in range(LATEST_BUILD_EVENTS + 2):
+            self.create_event(f"build-{hours}", first, hours)
+        self.create_event("deploy", first, 100, type="deploy")
+        batch = [
+            {
+                "customer": "acme", "project": "rocket", "deliverable": "deliverable-1", "id": f"ingested-{hours}",
+                "timestamp": (self.start + timedelta(hours=hours)).isoformat(), "outcome": "failure",
+                "type": "build", "stage": "staging", "version": "2.0.0", "source_code_uri": "https://github.com/example/deliverable-1",
+            }
+            for hours in (3, 1)
+        ]
+        self.assertEqual(self.client.post(f"{API}/events/", batch, format="json").status_code, 200)
+
+        expected = [f"build-{hours}" for hours in range(LATEST_BUILD_EVENTS + 1, 1, -1)]
+        self.assertEqual(self.latest_builds(), {"deliverable-0": expected, "deliverable-1": ["ingested-3", "ingested-1"]})
+        response = self.client.get(f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/")
+        self.assertEqual([event["id"] for event in response.json()["latest_build_events"]], expected)
+        first.refresh_from_db()
+        self.assertEqual((first.last_build_event_id, first.last_build_version), (expected[0], f"1.{LATEST_BUILD_EVENTS + 1}.0"))
+
+        # deleting the latest build moves last_build_* and the list back to the previous builds
+        Event.objects.filter(id=expected[0]).delete()
+        first.refresh_from_db()
+        self.assertEqual(first.last_build_event_id, expected[1])
+        self.assertEqual(self.latest_builds()["deliverable-0"], expected[1:] + ["build-1"])
+
+        # the event and the rows derived from it are written in one transaction
+        with mock.patch("space.signals.refresh_documents", side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.create_event("build-200", first, 200)
+        self.assertFalse(Event.objects.filter(id="build-200").exists())
+        first.refresh_from_db()
+        self.assertEqual(first.last_build_event_id, expected[1])
+
+
+class SpaceDeliverableFilterTest(APITestCase):
+    """Filters of GET /deliverables/, evaluated in the database."""
+
+    URL = f"{API}/deliverables/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        company = Company.objects.create(name="iotinga", email="info@example.com")
+        rocket = Project.objects.create(name="rocket", customer=Customer.objects.create(name="acme", company=company))
+        probe = Project.objects.create(name="probe", customer=Customer.objects.create(name="globex", company=company))
+        SpaceQueryBudgetTest.create_deliverables(rocket, 2)
+        SpaceQueryBudgetTest.create_deliverables(probe, 1)
+        # deliverable-1 of rocket: staging published with version 1.2.0, no delivery stage
+        Deliverable.objects.filter(project=rocket, name="deliverable-1").update(
+            staging_version="1.2.0",
+            stage_status={"production": "published", "staging": "published", "configuration": {"staging": "pending"}},
+        )
+        refresh_documents(Deliverable.objects.all())
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def names(self, **params):
+        response = self.client.get(self.URL, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(deliverable["customer"], deliverable["project"], deliverable["name"]) for deliverable in response.json()]
+
+    def test_filters(self):
+        self.assertEqual(self.names(customer="acme"), [("acme", "rocket", "deliverable-0"), ("acme", "rocket", "deliverable-1")])
+        self.assertEqual(self.names(customer="globex", project="probe"), [("globex", "probe", "deliverable-0")])
+        self.assertEqual(self.names(project="rocket", customer="globex"), [])
+        self.assertEqual(self.names(stage="staging", status="published"), [("acme", "rocket", "deliverable-1")])
+        self.assertEqual(len(self.names(stage="staging", status="pending")), 2)
+        self.assertEqual(self.names(stage="staging", configuration="pending"), [("acme", "rocket", "deliverable-1")])
+        self.assertEqual(len(self.names(stage="production")), 3)
+        self.assertEqual(self.names(stage="delivery"), [])
+        self.assertEqual(self.names(staging_version="1.2.0"), [("acme", "rocket", "deliverable-1")])
+        self.assertEqual(len(self.names(production_version="1.0.0", customer="acme")), 2)
+        self.assertEqual(self.names(delivery_version="9.9.9"), [])
+
+    def test_invalid_filters(self):
+        for params in [{"stage": "testing"}, {"status": "published"}, {"configuration": "pending"}, {"stage": "", "status": "published"}]:
+            response = self.client.get(self.URL, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn("error", response.json())
+
+
+class SpaceFieldsTest(APITestCase):
+    """Shapes returned with ?fields= and ?include= by the deliverable endpoints."""
+
+    PROJECT = f"{API}/customers/acme/projects/rocket/"
+    DELIVERABLE = f"{PROJECT}deliverables/deliverable-0/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        company = Company.objects.create(name="iotinga", email="info@example.com")
+        project = Project.objects.create(name="rocket", customer=Customer.objects.create(name="acme", company=company))
+        SpaceQueryBudgetTest.create_deliverables(project, 2)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_deliverables(self):
+        self.assertEqual(self.get(f"{API}/deliverables/", fields="name,project"), [
+            {"name": "deliverable-0", "project": "rocket"}, {"name": "deliverable-1", "project": "rocket"},
+        ])
+        deliverable = self.get(f"{API}/deliverables/", fields="name", include="configuration")[0]
+        self.assertEqual(deliverable, {"name": "deliverable-0", "configuration": {"staging": "published"}})
+        self.assertEqual(set(self.get(f"{API}/deliverables/")[0]), set(DOCUMENT_FIELDS))
+
+    def test_deliverable(self):
+        deliverable = self.get(self.DELIVERABLE)
+        self.assertEqual(set(deliverable), set(DETAIL_FIELDS))
+        self.assertNotIn("status", deliverable["stages"]["staging"])
+
+        self.assertEqual(self.get(self.DELIVERABLE, fields="name,repository_uri"), {
+            "name": "deliverable-0", "repository_uri": "https://github.com/example/deliverable-0",
+        })
+        stages = self.get(self.DELIVERABLE, fields="name", include="status")["stages"]
+        self.assertEqual({stage: block["status"] for stage, block in stages.items()}, {"production": "published", "staging": "pending", "delivery": None})
+
+    def test_project(self):
+        deliverables = self.get(self.PROJECT, fields="name,last_build_event")["deliverables"]
+        self.assertEqual(deliverables, [{"name": "deliverable-0", "last_build_event": None}, {"name": "deliverable-1", "last_build_event": None}])
+        deliverables = self.get(self.PROJECT, fields="name", include="configuration,status")["deliverables"]
+        self.assertEqual(set(deliverables[0]), {"name", "configuration", "stages"})
+        self.assertEqual(deliverables[0]["stages"]["production"]["status"], "published")
+        self.assertEqual(set(self.get(self.PROJECT)["deliverables"][0]), set(PROJECT_DELIVERABLE_FIELDS))
+
+    def test_invalid(self):
+        for url in (f"{API}/deliverables/", self.PROJECT, self.DELIVERABLE):
+            for params in [{"fields": "name,owner"}, {"include": "events"}]:
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400, (url, params))
+            # a field of another endpoint
+            self.assertEqual(self.client.get(url, {"fields": "last_build_event" if url != self.PROJECT else "latest_build_events"}).status_code, 400)
+
+
+class SpaceEncoderTest(APITestCase):
+    """encode_deliverable_row produces the same bytes as DRF encoding serialize_deliverable."""
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="iotinga", email="info@example.com")
+        customer = Customer.objects.create(name='Ac"me \\ ünïcode', company=company)
+        project = Project.objects.create(name="rocket %s 100%", customer=customer)
+        published = datetime(2026, 3, 2, 10, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        Deliverable.objects.create(
+            name="plain", project=project, repository="https://github.com/example/plain", stage_status={},
+        )
+        deliverable = Deliverable.objects.create(
+            name='dé \\ "q" / <b> %d',
+            project=project,
+            repository="https://github.com/example/ünï",
+            production_version="1.0.0",
+            production_last_published_at=published,
+            production_download_uri="https://example.com/download?a=1&b=%20",
+            staging_version="1.1.0-rc.1",
+            staging_last_published_at=published.replace(microsecond=0),
+            stage_status={
+                "production": "published",
+                "staging": {"state": "pending", "nested": [1, 2.5, None, True]},
+                "configuration": {"staging": "published", "note": "tab\there"},
+            },
+        )
+        for i, external_ref in enumerate([None, "PR-1 ✓", ""]):
+            Event.objects.create(
+                id=f"build \"{i}\"", deliverable=deliverable, outcome="success", timestamp=published + timedelta(seconds=i),
+                type="build", stage="staging", version=f"1.{i}.0", source_code_uri="https://github.com/example/ünï",
+                external_ref=external_ref, external_ref_uri="https://example.com/pr/1" if external_ref else None,
+            )
+
+    def test_equivalence(self):
+        deliverables = Deliverable.objects.select_related("project__customer").order_by("name")
+        builds = latest_builds([deliverable.id for deliverable in deliverables])
+        rows = {row[0]: row for row in Deliverable.objects.values_list(*DELIVERABLE_COLUMNS)}
+        self.assertEqual(len(rows), 2)
+        for deliverable in deliverables:
+            events = builds.get(deliverable.id, ())
+            expected = encode_json(serialize_deliverable(deliverable, events))
+            self.assertEqual(encode_deliverable_row(rows[deliverable.id], events).encode(), expected)
+        self.assertEqual(len(builds[deliverables[0].id]), 3)
+
+    def test_line_separators(self):
+        # escaped like JSONRenderer does (not stored here: the test database may not be UTF-8)
+        deliverable = Deliverable(
+            name="line\u2028sep\u2029",
+            project=Project(name="rocket", customer=Customer(name="acme")),
+            repository="https://github.com/example/line",
+            stage_status={"configuration": {"note": "\u2028"}},
+        )
+        row = []
+        for column in DELIVERABLE_COLUMNS:
+            value = deliverable
+            for name in column.split("__"):
+                value = getattr(value, name)
+            row.append(value)
+        body = encode_deliverable_row(row).encode()
+        self.assertEqual(body, encode_json(serialize_deliverable(deliverable)))
+        self.assertIn(b"line\\u2028sep\\u2029", body)
+
+
+class SpaceTreeCacheTest(APITestCase):
+    """The cached customer, project and deliverable documents are evicted by the changes they depend on."""
+
+    KEYS = {
+        DELIVERABLES_KEY,
+        customer_key("acme"),
+        project_key("acme", "rocket"),
+        deliverable_key("acme", "rocket", "deliverable-0"),
+        deliverable_key("acme", "rocket", "deliverable-1"),
+        customer_key("globex"),
+        project_key("globex", "probe"),
+        deliverable_key("globex", "probe", "deliverable-0"),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        company = Company.objects.create(name="iotinga", email="info@example.com")
+        cls.acme = Customer.objects.create(name="acme", company=company)
+        cls.rocket = Project.objects.create(name="rocket", customer=cls.acme)
+        cls.probe = Project.objects.create(name="probe", customer=Customer.objects.create(name="globex", company=company))
+        SpaceQueryBudgetTest.create_deliverables(cls.rocket, 2)
+        SpaceQueryBudgetTest.create_deliverables(cls.probe, 1)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        caches[LOCAL_CACHE].clear()
+
+    def cached(self):
+        return {key for key in self.KEYS if tree_cache.local.get(tree_cache.make_key(key)) is not None}
+
+    def evicted(self, change):
+        """Keys evicted by change(), with every document cached before it."""
+        for url in ["deliverables/", "customers/acme/", "customers/globex/"]:
+            self.assertEqual(self.client.get(f"{API}/{url}").status_code, 200)
+        for customer, project, names in [("acme", "rocket", ["deliverable-0", "deliverable-1"]), ("globex", "probe", ["deliverable-0"])]:
+            self.assertEqual(self.client.get(f"{API}/customers/{customer}/projects/{project}/").status_code, 200)
+            for name in names:
+                self.assertEqual(self.client.get(f"{API}/customers/{customer}/projects/{project}/deliverables/{name}/").status_code, 200)
+        self.assertEqual(self.cached(), self.KEYS)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        return self.KEYS - self.cached()
+
+    def create_event(self, deliverable):
+        return Event.objects.create(
+            id="build-1", deliverable=deliverable, outcome="success", timestamp=timezone.now(), type="build",
+            stage="staging", version="1.0.0", source_code_uri="https://github.com/example/deliverable-0",
+        )
+
+    def test_customer(self):
+        acme = {DELIVERABLES_KEY, customer_key("acme"), project_key("acme", "rocket"),
+                deliverable_key("acme", "rocket", "deliverable-0"), deliverable_key("acme", "rocket", "deliverable-1")}
+        self.assertEqual(self.evicted(self.acme.save), acme)
+
+        # a customer without projects
+        initech = Customer.objects.create(name="initech", company=self.acme.company)
+        self.client.get(f"{API}/customers/initech/")
+        self.assertIsNotNone(tree_cache.local.get(tree_cache.make_key(customer_key("initech"))))
+        with self.captureOnCommitCallbacks(execute=True):
+            initech.delete()
+        self.assertIsNone(tree_cache.local.get(tree_cache.make_key(customer_key("initech"))))
+
+    def test_project(self):
+        rocket = {DELIVERABLES_KEY, customer_key("acme"), project_key("acme", "rocket"),
+                  deliverable_key("acme", "rocket", "deliverable-0"), deliverable_key("acme", "rocket", "deliverable-1")}
+        self.assertEqual(self.evicted(self.rocket.save), rocket)
+        probe = {DELIVERABLES_KEY, customer_key("globex"), project_key("globex", "probe"), deliverable_key("globex", "probe", "deliverable-0")}
+        self.assertEqual(self.evicted(self.probe.delete), probe)
+
+    def test_deliverable(self):
+        first, second = Deliverable.objects.filter(project=self.rocket).order_by("name")
+        self.assertEqual(self.evicted(first.save), {DELIVERABLES_KEY, project_key("acme", "rocket"), deliverable_key("acme", "rocket", "deliverable-0")})
+        self.assertEqual(self.evicted(second.delete), {DELIVERABLES_KEY, project_key("acme", "rocket"), deliverable_key("acme", "rocket", "deliverable-1")})
+
+    def test_event(self):
+        deliverable = Deliverable.objects.get(project=self.probe)
+        probe = {DELIVERABLES_KEY, project_key("globex", "probe"), deliverable_key("globex", "probe", "deliverable-0")}
+        self.assertEqual(self.evicted(lambda: self.create_event(deliverable)), probe)
+        self.assertEqual(self.evicted(lambda: Event.objects.filter(id="build-1").delete()), probe)
+
+
+class SpaceConditionalTest(APITestCase):
+    """Conditional GETs: 304 while nothing changed, 200 after updates and deletes."""
+
+    DELIVERABLE = f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        company = Company.objects.create(name="iotinga", email="info@example.com")
+        cls.project = Project.objects.create(name="rocket", customer=Customer.objects.create(name="acme", company=company))
+        SpaceQueryBudgetTest.create_deliverables(cls.project, 3)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def assertNotModified(self, url, response):
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def assertModified(self, url, response):
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+
+    def test_deliverable(self):
+        response = self.client.get(self.DELIVERABLE)
+        self.assertNotModified(self.DELIVERABLE, response)
+        not_modified = self.client.get(self.DELIVERABLE, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(not_modified.status_code, 304)
+
+        deliverable = Deliverable.objects.get(name="deliverable-0")
+        deliverable.production_version = "2.0.0"
+        deliverable.save()
+        self.assertModified(self.DELIVERABLE, response)
+        self.assertEqual(self.client.get(self.DELIVERABLE, HTTP_IF_MODIFIED_SINCE="Thu, 01 Jan 2026 00:00:00 GMT").status_code, 200)
+
+    def test_lists(self):
+        # a delete does not move Max(updated_at): the lists are validated by the ETag only
+        for url in (f"{API}/deliverables/", f"{API}/customers/acme/projects/rocket/", f"{API}/customers/acme/"):
+            response = self.client.get(url)
+            self.assertNotIn("Last-Modified", response)
+            self.assertNotModified(url, response)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT").status_code, 200)
+
+        url = f"{API}/deliverables/"
+        response = self.client.get(url)
+        Deliverable.objects.get(name="deliverable-2").delete()
+        self.assertModified(url, response)
+
+        response = self.client.get(url)
+        Deliverable.objects.filter(name="deliverable-1").update(production_version="3.0.0")
+        refresh_documents(Deliverable.objects.filter(name="deliverable-1"))
+        self.assertModified(url, response)
+
+    def test_events(self):
+        url = f"{self.DELIVERABLE}events/"
+        deliverable = Deliverable.objects.get(name="deliverable-0")
+        for i in range(3):
+            Event.objects.create(
+                id=f"event-{i}", deliverable=deliverable, outcome="success", timestamp=timezone.now() - timedelta(hours=i),
+                type="build", stage="staging", version="1.0.0", source_code_uri="https://github.com/example/deliverable-0",
+            )
+        response = self.client.get(url)
+        self.assertNotIn("Last-Modified", response)
+        self.assertNotModified(url, response)
+
+        # the latest events are unchanged, the delete is told by the document of the deliverable
+        Event.objects.filter(id="event-2").delete()
+        self.assertModified(url, response)
+
+
+class SpaceEventPagesTest(APITestCase):
+    """Cursor pages of the events of a deliverable and validation of the paging parameters."""
+
+    URL = f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/events/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        company = Company.objects.create(name="iotinga", email="info@example.com")
+        project = Project.objects.create(name="rocket", customer=Customer.objects.create(name="acme", company=company))
+        deliverable = SpaceQueryBudgetTest.create_deliverables(project, 1)[0]
+        start = datetime(2026, 3, 2, tzinfo=dt_timezone.utc)
+        # three events share the same timestamp: the id breaks the tie
+        for id, hours in [("a", 0), ("b", 1), ("c", 1), ("d", 1), ("e", 2)]:
+            Event.objects.create(
+                id=id, deliverable=deliverable, outcome="success", timestamp=start + timedelta(hours=hours), type="build",
+                stage="staging", version="1.0.0", source_code_uri="https://github.com/example/deliverable-0",
+            )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_cursor_plan(self):
+        # the cursor is an index condition, not a filter of the rows read, and the later partitions are pruned
+        march = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        ensure_partitions(ahead=1, now=march)
+        events = Event.objects.filter(deliverable=Deliverable.objects.get()).order_by("-timestamp", "-id")
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = events_before(events, march + timedelta(days=1, hours=1), "c")[:2].explain()
+        self.assertRegex(plan, r'Index Cond: .*ROW\("timestamp", \(id\)::text\) < ROW\(')
+        self.assertNotIn("Filter", plan)
+        self.assertIn(partition_name(march), plan)
+        self.assertNotIn(partition_name(add_months(march, 1)), plan)
+
+    def test_pages(self):
+        pages, url = [], f"{self.URL}?cursor=&limit=2"
+        while url:
+            page = self.client.get(url).json()
+            pages.append([event["id"] for event in page["results"]])
+            url = page["next"]
+        self.assertEqual(pages, [["e", "d"], ["c", "b"], ["a"]])
+
+        # a last page exactly full has no next page
+        page = self.client.get(self.URL, {"cursor": "", "limit": 5}).json()
+        self.assertEqual(([event["id"] for event in page["results"]], page["next"]), (["e", "d", "c", "b", "a"], None))
+
+    def test_invalid_parameters(self):
+        for params in [{"cursor": "not a cursor"}, {"cursor": "WzFd"}, {"limit": 0}, {"limit": -1}, {"limit": "abc"},
+                       {"limit": 1001}, {"offset": -1}, {"offset": "x"}, {"from": "yesterday"}]:
+            response = self.client.get(self.URL, params)
+            self.assertEqual(response.status_code, 400, params)
+        self.assertEqual(len(self.client.get(self.URL, {"limit": 1000}).json()), 5)
+
+
+class BroadcasterTest(SimpleTestCase):
+    """Replay history of the live streams broadcaster."""
+
+    async def test_history_per_channel(self):
+        broadcaster = Broadcaster(history=3)
+        async with broadcaster.subscribe("deliverable"), broadcaster.subscribe("registry.context"):
+            first = broadcaster.publish("deliverable", "event", "1")
+            for i in range(10):
+                broadcaster.publish("registry.context", "revision", str(i))
+
+        # a busy channel does not evict the history of the others
+        async with broadcaster.subscribe("deliverable", first.id - 1) as subscription:
+            self.assertEqual([message.data for message in subscription.replay], ["1"])
+        async with broadcaster.subscribe("registry.context", first.id) as subscription:
+            self.assertIsNone(subscription.replay)
+
+    async def test_history_without_subscribers(self):
+        broadcaster = Broadcaster(keep=0)
+        async with broadcaster.subscribe("deliverable"):
+            first = broadcaster.publish("deliverable", "event", "1")
+        # the history of a channel is dropped once idle, the messages published since cannot be replayed
+        broadcaster.publish("deliverable", "event", "2")
+        self.assertEqual(broadcaster._history, {})
+        async with broadcaster.subscribe("deliverable", first.id) as subscription:
+            self.assertIsNone(subscription.replay)
+        async with broadcaster.subscribe("other", broadcaster.next_id()) as subscription:
+            self.assertEqual(subscription.replay, [])
+
+    async def test_out_of_order(self):
+        # a message of another process committed after a later one
+        broadcaster = Broadcaster()
+        async with broadcaster.subscribe("deliverable"):
+            early, late = broadcaster.next_id(), broadcaster.next_id()
+            broadcaster.publish("deliverable", "event", "late", late)
+            broadcaster.publish("deliverable", "event", "early", early)
+            async with broadcaster.subscribe("deliverable", late) as subscription:
+                self.assertIsNone(subscription.replay)
+            later = broadcaster.publish("deliverable", "event", "later")
+            async with broadcaster.subscribe("deliverable", later.id - 1) as subscription:
+                self.assertEqual(subscription.replay, [later])
+
+    async def test_restart(self):
+        # the NOTIFY listener reconnected: the messages published meanwhile were not received
+        broadcaster = Broadcaster()
+        async with broadcaster.subscribe("deliverable"):
+            first = broadcaster.publish("deliverable", "event", "1")
+            broadcaster.restart()
+            async with broadcaster.subscribe("deliverable", first.id) as subscription:
+                self.assertIsNone(subscription.replay)
+
+    def test_notify_parts(self):
+        receiver = NotifyReceiver()
+        message = Message(42, "deliverable", "event", "àèìòù" * 10 + "\n" + "x" * 7)
+        with mock.patch.object(broadcast, "NOTIFY_PART_SIZE", 8):
+            payloads = notify_payloads(message)
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload.split("\n", 1)[1].encode()) <= 8 for payload in payloads))
+        self.assertEqual([receiver.receive(payload) for payload in payloads], [None] * (len(payloads) - 1) + [message])
+
+        # a message missing its first parts is dropped
+        self.assertEqual([receiver.receive(payload) for payload in payloads[1:]], [None] * (len(payloads) - 1))
+
+
+class BroadcasterNotifyTest(TransactionTestCase):
+    """Messages published through PostgreSQL NOTIFY, received by the listener of another connection."""
+
+    def test_notify(self):
+        from psycopg import connect
+
+        with connect(**connection.get_connection_params(), autocommit=True) as listener, \
+                mock.patch.object(broadcast, "NOTIFY_CHANNEL", "tars_broadcast_test"):
+            listener.execute("LISTEN tars_broadcast_test")
+            messages = [("1", "event", "a"), ("2", "deliverable", "b" * 20000)]
+            publish_many_on_commit(messages)
+            receiver = NotifyReceiver()
+            received = [receiver.receive(notify.payload) for notify in listener.notifies(timeout=5, stop_after=4)]
+        received = [message for message in received if message is not None]
+        self.assertEqual([(message.channel, message.event, message.data) for message in received], messages)
+        self.assertLess(received[0].id, received[1].id)
+
+
+class SpaceStreamTest(APITestCase):
+    """Server-Sent Events stream of a deliverable: live messages, replay and backfill after a reconnection."""
+
+    URL = f"{API}/customers/acme/projects/rocket/deliverables/deliverable-0/events/stream/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", password="admin")
+        company = Company.objects.create(name="iotinga", email="info@example.com")
+        project = Project.objects.create(name="rocket", customer=Customer.objects.create(name="acme", company=company))
+        cls.deliverable = SpaceQueryBudgetTest.create_deliverables(project, 1)[0]
+
+    async def stream(self, headers=None):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.URL, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return response.streaming_content
+
+    async def read(self, stream, count):
+        chunks = [await asyncio.wait_for(anext(stream), 5) for _ in range(count)]
+        return [chunk.decode() for chunk in chunks]
+
+    async def test_live(self):
+        stream = await self.stream()
+        self.assertEqual(await self.read(stream, 1), ["retry: 3000\n\n"])
+        reading = asyncio.create_task(self.read(stream, 1))
+        await asyncio.sleep(0.1)
+        message = broadcaster.publish(str(self.deliverable.id), "event", '{"id": "build-1"}')
+        self.assertEqual(await reading, [f'id: {message.id}\nevent: event\ndata: {{"id": "build-1"}}\n\n'])
+        await stream.aclose()
+
+    async def test_replay(self):
+        channel = str(self.deliverable.id)
+        # published while the client was connected
+        async with broadcaster.subscribe(channel):
+            first, second, third = (broadcaster.publish(channel, "event", str(i)) for i in range(3))
+        stream = await self.stream({"Last-Event-ID": str(first.id)})
+        self.assertEqual(await self.read(stream, 3), ["retry: 3000\n\n", second.encode().decode(), third.encode().decode()])
+        await stream.aclose()
+
+    async def test_backfill(self):
+        # older than the history: the current document and the events changed since then are read from the database
+        await Event.objects.acreate(
+            id="build-1", deliverable=self.deliverable, outcome="success", timestamp=timezone.now(), type="build",
+            stage="staging", version="1.0.0", source_code_uri="https://github.com/example/deliverable-0",
+        )
+        stream = await self.stream({"Last-Event-ID": "1"})
+        retry, document, event = await self.read(stream, 3)
+        self.assertIn("event: deliverable\n", document)
+        self.assertIn('"id":"build-1"', event)
+        await stream.aclose()
+
+    async def test_invalid_last_event_id(self):
+        await self.async_client.aforce_login(self.user)
+        for last_event_id in ["-1", "abc", "1" + "0" * 30]:
+            response = await self.async_client.get(self.URL, headers={"Last-Event-ID": last_event_id})
+            self.assertEqual(response.status_code, 400, last_event_id)
@@ -1,7 +1,7 @@
 from django.urls import path, include
 
 from rest_framework import routers
-from space import views
+from space import streams, views
 
 
 router = routers.DefaultRouter()
@@ -17,11 +17,15 @@ urlpatterns = [
     path('api/v1/customers/<str:customer_name>/projects/<str:project_name>/', views.get_project_details),
     path('api/v1/customers/<str:customer_name>/projects/<str:project_name>/deliverables/<str:deliverable_name>/', views.get_deliverable_details),
     path('api/v1/deliverables/', views.get_all_deliverables),
+    path('api/v1/events/', views.ingest_deliverable_events),
+    path('api/v1/cache/', views.cache_stats),
     path('api/v1/customers/<str:customer>/projects/<str:project>/deliverables/<str:deliverable>/configurations/<str:stage>/', views.stage_status),
     
 
     ## TESTING ##
     path('api/v1/customers/<str:customer>/projects/<str:project>/deliverables/<str:deliverable>/events/', views.get_deliverable_events),
+    path('api/v1/customers/<str:customer>/projects/<str:project>/deliverables/<str:deliverable>/events/stream/', streams.stream_deliverable_events),
+    path('api/v1/customers/<str:customer>/projects/<str:project>/deliverables/<str:deliverable>/stats/', views.get_deliverable_stats),
     path('api/v1/customers/<str:customer>/projects/<str:project>/deliverables/<str:deliverable>/publish/', views.publish_deliverable),
     
 ]
@@ -1,16 +1,87 @@
+import json
+
 from django.shortcuts import render
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import logout
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from authentication.functions.membership import get_memberships
 from registry.models import Customer, Project, Deliverable, Event
 from rest_framework import status
 from django.shortcuts import get_object_or_404
-from datetime import datetime
+from datetime import date, datetime
 from django.middleware.csrf import get_token
+from django.db.models import Count, Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from space.pagination import (
+    CUSTOMER_ORDERINGS,
+    CustomerCursorPagination,
+    decode_event_cursor,
+    encode_event_cursor,
+    event_page_url,
+    events_before,
+)
+from tars.renderers import NDJSONRenderer, encode_json, stream_json_array, stream_ndjson
+from space.conditional import (
+    conditional,
+    configuration_marker,
+    customer_marker,
+    customers_marker,
+    deliverable_marker,
+    deliverables_marker,
+    events_marker,
+    project_marker,
+)
+from space.events import ingest_events
+from space.models import DeliverableDocument
+from space.stats import BUCKETS, bucket_stats
+from space.cache import ALL, DELIVERABLES_KEY, customer_key, deliverable_key, project_key, tree_cache
+from space.documents import read_documents
+from space.encoders import encode_array
+from space.serializers import (
+    DETAIL_FIELDS,
+    DOCUMENT_FIELDS,
+    PROJECT_DELIVERABLE_FIELDS,
+    STAGES,
+    EventInputSerializer,
+    select_fields,
+    serialize_event,
+    shape_document,
+    shape_keys,
+)
+
+# Numero di righe lette dal cursore lato server per ogni giro nelle risposte in streaming
+STREAM_CHUNK_SIZE = 500
+
+# Numero massimo di eventi accettati da POST /events/ in una singola richiesta
+MAX_INGEST_EVENTS = 10000
+
+# Eventi restituiti da GET .../events/ senza ?limit= e massimo ammesso per ?limit=
+EVENTS_LIMIT = 50
+MAX_EVENTS_LIMIT = 1000
+
+# Parametri di GET /deliverables/ che filtrano per versione pubblicata, con la colonna corrispondente del deliverable
+VERSION_FILTERS = {
+    "production_version": "deliverable__production_version",
+    "staging_version": "deliverable__staging_version",
+    "delivery_version": "deliverable__delivery_version",
+}
+
+def _json_response(request, body):
+    # Corpo JSON già codificato: restituito così com'è in JSON, decodificato per gli altri renderer (API navigabile)
+    if request.accepted_renderer.format == JSONRenderer.format:
+        return HttpResponse(body, content_type="application/json", status=200)
+    return Response(json.loads(body), status=200)
+
+
+def _cached_json(request, key, build, scope=ALL):
+    # Corpo JSON della chiave dalla cache dei documenti (space.cache), valido per l'indicatore di modifica calcolato da @conditional
+    return _json_response(request, tree_cache.get_or_build(key, request.change_token, build, scope))
+
 
 ## AUTHENTICATION (WORKING) ##
 
@@ -92,9 +163,11 @@ def auth_logout(request: Request):
 
 ## CUSTOMER MANAGEMENT (WORKING) ##
 
-# GET /customers/ - Ottieni tutti i clienti con il numero di progetti associati e il loro id - possibili risposte gestite 200/401 ✓
+# GET /customers/ - Ottieni tutti i clienti con il numero di progetti associati e il loro id - possibili risposte gestite 200/304/400/401/404 ✓
+# Parametri opzionali: name (prefisso del nome), ordering (name, -name, number_of_projects, -number_of_projects), limit e cursor (paginazione a cursore)
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])  # Solo utenti autenticati possono accedere a queste funzionalità
+@conditional(customers_marker)
 def get_customers(request):
  
     # Controlla se l'utente è autenticato e in caso contrario restituisci errore con codice 401 Unauthorized
@@ -103,30 +176,33 @@ def get_customers(request):
             "error":"Invalid auth token"
         }, status=401)
 
-    # Recupera tutti i clienti attraverso la funzione `Customer.objects.all()` che restituisce un queryset (una raccolta di oggetti in django) con tutti gli oggetti della tabella `Customer`
-    customers = Customer.objects.all()
-
-    # Crea una lista di dizionari vuota che conterrà i dati relativi ai clienti
-    customers_data = []
+    # Verifica che l'ordinamento richiesto sia tra quelli ammessi, altrimenti restituisci errore con codice 400 Bad Request
+    ordering = request.query_params.get("ordering", "name")
+    if ordering not in CUSTOMER_ORDERINGS:
+        return Response({
+            "error": f"Invalid ordering, allowed values are: {', '.join(CUSTOMER_ORDERINGS)}"
+        }, status=400)
 
-    # Per ogni cliente nel queryset
-    for customer in customers:
+    # Un'unica query aggregata: il numero di progetti viene calcolato dal database con COUNT ... GROUP BY
+    # Solo i clienti e i progetti visibili all'utente (membership dei progetti, tutti per i superuser)
+    memberships = get_memberships(request)
+    customers = memberships.scope(Customer.objects, customer="id").values("id", "name").annotate(
+        number_of_projects=Count("project", filter=memberships.condition(project="project"))
+    )
 
-        # Conta il numero di progetti associati a questo cliente (funzione di django)
-        num_projects = Project.objects.filter(customer=customer).count()
-        
-        # Crea un dizionario contenente i dati del cliente con il numero di progetti
-        customer_data = {
-            "name": customer.name,
-            "id": customer.id,
-            "number_of_projects": num_projects
-        }
+    # Filtro per prefisso del nome (LIKE 'prefisso%', servito dall'indice registry_customer_name_prefix)
+    name = request.query_params.get("name")
+    if name:
+        customers = customers.filter(name__startswith=name)
 
-        # Aggiungi alla lista di dizionari il dizionario appena creato
-        customers_data.append(customer_data)
+    # Se richiesta, applica la paginazione a cursore (ordinamento e filtro sul cursore vengono eseguiti in SQL)
+    paginator = CustomerCursorPagination(ordering)
+    page = paginator.paginate_queryset(customers, request)
+    if page is not None:
+        return paginator.get_paginated_response(page)
 
     # Restituisci i dati con codice 200 OK
-    return Response(customers_data, status=200)
+    return Response(list(customers.order_by(*CUSTOMER_ORDERINGS[ordering])), status=200)
 
 
 
@@ -137,9 +213,10 @@ def get_customers(request):
 
 
 
-# GET /customers/{customer}/ - Ottieni informazioni su un cliente specifico in base al nome - possibili risposte gestite 200/401/404 ✓
+# GET /customers/{customer}/ - Ottieni informazioni su un cliente specifico in base al nome - possibili risposte gestite 200/304/401/404 ✓
 @api_view(["GET"])
 @permission_classes([IsAuthenticated]) # Solo utenti autenticati possono accedere a queste funzionalità
+@conditional(customer_marker)
 def get_customer_by_name(request, customer):
 
     # Controlla se l'utente è autenticato e in caso contrario restituisci errore con codice 401 Unauthorized
@@ -148,40 +225,47 @@ def get_customer_by_name(request, customer):
             "error": "Invalid auth token"
         }, status=401)
 
+    # Progetti visibili all'utente (membership dei progetti, tutti per i superuser)
+    memberships = get_memberships(request)
+
     # Blocco try perche possiamo avere due casistiche, l'istanza corrispondente esiste oppure un errore sollevato da django
     try:
-        # Cerca il cliente con il nome fornito, se esiste verrà restituita istanza del cliente corrispondente, altrimenti django solleverà l'errore .DoesNotExist
-        customer_instance = Customer.objects.get(name=customer)
+        # Il documento del cliente viene costruito solo se non è già in cache per la versione corrente
+        def build():
+            # Cerca il cliente con il nome fornito, se esiste verrà restituita istanza del cliente corrispondente, altrimenti django solleverà l'errore .DoesNotExist
+            customer_instance = memberships.scope(Customer.objects, customer="id").get(name=customer)
         
-        # Crea una lista vuota per memorizzare i dati dei progetti relativi al cliente
-        projects_data = []
+            # Crea una lista vuota per memorizzare i dati dei progetti relativi al cliente
+            projects_data = []
 
-        # Recupero l'istanza del progetto del cliente corrispondente
-        projects = Project.objects.filter(customer=customer_instance)
+            # Recupero l'istanza del progetto del cliente corrispondente
+            projects = memberships.scope(Project.objects.filter(customer=customer_instance), project="id")
 
-        # Per ogni progetto associato all'istanza del cliente corrispondente 
-        for project in projects:
+            # Per ogni progetto associato all'istanza del cliente corrispondente 
+            for project in projects:
 
-            # Conta i deliverables associati al progetto            
-            # Crea il dizionario con informazioni relative al cliente
-            project_data = {
-                "name": project.name,
-                "uri": f"https://tars.tinga.io/space/api/v1/customer/{customer}/projects/{project.name}",
-                "number_of_deliverables": project.number_of_deliverables,
-            }
+                # Conta i deliverables associati al progetto            
+                # Crea il dizionario con informazioni relative al cliente
+                project_data = {
+                    "name": project.name,
+                    "uri": f"https://tars.tinga.io/space/api/v1/customer/{customer}/projects/{project.name}",
+                    "number_of_deliverables": project.number_of_deliverables,
+                }
 
-            # Aggiungi dizionario alla lista creata in precedenza
-            projects_data.append(project_data)
+                # Aggiungi dizionario alla lista creata in precedenza
+                projects_data.append(project_data)
         
-        # Prepara i dati del cliente con la lista dei progetti
-        customer_data = {
-            "name": customer_instance.name,
-            "id": customer_instance.id,
-            "projects": projects_data,
-        }
+            # Prepara i dati del cliente con la lista dei progetti
+            customer_data = {
+                "name": customer_instance.name,
+                "id": customer_instance.id,
+                "projects": projects_data,
+            }
         
+            return encode_json(customer_data).decode()
+
         # Restituisco i dati con codice 200 OK
-        return Response(customer_data, status=200)
+        return _cached_json(request, customer_key(customer), build, memberships.key)
     
     # Se non viene trovato un cliente con il nome specificato, gestisce l'eccezione e restituisce un errore con codice 404 Not Found
     except Customer.DoesNotExist:
@@ -197,9 +281,11 @@ def get_customer_by_name(request, customer):
 
 
 
-# GET /customers/{customer}/projects/{project}/ - Ottieni informazioni relative al progetto di un determinato customer - possibili risposte gestite 200/401/404 ✓
+# GET /customers/{customer}/projects/{project}/ - Ottieni informazioni relative al progetto di un determinato customer - possibili risposte gestite 200/304/400/401/404 ✓
+# Con ?fields= e ?include= si scelgono i campi dei deliverables restituiti (vedi space.serializers.select_fields)
 @api_view(["GET"])  
 @permission_classes([IsAuthenticated])  # Solo gli utenti autenticati possono accedere a questa funzionalità
+@conditional(project_marker)
 def get_project_details(request, customer_name, project_name):
 
     # Controlla se l'utente è autenticato e in caso contrario restituisci errore con codice 401 Unauthorized
@@ -208,83 +294,48 @@ def get_project_details(request, customer_name, project_name):
             "error": "Invalid auth token"  
         }, status=401)
 
+    # Campi dei deliverables richiesti e in caso di campi non validi restituisci errore con codice 400 Bad Request
+    try:
+        shape = select_fields(PROJECT_DELIVERABLE_FIELDS, request.query_params.get("fields"), request.query_params.get("include"))
+    except ValueError as e:
+        return Response({
+            "error": str(e)
+        }, status=400)
+
     # Recupera il progetto specifico del cliente filtrando sia il nome del cliente che quello del progetto, la funzione restituisce il primo risultato trovato (se condizioni soddisfatte) e in caso contrario None
-    project = Project.objects.filter(customer__name=customer_name, name=project_name).first()
+    project = Project.objects.filter(customer__name=customer_name, name=project_name).values("id", "name", "customer__name").first()
     
-    # Se il progetto non esiste, restituisci un errore con codice 404 Not Found
-    if project is None:
+    # Se il progetto non esiste o l'utente non ne fa parte, restituisci un errore con codice 404 Not Found
+    if project is None or not get_memberships(request).has_project(project["id"]):
         return Response(
             {"error": "Project not found"
         }, status=404)
 
-    # Recupera tutti i deliverables associati al progetto
-    deliverables = Deliverable.objects.filter(project=project)
+    # Risposta completa (senza fields/include): servita dalla cache dei documenti se ancora valida per l'indicatore di modifica
+    key = project_key(customer_name, project_name) if shape == PROJECT_DELIVERABLE_FIELDS else None
+    body = tree_cache.get(key, request.change_token) if key else None
+    if body is not None:
+        return _json_response(request, body)
+
+    # Recupera i documenti già pronti dei deliverables del progetto dal read model (un'unica lettura indicizzata), limitati alle chiavi necessarie per i campi richiesti
+    documents = read_documents(
+        DeliverableDocument.objects.filter(customer_name=customer_name, project_name=project_name).order_by("name"),
+        shape_keys(shape),
+    )
 
-    # Crea un dizionario con i dettagli del progetto da restituire nella risposta, inizialmente lista di deliverables vuota
+    # Crea un dizionario con i dettagli del progetto da restituire nella risposta
     project_details = {
-        "name": project.name,  
-        "customer": project.customer.name, 
-        "id": project.id,  
-        "deliverables": []  # Lista vuota che conterrà i dettagli dei deliverables del progetto
+        "name": project["name"],  
+        "customer": project["customer__name"], 
+        "id": project["id"],  
+        "deliverables": [shape_document(document, shape) for document in documents]
     }
 
-    # Per ogni deliverable presenti nei deliverables
-    for deliverable in deliverables:
-
-        # Prepara i dati di ogni deliverable
-        deliverable_data = {
-            "name": deliverable.name,  # Nome del deliverable
-            "uri": deliverable.repository,  # URL del repository del deliverable
-            "stages": {
-
-                # Dettagli sulla versione di produzione, con il relativo URI di download e configurazione
-                "production": {
-                    "current_published_version": deliverable.production_version,
-                    "last_published_at": deliverable.production_last_published_at,
-                    "download_uri": deliverable.production_download_uri,
-                    "current_configuration_uri": f"https://tars.iotinga.it/space/api/v1/customers/{customer_name}/projects/{project_name}/delivered/{deliverable.name}/configurations/production"
-                },
-                
-                # Dettagli sulla versione di staging
-                "staging": {
-                    "current_published_version": deliverable.staging_version,
-                    "last_published_at": deliverable.staging_last_published_at,
-                    "download_uri": deliverable.staging_download_uri,
-                    "current_configuration_uri": f"https://tars.iotinga.it/space/api/v1/customers/{customer_name}/projects/{project_name}/delivered/{deliverable.name}/configurations/staging"
-                },
-
-                # Dettagli sulla versione di delivery
-                "delivery": {
-                    "current_published_version": deliverable.delivery_version,
-                    "last_published_at": deliverable.delivery_last_published_at,
-                    "download_uri": deliverable.delivery_download_uri,
-                    "current_configuration_uri": f"https://tars.iotinga.it/space/api/v1/customers/{customer_name}/projects/{project_name}/delivered/{deliverable.name}/configurations/delivery"
-                }
-            },
-            
-            # Dettagli sull'evento dell'ultimo build
-            "last_build_event": {
-                "id": deliverable.last_build_event_id,  # ID dell'evento dell'ultimo build
-                "outcome": deliverable.last_build_outcome,  # Risultato dell'ultimo build (ad esempio "success", "failure")
-                "timestamp": deliverable.last_build_timestamp,  # Data e ora dell'ultimo build
-                "type": "build",  # Tipo di evento (presumibilmente sempre 'build')
-                "stage": deliverable.last_build_stage,  # Fase dell'ultimo build (es. "compiling", "testing")
-                "version": deliverable.last_build_version,  # Versione dell'ultimo build
-                "source_code_uri": deliverable.source_code_uri,  # URI del codice sorgente
-                "external_ref": deliverable.external_ref,  # Riferimento esterno (se presente)
-                "external_ref_uri": deliverable.external_ref_uri  # URI del riferimento esterno (se presente)
-            },
-            
-            # Sezione trascurabile perchè specificate in precedenza
-            "repository_uri": deliverable.repository,  # URI del repository del deliverable
-            "project": project_name,  # Nome del progetto a cui il deliverable appartiene
-            "customer": customer_name  # Nome del cliente a cui il progetto appartiene
-        }
-
-        # Aggiungi i dati del deliverable alla lista dei deliverables nel dizionario `project_details`
-        project_details["deliverables"].append(deliverable_data)
-
-    # Restituisci i dati con codice 200 OK
+    # Salva in cache la risposta completa e restituisci i dati con codice 200 OK
+    if key:
+        body = encode_json(project_details).decode()
+        tree_cache.set(key, request.change_token, body)
+        return _json_response(request, body)
     return Response(project_details, status=200)  
 
 
@@ -296,9 +347,11 @@ def get_project_details(request, customer_name, project_name):
 
 
 
-# GET /customers/{customer}/projects/{project}/deliverables/{deliverable}/ - Ottieni informazioni su un deliverable di un progetto di un customer - possibili risposte gestite 200/401/404 ✓
+# GET /customers/{customer}/projects/{project}/deliverables/{deliverable}/ - Ottieni informazioni su un deliverable di un progetto di un customer - possibili risposte gestite 200/304/400/401/404 ✓
+# Con ?fields= e ?include= si scelgono i campi restituiti (vedi space.serializers.select_fields)
 @api_view(["GET"])  
 @permission_classes([IsAuthenticated])  # Solo gli utenti autenticati possono accedere a questa funzionalità
+@conditional(deliverable_marker)
 def get_deliverable_details(request, customer_name, project_name, deliverable_name):
     
     # Controlla se l'utente è autenticato e in caso contrario restituisci errore con codice 401 Unauthorized
@@ -307,67 +360,43 @@ def get_deliverable_details(request, customer_name, project_name, deliverable_na
             "error": "Invalid auth token"  
         }, status=401)
     
-    # Trova il deliverable specifico filtrando per nome customer, nome progetto e nome deliverable, la funzione get_object_or_404 se non trova il deliverable corrispondente, solleva automaticamente un'eccezione di errore con codice 404 Not Found
-    deliverable = get_object_or_404(Deliverable, project__customer__name=customer_name,  project__name=project_name,  name=deliverable_name)
-    
-    # Costruisci la risposta, includendo tutti i dettagli del deliverable
-    deliverable_details = {
-        "name": deliverable.name,  # Nome del deliverable
-        "project": deliverable.project.name,  # Nome del progetto a cui appartiene il deliverable
-        "customer": deliverable.project.customer.name,  # Nome del cliente a cui appartiene il progetto
-        "id": str(deliverable.id),  # ID del deliverable convertito in stringa per evitare possibili problemi di serializzazione
-        "stages": {
-            
-            # Dettagli sullo stadio di produzione del deliverable
-            "production": {
-                "current_published_version": deliverable.production_version,  # Versione attualmente pubblicata in produzione
-                "last_published_at": deliverable.production_last_published_at,  # Data dell'ultima pubblicazione in produzione
-                "download_uri": deliverable.production_download_uri,  # URI per il download della versione di produzione
-                "current_configuration_uri": f"https://tars.iotinga.it/space/api/v1/customers/{customer_name}/projects/{project_name}/deliverables/{deliverable.name}/configurations/production"
-                # URI della configurazione di produzione
-            },
-            
-            # Dettagli sullo stadio di staging del deliverable
-            "staging": {
-                "current_published_version": deliverable.staging_version,  # Versione attualmente pubblicata in staging
-                "last_published_at": deliverable.staging_last_published_at,  # Data dell'ultima pubblicazione in staging
-                "download_uri": deliverable.staging_download_uri,  # URI per il download della versione di staging
-                "current_configuration_uri": f"https://tars.iotinga.it/space/api/v1/customers/{customer_name}/projects/{project_name}/deliverables/{deliverable.name}/configurations/staging"
-                # URI della configurazione di staging
-            },
-            
-            # Dettagli sullo stadio di delivery del deliverable
-            "delivery": {
-                "current_published_version": deliverable.delivery_version,  # Versione attualmente pubblicata in delivery
-                "last_published_at": deliverable.delivery_last_published_at,  # Data dell'ultima pubblicazione in delivery
-                "download_uri": deliverable.delivery_download_uri,  # URI per il download della versione di delivery
-                "current_configuration_uri": f"https://tars.iotinga.it/space/api/v1/customers/{customer_name}/projects/{project_name}/deliverables/{deliverable.name}/configurations/delivery"
-                # URI della configurazione di delivery
-            }
-        },
-        
-        # Un campo per indicare se il deliverable può essere pubblicato dalla UI (qui viene impostato sempre su True)
-        "can_publish_from_ui": True,  # Supponiamo che sia sempre True
-        "latest_build_events": [
-            {
-                "id": deliverable.last_build_event_id,  # ID dell'evento dell'ultimo build
-                "outcome": deliverable.last_build_outcome,  # Risultato dell'ultimo build (ad esempio "success", "failure")
-                "timestamp": deliverable.last_build_timestamp,  # Data e ora dell'ultimo build
-                "type": "build",  # Tipo di evento (presumibilmente sempre "build")
-                "stage": deliverable.last_build_stage,  # Fase dell'ultimo build (es. "compiling", "testing")
-                "version": deliverable.last_build_version,  # Versione dell'ultimo build
-                "source_code_uri": deliverable.source_code_uri,  # URI del codice sorgente
-                "external_ref": deliverable.external_ref,  # Riferimento esterno (se presente)
-                "external_ref_uri": deliverable.external_ref_uri  # URI del riferimento esterno (se presente)
-            }
-        ],
-        
-        # URI del repository del deliverable
-        "repository_uri": deliverable.repository  # URI del repository del deliverable
-    }
+    # Campi richiesti e in caso di campi non validi restituisci errore con codice 400 Bad Request
+    try:
+        shape = select_fields(DETAIL_FIELDS, request.query_params.get("fields"), request.query_params.get("include"))
+    except ValueError as e:
+        return Response({
+            "error": str(e)
+        }, status=400)
+
+    # Trova il documento del deliverable nel read model filtrando per nome customer, nome progetto e nome deliverable, se non esiste (o l'utente non fa parte del progetto) restituisci errore con codice 404 Not Found
+    # (per i superuser il controllo della membership non costa query, l'esistenza viene verificata leggendo il documento)
+    memberships = get_memberships(request)
+    documents = memberships.scope(
+        DeliverableDocument.objects.filter(customer_name=customer_name, project_name=project_name, name=deliverable_name),
+        project="project",
+    )
+    if not memberships.unrestricted and not documents.exists():
+        raise Http404("No Deliverable matches the given query.")
+
+    # Risposta completa (senza fields/include): servita dalla cache dei documenti se ancora valida per l'indicatore di modifica
+    key = deliverable_key(customer_name, project_name, deliverable_name) if shape == DETAIL_FIELDS else None
+    body = tree_cache.get(key, request.change_token) if key else None
+    if body is not None:
+        return _json_response(request, body)
+
+    document = next(read_documents(documents[:1], shape_keys(shape)), None)
+    if document is None:
+        raise Http404("No Deliverable matches the given query.")
     
-    # Restituisci i dati con codice 200 OK
-    return Response(deliverable_details, status=200)
+    # Salva in cache la risposta completa e restituisci i dati con codice 200 OK
+    if key:
+        body = encode_json(shape_document(document, shape)).decode()
+        tree_cache.set(key, request.change_token, body)
+        return _json_response(request, body)
+    return Response(shape_document(document, shape), status=200)
+
+
+
 
 
 
@@ -375,12 +404,52 @@ def get_deliverable_details(request, customer_name, project_name, deliverable_na
 
 
 
+def _deliverable_filters(params):
+    """
+    Traduce i parametri di GET /deliverables/ in un filtro sui documenti del read model.
 
+    Ogni filtro è servito da un indice: customer e project dal prefisso di space_document_path_unique,
+    stage/status/configuration dall'indice GIN su stage_status, le versioni dagli indici sulle colonne *_version.
+    Solleva ValueError se la combinazione di parametri non è valida.
+    """
+    filters = Q()
 
+    if params.get("customer"):
+        filters &= Q(customer_name=params["customer"])
+    if params.get("project"):
+        filters &= Q(project_name=params["project"])
 
-# GET /deliverables/ - Ottieni tutti i deliverables con informazioni associate - possibili risposte gestite 200/401/404 ✓
+    stage = params.get("stage")
+    status = params.get("status")
+    configuration = params.get("configuration")
+    if stage is not None and stage not in STAGES:
+        raise ValueError(f"Invalid stage, expected one of: {', '.join(STAGES)}")
+    if (status or configuration) and not stage:
+        raise ValueError("The status and configuration filters require a stage")
+
+    # Contenimento jsonb (@>): usa l'indice GIN registry_deliv_stage_gin
+    if status:
+        filters &= Q(deliverable__stage_status__contains={stage: status})
+    if configuration:
+        filters &= Q(deliverable__stage_status__contains={"configuration": {stage: configuration}})
+    if stage and not status and not configuration:
+        filters &= Q(deliverable__stage_status__has_key=stage)
+
+    for param, field in VERSION_FILTERS.items():
+        if params.get(param):
+            filters &= Q(**{field: params[param]})
+
+    return filters
+
+
+# GET /deliverables/ - Ottieni tutti i deliverables con informazioni associate - possibili risposte gestite 200/304/400/401/404 ✓
+# Filtri opzionali: customer, project, stage, status, configuration, production_version, staging_version, delivery_version
+# Con ?fields= si scelgono i campi restituiti (vedi space.serializers.select_fields)
+# Con ?format=ndjson (o Accept: application/x-ndjson) la risposta è in streaming, un deliverable per riga; con ?stream=true viene restituito un array JSON in streaming
 @api_view(["GET"]) 
 @permission_classes([IsAuthenticated])  # Solo gli utenti autenticati possono accedere a questa funzionalità
+@renderer_classes([JSONRenderer, BrowsableAPIRenderer, NDJSONRenderer])
+@conditional(deliverables_marker)
 def get_all_deliverables(request):
     
     # Controlla se l'utente è autenticato e in caso contrario restituisci errore con codice 401 Unauthorized
@@ -389,82 +458,57 @@ def get_all_deliverables(request):
             "error": "Invalid auth token"  
         }, status=401)
 
-    # Recupera tutti i deliverables senza alcun filtro
-    deliverables = Deliverable.objects.all()
+    # Costruisce i filtri e i campi richiesti e in caso di parametri non validi restituisci errore con codice 400 Bad Request
+    try:
+        filters = _deliverable_filters(request.query_params)
+        shape = select_fields(DOCUMENT_FIELDS, request.query_params.get("fields"), request.query_params.get("include"))
+    except ValueError as e:
+        return Response({
+            "error": str(e)
+        }, status=400)
+
+    # Recupera i documenti già pronti dei deliverables dal read model, nell'ordine dell'indice space_document_path_unique
+    # Solo i deliverables dei progetti visibili all'utente (membership dei progetti, tutti per i superuser)
+    memberships = get_memberships(request)
+    documents = memberships.scope(DeliverableDocument.objects.filter(filters), project="project").order_by("customer_name", "project_name", "name")
 
-    # Se non ci sono deliverables, restituisci un errore 404 Not Found
-    if not deliverables:
+    # Se non ci sono deliverables, restituisci un errore 404 Not Found (con un filtro, nessun risultato non è un errore: lista vuota)
+    if not documents.exists():
+        if filters:
+            return Response([], status=200)
         return Response({
             "error": "No deliverables found"
         }, status=404)
 
-    # Costruisce la lista di deliverables da restituire
-    deliverable_list = []
-    
-    # Per ogni deliverable presente
-    for deliverable in deliverables:
-        # Prepara i dati del deliverable in un dizionario
-        deliverable_data = {
-            "name": deliverable.name,  # Nome del deliverable
-            "project": deliverable.project.name,  # Nome del progetto associato
-            "customer": deliverable.project.customer.name,  # Nome del cliente associato al progetto
-            "id": str(deliverable.id),  # ID del deliverable (convertito in stringa per evitare problemi di serializzazione)
-            "stages": {  
-                
-                # Dettagli sullo stadio di produzione
-                "production": {
-                    "status": deliverable.stage_status["production"],
-                    "current_published_version": deliverable.production_version,  # Versione attuale in produzione
-                    "last_published_at": deliverable.production_last_published_at,  # Data dell'ultima pubblicazione in produzione
-                    "download_uri": deliverable.production_download_uri,  # URI per il download della versione di produzione
-                    "current_configuration_uri": f"https://tars.iotinga.it/space/api/v1/customers/{deliverable.project.customer.name}/projects/{deliverable.project.name}/deliverables/{deliverable.name}/configurations/production"
-                },
-                
-                # Dettagli sullo stadio di staging
-                "staging": {
-                    "status": deliverable.stage_status["staging"],
-                    "current_published_version": deliverable.staging_version,  # Versione attuale in staging
-                    "last_published_at": deliverable.staging_last_published_at,  # Data dell'ultima pubblicazione in staging
-                    "download_uri": deliverable.staging_download_uri,  # URI per il download della versione di staging
-                    "current_configuration_uri": f"https://tars.iotinga.it/space/api/v1/customers/{deliverable.project.customer.name}/projects/{deliverable.project.name}/deliverables/{deliverable.name}/configurations/staging"
-                },
-                
-                # Dettagli sullo stadio di delivery
-                "delivery": {
-                    "status": deliverable.stage_status["delivery"],
-                    "current_published_version": deliverable.delivery_version,  # Versione attuale in delivery
-                    "last_published_at": deliverable.delivery_last_published_at,  # Data dell'ultima pubblicazione in delivery
-                    "download_uri": deliverable.delivery_download_uri,  # URI per il download della versione di delivery
-                    "current_configuration_uri": f"https://tars.iotinga.it/space/api/v1/customers/{deliverable.project.customer.name}/projects/{deliverable.project.name}/deliverables/{deliverable.name}/configurations/delivery"
-                }
-            },
-            
-            "can_publish_from_ui": True,  # Indica se il deliverable può essere pubblicato dalla UI, qui sempre impostato su True
-            "latest_build_events": [  # Dettagli sull'ultimo evento di build relativo al deliverable
-                {
-                    "id": deliverable.last_build_event_id,  # ID dell'ultimo evento di build
-                    "outcome": deliverable.last_build_outcome,  # Esito dell'ultimo build (successo, fallimento, etc.)
-                    "timestamp": deliverable.last_build_timestamp,  # Timestamp dell'ultimo evento di build
-                    "type": "build",  # Tipo di evento (presumibilmente sempre di tipo "build")
-                    "stage": deliverable.last_build_stage,  # Fase dell'ultimo build (es. "compiling", "testing")
-                    "version": deliverable.last_build_version,  # Versione dell'ultimo build
-                    "source_code_uri": deliverable.source_code_uri,  # URI del codice sorgente
-                    "external_ref": deliverable.external_ref,  # Riferimento esterno (se presente)
-                    "external_ref_uri": deliverable.external_ref_uri  # URI del riferimento esterno (se presente)
-                }
-            ],
-
-            "repository_uri": deliverable.repository  # URI del repository del deliverable
-        }
+    # Documenti completi: i corpi già codificati vengono restituiti così come sono, altrimenti si leggono solo le chiavi dei campi richiesti
+    full = shape == DOCUMENT_FIELDS
+
+    # Modalità streaming: i documenti vengono letti con un cursore lato server e inviati uno alla volta, la memoria resta costante
+    streaming = request.accepted_renderer.format == NDJSONRenderer.format or request.query_params.get("stream") in ("1", "true")
+    if streaming:
+        if full:
+            rows = documents.values_list("body", flat=True).iterator(chunk_size=STREAM_CHUNK_SIZE)
+        else:
+            rows = (
+                encode_json(shape_document(document, shape)).decode()
+                for document in read_documents(documents, shape_keys(shape), chunk_size=STREAM_CHUNK_SIZE)
+            )
+
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return StreamingHttpResponse(stream_ndjson(rows), content_type=NDJSONRenderer.media_type)
+        return StreamingHttpResponse(stream_json_array(rows), content_type="application/json")
+
+    # Documenti completi: l'array viene composto dai corpi già codificati, senza decodificarli e ricodificarli, e senza filtri viene servito dalla cache
+    if full:
+        def build():
+            return encode_array(documents.values_list("body", flat=True))
+
+        if filters:
+            return _json_response(request, build())
+        return _cached_json(request, DELIVERABLES_KEY, build, memberships.key)
 
-        # Recupero la configurazione per il deliverable (se disponibile)
-        configuration = deliverable.stage_status.get("configuration", {})
-        
-        # Aggiungo la configurazione alla risposta, se presente
-        deliverable_data["configuration"] = configuration
-
-        # Aggiunge i dati del deliverable alla lista
-        deliverable_list.append(deliverable_data)
+    # Costruisce la lista di deliverables da restituire
+    deliverable_list = [shape_document(document, shape) for document in read_documents(documents, shape_keys(shape))]
 
     # Restituisci i dati con codice 200 OK
     return Response(deliverable_list, status=200)
@@ -478,9 +522,10 @@ def get_all_deliverables(request):
 
 
 
-# GET,POST,DELETE /customers/{customer}/projects/{project}/deliverables/{deliverable}/configurations/{stage}/ - Ottieni/Modifica/Elimina lo stato di uno stage di un deliverable (nel dizionario configuration) - possibili risposte gestite 200/401/404/400 ✓
+# GET,POST,DELETE /customers/{customer}/projects/{project}/deliverables/{deliverable}/configurations/{stage}/ - Ottieni/Modifica/Elimina lo stato di uno stage di un deliverable (nel dizionario configuration) - possibili risposte gestite 200/304/401/404/400 ✓
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])  # Solo gli utenti autenticati possono accedere a questa funzionalità
+@conditional(configuration_marker)
 def stage_status(request, customer, project, deliverable, stage):
 
     # Controlla se l'utente è autenticato e in caso contrario restituisci errore con codice 401 Unauthorized
@@ -490,7 +535,7 @@ def stage_status(request, customer, project, deliverable, stage):
         }, status=401)
     
     # Ottieni il deliverable filtrando in base al nome deliverable, nome progetto, nome customer e in caso non ci fosse restituisco errore con codice 404 Not Found
-    deliverable_instance = get_object_or_404(Deliverable, name=deliverable, project__name=project, project__customer__name=customer)
+    deliverable_instance = get_object_or_404(get_memberships(request).scope(Deliverable.objects, project="project"), name=deliverable, project__name=project, project__customer__name=customer)
     
     # Recupero configurazioni dal dizionario stage_status
     configuration = deliverable_instance.stage_status.get("configuration")
@@ -598,9 +643,10 @@ def stage_status(request, customer, project, deliverable, stage):
 ## TESTING ##
 
 # Da controllare la logica degli events, cosa sono e cosa si deve visualizzare a schermo?
-# GET /customers/{customer}/projects/{project}/deliverables/{deliverable}/events/ - Ottieni gli eventi di un deliverable - possibili risposte gestite 200/401/404
+# GET /customers/{customer}/projects/{project}/deliverables/{deliverable}/events/ - Ottieni gli eventi di un deliverable - possibili risposte gestite 200/304/401/404
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])# Solo gli utenti autenticati possono accedere a questa funzionalità
+@conditional(events_marker)
 def get_deliverable_events(request, customer, project, deliverable):
 
     # Controlla se l'utente è autenticato e in caso contrario restituisci errore con codice 401 Unauthorized
@@ -614,42 +660,65 @@ def get_deliverable_events(request, customer, project, deliverable):
     to_time = request.query_params.get('to', None)
     limit = request.query_params.get('limit', None)
     offset = request.query_params.get('offset', None)
+    # Se presente (anche vuoto, per la prima pagina) attiva la paginazione a cursore su (timestamp, id)
+    cursor = request.query_params.get('cursor', None)
 
-    # Impostare i valori di default
-    limit = int(limit) if limit else 50  # Limite di eventi da restituire (default 50)
-    offset = int(offset) if offset else 0  # Offset per saltare gli eventi (default 0)
+    # Impostare i valori di default e in caso di parametri non validi restituisci errore con codice 400 Bad Request
+    try:
+        limit = int(limit) if limit else EVENTS_LIMIT  # Limite di eventi da restituire (default 50)
+        offset = int(offset) if offset else 0  # Offset per saltare gli eventi (default 0)
+    except ValueError:
+        return Response({"detail": "limit and offset must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= limit <= MAX_EVENTS_LIMIT:
+        return Response({"detail": f"limit must be between 1 and {MAX_EVENTS_LIMIT}"}, status=status.HTTP_400_BAD_REQUEST)
+    if offset < 0:
+        return Response({"detail": "offset must not be negative"}, status=status.HTTP_400_BAD_REQUEST)
 
     # Converti "from" e "to" in oggetti datetime, se sono presenti
-    from_datetime = datetime.fromisoformat(from_time) if from_time else None
-    to_datetime = datetime.fromisoformat(to_time) if to_time else None
+    try:
+        from_datetime = datetime.fromisoformat(from_time) if from_time else None
+        to_datetime = datetime.fromisoformat(to_time) if to_time else None
+    except ValueError:
+        return Response({"detail": "Invalid date, use ISO 8601"}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
         # Ottieni il deliverable
-        deliverable_obj = Deliverable.objects.get(name=deliverable, project__name=project, project__customer__name=customer)
+        deliverable_obj = get_memberships(request).scope(Deliverable.objects, project="project").get(name=deliverable, project__name=project, project__customer__name=customer)
 
-        # Filtra gli eventi in base ai parametri forniti
-        events_query = Event.objects.filter(deliverable=deliverable_obj)
+        # Filtra gli eventi in base ai parametri forniti, dal più recente al meno recente (ordine servito dall'indice registry_event_deliv_ts_idx)
+        events_query = Event.objects.filter(deliverable=deliverable_obj).order_by("-timestamp", "-id")
 
         if from_datetime:
             events_query = events_query.filter(timestamp__gte=from_datetime)
         if to_datetime:
             events_query = events_query.filter(timestamp__lte=to_datetime)
 
+        # Paginazione a cursore: riparte dall'ultimo (timestamp, id) restituito, il costo non dipende dalla profondità della pagina
+        if cursor is not None:
+            if cursor:
+                try:
+                    cursor_timestamp, cursor_id = decode_event_cursor(cursor)
+                except ValueError:
+                    return Response({"detail": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+                events_query = events_before(events_query, cursor_timestamp, cursor_id)
+
+            # Leggi un elemento in più per sapere se esiste una pagina successiva
+            page = list(events_query[:limit + 1])
+            next_url = None
+            if len(page) > limit:
+                page = page[:limit]
+                next_url = event_page_url(request, encode_event_cursor(page[-1].timestamp, page[-1].id))
+
+            return Response({
+                "next": next_url,
+                "results": [serialize_event(event) for event in page],
+            }, status=status.HTTP_200_OK)
+
         # Paginazione
         events_query = events_query[offset:offset+limit]
 
         # Serializzazione degli eventi
-        events = [{
-            "id": event.id,
-            "outcome": event.outcome,
-            "timestamp": event.timestamp.isoformat(),
-            "type": event.type,
-            "stage": event.stage,
-            "version": event.version,
-            "source_code_uri": event.source_code_uri,
-            "external_ref": event.external_ref,
-            "external_ref_uri": event.external_ref_uri
-        } for event in events_query]
+        events = [serialize_event(event) for event in events_query]
 
         # Risposta 200 con gli eventi
         return Response(events, status=status.HTTP_200_OK)
@@ -658,6 +727,90 @@ def get_deliverable_events(request, customer, project, deliverable):
         return Response({"detail": "Deliverable not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
+# GET /customers/{customer}/projects/{project}/deliverables/{deliverable}/stats/ - Statistiche degli eventi di un deliverable per periodo - possibili risposte gestite 200/400/401/404
+# Le statistiche sono lette dai conteggi giornalieri (space.stats), il costo non dipende dal numero di eventi
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])  # Solo gli utenti autenticati possono accedere a questa funzionalità
+def get_deliverable_stats(request, customer, project, deliverable):
+
+    # Recupera i parametri di query: periodo (day, week, month, year), intervallo di giorni e filtri
+    bucket = request.query_params.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return Response({"detail": f"Invalid bucket, use one of {', '.join(BUCKETS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        since = date.fromisoformat(request.query_params['from']) if request.query_params.get('from') else None
+        until = date.fromisoformat(request.query_params['to']) if request.query_params.get('to') else None
+    except ValueError:
+        return Response({"detail": "Invalid date, use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        # Ottieni il deliverable
+        deliverable_obj = get_memberships(request).scope(Deliverable.objects, project="project").get(name=deliverable, project__name=project, project__customer__name=customer)
+    except Deliverable.DoesNotExist:
+        return Response({"detail": "Deliverable not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    stats = bucket_stats(
+        deliverable_obj,
+        bucket,
+        since,
+        until,
+        stage=request.query_params.get('stage') or None,
+        type=request.query_params.get('type') or None,
+    )
+
+    # Risposta 200 con le statistiche, dal periodo meno recente
+    return Response({"bucket": bucket, "results": stats}, status=status.HTTP_200_OK)
+
+
+# POST /events/ - Registra in blocco gli eventi di più deliverables (es. dalle pipeline di CI) - possibili risposte gestite 200/400/401
+# Il body è una lista di eventi (o un oggetto con la chiave "events"), ogni evento indica il deliverable con customer, project e deliverable
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])  # Solo gli utenti autenticati possono accedere a questa funzionalità
+def ingest_deliverable_events(request):
+
+    # Controlla se l'utente è autenticato e in caso contrario restituisci errore con codice 401 Unauthorized
+    if not request.user.is_authenticated:
+        return Response({
+            "error": "Invalid auth token"
+        }, status=401)
+
+    # Accetta sia una lista di eventi sia un oggetto {"events": [...]}
+    data = request.data.get("events") if isinstance(request.data, dict) else request.data
+
+    # Se il body non contiene una lista di eventi o ne contiene troppi, restituisci errore con codice 400 Bad Request
+    if not isinstance(data, list):
+        return Response({
+            "error": "A list of events is required in the request body."
+        }, status=400)
+    if len(data) > MAX_INGEST_EVENTS:
+        return Response({
+            "error": f"At most {MAX_INGEST_EVENTS} events can be sent in a request."
+        }, status=400)
+
+    # Valida tutti gli eventi, in caso di errori restituisci il dettaglio per ogni evento con codice 400 Bad Request
+    serializer = EventInputSerializer(data=data, many=True)
+    if not serializer.is_valid():
+        return Response({
+            "error": "Invalid events",
+            "events": serializer.errors
+        }, status=400)
+
+    # Inserisce gli eventi e aggiorna i campi last_build_* dei deliverables coinvolti con un numero costante di query
+    summary = ingest_events(serializer.validated_data, get_memberships(request).scope(Deliverable.objects, project="project"))
+
+    # Restituisci il riepilogo con codice 200 OK
+    return Response(summary, status=200)
+
+
+# GET /cache/ - Statistiche della cache dei documenti space (hit, miss, invalidazioni) del processo che risponde - possibili risposte gestite 200/401/403
+@api_view(['GET'])
+@permission_classes([IsAdminUser])  # Solo gli amministratori possono accedere a questa funzionalità
+def cache_stats(request):
+
+    # Restituisci i contatori con codice 200 OK
+    return Response(tree_cache.stats(), status=200)
+
+
 # Rende solamente uno stato di uno stage in configuration uguale a published ma effettivamente non pubblica niente 
 # POST /customers/{customer}/projects/{project}/deliverables/{deliverable}/publish/ - Rende lo stato di un deliverable uguale a published - possibili risposte gestite 200/401/404
 @api_view(['POST'])
@@ -685,7 +838,7 @@ def publish_deliverable(request, customer, project, deliverable):
         }, status=400)
 
     # Ottieni il deliverable in base al nome del deliverable, del progetto e del cliente
-    deliverable_instance = get_object_or_404(Deliverable, name=deliverable, project__name=project, project__customer__name=customer)
+    deliverable_instance = get_object_or_404(get_memberships(request).scope(Deliverable.objects, project="project"), name=deliverable, project__name=project, project__customer__name=customer)
 
     # Recupero configurazioni dal dizionario stage_status
     configuration = deliverable_instance.stage_status.get("configuration")
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection, transaction
+
+log = logging.getLogger(__name__)
+
+# Optional PostgreSQL NOTIFY channel: messages published by any process reach the subscribers of every process
+NOTIFY_CHANNEL = getattr(settings, "BROADCAST_NOTIFY_CHANNEL", None)
+
+# NOTIFY payloads are limited to 8000 bytes: longer messages are sent in parts of at most this many bytes
+NOTIFY_PART_SIZE = 7000
+
+
+@dataclass(frozen=True)
+class Message:
+    id: int
+    channel: str
+    event: str
+    data: str
+
+    def encode(self) -> bytes:
+        """Message in the text/event-stream format."""
+        lines = [f"id: {self.id}", f"event: {self.event}"]
+        lines += [f"data: {line}" for line in self.data.splitlines() or [""]]
+        return ("\n".join(lines) + "\n\n").encode()
+
+
+class Subscription:
+    def __init__(self, broadcaster, channel, replay):
+        self.broadcaster = broadcaster
+        self.channel = channel
+        self.replay = replay
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def put(self, message: Message):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+    async def get(self) -> Message:
+        return await self.queue.get()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broadcaster.unsubscribe(self)
+
+
+class Broadcaster:
+    """
+    Publish/subscribe hub of the process for the live streams (space events, registry context watch).
+
+    publish_many_on_commit() reaches the hubs of the other processes through
+    PostgreSQL NOTIFY when BROADCAST_NOTIFY_CHANNEL is set; without it (in
+    development and tests) only the subscribers of this process get the messages.
+
+    Messages get increasing ids (microseconds since the epoch, so they remain
+    meaningful as Last-Event-ID across restarts and processes) and the latest
+    `history` ones of every channel are kept to let reconnecting clients
+    resume without losing messages. Each channel has its own history, so a
+    busy channel does not evict the messages of the others. Histories are
+    kept only for the channels with subscribers, and for `keep` seconds
+    after the last one leaves so that it can reconnect.
+    """
+
+    def __init__(self, history: int = 100, keep: float = 60):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._history_size = history
+        self._keep = keep
+        self._history = {}
+        # {channel: time.monotonic() when its last subscriber left}, oldest first
+        self._idle = {}
+        self._last_id = time.time_ns() // 1000
+        # messages up to these ids may have been missed: published before start (of any channel) or before the
+        # history of the channel, dropped from it or received out of order
+        self._start = self._last_id
+        self._horizons = {}
+
+    def next_id(self) -> int:
+        with self._lock:
+            return self._next_id()
+
+    def _next_id(self) -> int:
+        self._last_id = max(self._last_id + 1, time.time_ns() // 1000)
+        return self._last_id
+
+    def restart(self):
+        """The messages published so far may have been missed (the NOTIFY listener reconnected): clients resuming from them reload."""
+        with self._lock:
+            self._start = self._next_id()
+
+    def publish(self, channel: str, event: str, data: str, id: int | None = None) -> Message:
+        """Deliver a message to the subscribers of the channel, `id` is given for the messages of other processes."""
+        with self._lock:
+            if id is None:
+                id = self._next_id()
+            else:
+                self._last_id = max(self._last_id, id)
+            message = Message(id, channel, event, data)
+            history = self._history.get(channel)
+            if history is not None:
+                if history and id < history[-1].id:
+                    # committed after a later message: the clients that saw that one have missed this one
+                    self._horizons[channel] = max(self._horizons[channel], history[-1].id + 1)
+                if len(history) == history.maxlen:
+                    self._horizons[channel] = max(self._horizons[channel], history[0].id)
+                history.append(message)
+            subscribers = list(self._subscribers.get(channel, ()))
+
+        for subscription in subscribers:
+            try:
+                subscription.put(message)
+            except RuntimeError:
+                # the event loop of the subscriber has been closed
+                self.unsubscribe(subscription)
+        return message
+
+    def subscribe(self, channel: str, last_event_id: int | None = None) -> Subscription:
+        """
+        Subscribe to a channel from the running event loop.
+
+        If last_event_id is given, subscription.replay holds the retained
+        messages published after it, or None if the history does not go back
+        that far and the caller has to recover the missed state by itself.
+        """
+        with self._lock:
+            self._drop_idle()
+            history = self._history.get(channel)
+            replay = []
+            if last_event_id is not None:
+                if history is None:
+                    # nothing kept: only a client up to date with every channel misses nothing
+                    replay = [] if last_event_id >= self._last_id else None
+                elif last_event_id < max(self._start, self._horizons[channel]):
+                    replay = None
+                else:
+                    replay = [m for m in history if m.id > last_event_id]
+            if history is None:
+                self._history[channel] = deque(maxlen=self._history_size)
+                self._horizons[channel] = self._last_id
+            self._idle.pop(channel, None)
+
+            subscription = Subscription(self, channel, replay)
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers and self._subscribers.pop(subscription.channel, None) is not None:
+                self._idle[subscription.channel] = time.monotonic()
+            self._drop_idle()
+
+    def _drop_idle(self):
+        expired = time.monotonic() - self._keep
+        while self._idle:
+            channel, since = next(iter(self._idle.items()))
+            if since > expired:
+                break
+            del self._idle[channel], self._history[channel], self._horizons[channel]
+
+
+broadcaster = Broadcaster()
+
+
+def publish_on_commit(channel: str, event: str, data: str):
+    """Publish the message once the current transaction (if any) is committed."""
+    publish_many_on_commit([(channel, event, data)])
+
+
+def publish_many_on_commit(messages):
+    """
+    Publish the (channel, event, data) messages once the current transaction (if any) is committed.
+
+    With BROADCAST_NOTIFY_CHANNEL they are sent with a single pg_notify()
+    statement, delivered by PostgreSQL at commit to the listener of every
+    process (this one included), otherwise to the subscribers of this process.
+    """
+    messages = list(messages)
+    if not messages:
+        return
+    if not NOTIFY_CHANNEL:
+        transaction.on_commit(lambda: [broadcaster.publish(*message) for message in messages])
+        return
+    payloads = [
+        payload for channel, event, data in messages
+        for payload in notify_payloads(Message(broadcaster.next_id(), channel, event, data))
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload", [NOTIFY_CHANNEL, payloads])
+
+
+def notify_payloads(message: Message) -> list[str]:
+    """
+    The NOTIFY payloads of a message: a JSON header line [id, channel, event, part, parts] followed by a part of the data.
+
+    The data is split on UTF-8 character boundaries so that every part
+    fits in NOTIFY_PART_SIZE bytes.
+    """
+    data = message.data.encode()
+    parts, start = [], 0
+    while True:
+        end = min(start + NOTIFY_PART_SIZE, len(data))
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            # a continuation byte: the character starts before
+            end -= 1
+        parts.append(data[start:end].decode())
+        if end >= len(data):
+            break
+        start = end
+    return [
+        json.dumps([message.id, message.channel, message.event, index, len(parts)]) + "\n" + part
+        for index, part in enumerate(parts)
+    ]
+
+
+class NotifyReceiver:
+    """Rebuilds the messages from the NOTIFY payloads of notify_payloads(), received in order."""
+
+    def __init__(self):
+        self._parts = {}
+
+    def receive(self, payload: str) -> Message | None:
+        """The message completed by the payload, None while parts are missing."""
+        header, part = payload.split("\n", 1)
+        id, channel, event, index, count = json.loads(header)
+        if count == 1:
+            return Message(id, channel, event, part)
+        parts = self._parts.setdefault(id, [])
+        if index != len(parts):
+            # a part was lost (the listener reconnected): the message cannot be rebuilt
+            self._parts.pop(id)
+            return None
+        parts.append(part)
+        if len(parts) < count:
+            return None
+        return Message(id, channel, event, "".join(self._parts.pop(id)))
+
+
+def _listen():
+    # one connection per process, LISTENing for the messages published by all of them
+    from psycopg import connect, sql
+
+    while True:
+        try:
+            with connect(**connection.get_connection_params(), autocommit=True) as listener:
+                listener.execute(sql.SQL("LISTEN {}").format(sql.Identifier(NOTIFY_CHANNEL)))
+                # the messages published before (or while the listener was down) were not received
+                broadcaster.restart()
+                receiver = NotifyReceiver()
+                for notify in listener.notifies():
+                    message = receiver.receive(notify.payload)
+                    if message is not None:
+                        broadcaster.publish(message.channel, message.event, message.data, message.id)
+        except Exception:
+            log.exception("Broadcast notification listener failed, reconnecting")
+            time.sleep(5)
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def start_listener():
+    """Start the NOTIFY listener thread of the process, if BROADCAST_NOTIFY_CHANNEL is set (idempotent)."""
+    global _listener
+    if not NOTIFY_CHANNEL:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name="broadcast-notify", daemon=True)
+            _listener.start()
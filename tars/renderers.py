@@ -0,0 +1,48 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renderer per risposte newline-delimited JSON (un oggetto per riga).
+
+    Serve soprattutto a rendere selezionabile il formato con `?format=ndjson`
+    o con l'header `Accept: application/x-ndjson`: le viste che lo supportano
+    restituiscono direttamente una risposta in streaming.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, list):
+            data = [data]
+        return b"".join(encode_line(item) for item in data)
+
+
+def encode_json(data):
+    """Codifica un oggetto JSON con lo stesso encoder usato da JSONRenderer."""
+    return JSONRenderer().render(data)
+
+
+def encode_line(data):
+    """Codifica un oggetto JSON come una riga NDJSON."""
+    return encode_json(data) + b"\n"
+
+
+def stream_ndjson(bodies):
+    """Genera una riga NDJSON per ogni oggetto già codificato, man mano che viene letto."""
+    for body in bodies:
+        yield body.encode() + b"\n"
+
+
+def stream_json_array(bodies):
+    """Genera a blocchi un array JSON a partire da oggetti già codificati."""
+    yield b"["
+    separator = b""
+    for body in bodies:
+        yield separator + body.encode()
+        separator = b","
+    yield b"]"
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+from datetime import timedelta
 from pathlib import Path
 from rest_framework.permissions import DjangoModelPermissions
 
@@ -51,6 +53,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework.authtoken",
     "guardian",
@@ -111,6 +114,35 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # in-process LRU tier of the space documents cache (space.cache)
+    "space": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "space",
+        "TIMEOUT": 3600,
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+}
+
+# optional tier shared by all the workers, e.g. SPACE_CACHE_URL=redis://127.0.0.1:6379/1 (requires the redis package)
+if os.environ.get("SPACE_CACHE_URL"):
+    CACHES["space_shared"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["SPACE_CACHE_URL"],
+        "TIMEOUT": 3600,
+    }
+
+# memberships of the users (authentication.functions.membership) reused across requests only with a cache shared by
+# all the workers, a revocation must reach every one of them
+if "space_shared" in CACHES:
+    MEMBERSHIP_CACHE = "space_shared"
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -159,7 +191,7 @@ class DefaultAuthPermission(DjangoModelPermissions):
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.BasicAuthentication",
+        "authentication.backends.CachedBasicAuthentication",
         "rest_framework.authentication.SessionAuthentication",
         "rest_framework.authentication.TokenAuthentication",
         "rest_framework_simplejwt.authentication.JWTAuthentication",
@@ -167,11 +199,34 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "tars.settings.DefaultAuthPermission",
         "rest_framework.permissions.IsAuthenticated",
-        'rest_framework.authentication.SessionAuthentication',
     ],
-    # too small application, don't need to paginate :)
-    #"DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
-    #"PAGE_SIZE": 100,
+    # the registry endpoints paginate on request (?limit= / ?cursor=), see registry.pagination
+}
+
+# with a channel name (e.g. CONTEXT_NOTIFY_CHANNEL=registry_context) the Context writes are announced with
+# PostgreSQL NOTIFY and wake the /registry/context/watch/ requests of every worker, not only of the writing one
+CONTEXT_NOTIFY_CHANNEL = os.environ.get("CONTEXT_NOTIFY_CHANNEL") or None
+
+# likewise with BROADCAST_NOTIFY_CHANNEL (e.g. tars_broadcast) the messages of the space live streams reach the
+# clients connected to every worker (tars.broadcast), otherwise only the ones of the worker writing the events
+BROADCAST_NOTIFY_CHANNEL = os.environ.get("BROADCAST_NOTIFY_CHANNEL") or None
+
+# registry_event monthly partitions: created this many months ahead, kept this many months by events_retention
+EVENT_PARTITIONS_AHEAD = 3
+EVENT_RETENTION_MONTHS = 24
+
+# days of Context changes kept by context_retention: the watchers behind them get 410 and reload the keys
+CONTEXT_CHANGE_RETENTION_DAYS = 7
+
+# build events listed in the latest_build_events of the space deliverables (space.builds)
+SPACE_LATEST_BUILD_EVENTS = 5
+
+# successful Basic auth verifications are reused for this many seconds (authentication.backends)
+BASIC_AUTH_CACHE_TIMEOUT = 300
+
+# tokens returned by /authentication/token/access/ in exchange for Basic credentials
+SIMPLE_JWT = {
+    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
 }
 
 EMAIL_HOST = "localhost"
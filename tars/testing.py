@@ -0,0 +1,81 @@
+"""
+Test helpers shared by the tars apps.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# JSON lines file the query counts and timings of the measured calls are appended to, e.g.
+# QUERY_BUDGET_REPORT=/tmp/budget.jsonl ./manage.py test
+REPORT = os.environ.get("QUERY_BUDGET_REPORT")
+
+
+def record(test, label, rows, queries, seconds):
+    """Append a measure to the QUERY_BUDGET_REPORT file, if set."""
+    if not REPORT:
+        return
+    with open(REPORT, "a") as report:
+        report.write(json.dumps({"test": test, "label": label, "rows": rows, "queries": queries, "ms": round(seconds * 1000, 3)}) + "\n")
+
+
+class QueryBudgetMixin:
+    """
+    Assertions on the number of SQL queries run by an endpoint, for TestCase subclasses.
+
+    assertQueriesConstant() fails when the number of queries grows with the
+    number of rows returned (the N+1 pattern of lazily loaded relations).
+    Every measured call is timed and recorded (see QUERY_BUDGET_REPORT).
+    """
+
+    def count_queries(self, function, label=None, rows=None):
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            result = function()
+        record(self.id(), label, rows, len(queries), time.perf_counter() - start)
+        return len(queries), result
+
+    def _measure_sizes(self, function, grow, sizes, label):
+        counts, result = {}, None
+        for size in sizes:
+            grow(size)
+            counts[size], result = self.count_queries(function, label, size)
+        if len(set(counts.values())) > 1:
+            detail = ", ".join(f"{size} rows: {count} queries" for size, count in counts.items())
+            self.fail(f"The number of queries grows with the number of rows ({detail})")
+        return counts[sizes[0]], result
+
+    def assertQueriesConstant(self, function, grow, sizes=(1, 3, 10), label=None):
+        """
+        Call `grow(n)` to have n rows, then `function()`, for each of the sizes.
+
+        Fails if the query count differs between sizes; returns the count.
+        `function` is usually a request to a list endpoint.
+        """
+        return self._measure_sizes(function, grow, sizes, label)[0]
+
+    def assertQueryBudget(self, function, grow, budget, sizes=(1, 3, 10), label=None):
+        """
+        assertQueriesConstant() with at most `budget` queries.
+
+        Returns the result of the last call (the largest size).
+        """
+        queries, result = self._measure_sizes(function, grow, sizes, label)
+        if queries > budget:
+            self.fail(f"{label or 'The call'} runs {queries} queries, the budget is {budget}")
+        return result
+
+    @contextmanager
+    def assertMaxQueries(self, budget, label=None):
+        """Fail if the block runs more than `budget` queries."""
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            yield queries
+        record(self.id(), label, None, len(queries), time.perf_counter() - start)
+        if len(queries) > budget:
+            statements = "\n".join(query["sql"] for query in queries.captured_queries)
+            self.fail(f"{len(queries)} queries run, the budget is {budget}:\n{statements}")